@@ -3,44 +3,104 @@ import streamlit as st
 from dotenv import load_dotenv
 import os
 import uuid
-import urllib.parse
-import json
 from datetime import datetime, timedelta, timezone
 #from botocore.exceptions import NoCredentialsError
 
 
 import sys
 
-# Add the root directory to sys.path
-sys.path.append(os.path.abspath(os.path.join(os.getcwd(), '..')))
-from utils.backend import classify_sentiment, extract_issue_summary, detect_urgency
-from utils.f_calendar import create_calendar_event
+# Add the root directory to sys.path (once: the script runs again on every rerun)
+ROOT_DIR = os.path.abspath(os.path.join(os.getcwd(), '..'))
+if ROOT_DIR not in sys.path:
+    sys.path.append(ROOT_DIR)
+from utils.backend import triage_email, cache_stats
+from utils.jobs import submit_escalation, escalation_status, QUEUED, RUNNING, DONE, FAILED
+from utils.session_store import get_session_store
+from utils.rate_limiter import request_context
+from utils.providers import preload_provider, run_async
+from utils.results_store import get_results_store
 
 load_dotenv()
+# The model client is imported while the user types the first email
+preload_provider()
+
+# Seconds between checks of a background scheduling job
+ESCALATION_POLL_SECONDS = float(os.getenv("ESCALATION_POLL_SECONDS", "2"))
 
 # FRONTEND
 st.set_page_config(page_title = 'AI Support Agent Simulator', layout = "centered")
 st.title("AI Support Triage Agent")
 
+with st.sidebar:
+    stats = cache_stats()
+    st.caption(f"LLM cache: {stats['hits']} hits / {stats['misses']} misses (hit rate {stats['hit_rate']:.0%})")
+
 email_text = st.text_area("Paste Client Email")
 client_email = st.text_input("Client Email")
 
 if st.button("Analyze and Route"):
-    sentiment = classify_sentiment(email_text)
-    summary = extract_issue_summary(email_text)
-    urgency = detect_urgency(email_text)
-
-    st.write(f"**Sentiment:** {sentiment}")
-    st.write(f"**Urgency:** {urgency}")
-    st.write(f"**Issue Summary:** {summary}")
-
-    if sentiment["sentiment_identified"] in ["Angry", "Frustrated"] or urgency["urgency_identified"] in ["High", "Critical"]:
-        link = create_calendar_event(email_text, summary, urgency)
-        st.success("High priority issue detected. 15-min call scheduled.")
-        st.markdown(f"[Join Google Meet]({link})")
+    # Sentiment, summary and urgency are requested concurrently, queued fairly against other sessions
+    with request_context(call_type="triage", session=st.session_state.setdefault("client_id", uuid.uuid4().hex)):
+        triage = run_async(triage_email(email_text))
+    sentiment = triage["sentiment"]
+    summary = triage["summary"]
+    urgency = triage["urgency"]
+
+    results = get_results_store()
+    if sentiment.get("sentiment_identified") in ["Angry", "Frustrated"] or urgency.get("urgency_identified") in ["High", "Critical"]:
+        job_id = uuid.uuid4().hex
+        if results is not None:
+            # Queued for a background writer before the job exists, so the booking is recorded after the ticket
+            results.record_triage(job_id, triage, client_email, email_text, job_id=job_id)
+        # The call is booked by a background worker; this page only polls for the link
+        triage["escalation_job"] = submit_escalation(client_email, summary, urgency, job_id=job_id)
+    else:
+        # The chat page loads the email and summary from the session store, the link only carries the id
+        session_id = get_session_store().create_session({
+            "client_email": client_email,
+            # Cleaned email (no quoted history or signature), also used in the chat prompts
+            "email_text": triage["email"],
+            "summary": summary,
+            "urgency": urgency.get("urgency_identified")
+        })
+        triage["chat_link"] = f"/agent_chat?session_id={session_id}"
+        if results is not None:
+            # Queued for a background writer, the page does not wait for it
+            results.record_triage(session_id, triage, client_email, email_text, session_id=session_id)
+    # Kept in the session so the result stays on screen while the page polls
+    st.session_state["triage"] = triage
+
+triage = st.session_state.get("triage")
+if triage:
+    st.write(f"**Sentiment:** {triage['sentiment']}")
+    st.write(f"**Urgency:** {triage['urgency']}")
+    st.write(f"**Issue Summary:** {triage['summary']}")
+    saved = triage["preprocessing"]["tokens_saved"]
+    if saved:
+        st.caption(f"Quoted history, signature and markup removed: {saved} fewer tokens per model call")
+
+    if triage.get("escalation_job"):
+        job_id = triage["escalation_job"]
+        pending = escalation_status(job_id)[0] in (QUEUED, RUNNING)
+
+        # Only this panel reruns while the job is pending
+        @st.fragment(run_every=ESCALATION_POLL_SECONDS if pending else None)
+        def escalation_panel():
+            status, link, error = escalation_status(job_id)
+            if pending and status in (DONE, FAILED):
+                # Full rerun, which also stops the polling
+                st.rerun()
+            if status == DONE:
+                st.success("High priority issue detected. 15-min call scheduled.")
+                st.markdown(f"[Join Google Meet]({link})")
+            elif status == FAILED:
+                st.error(f"High priority issue detected, but the call could not be scheduled: {error}")
+            else:
+                st.warning("High priority issue detected. Scheduling a 15-min call…")
+                if error:
+                    st.caption(f"Retrying: {error}")
+
+        escalation_panel()
     else:
-        encoded_summary = urllib.parse.quote(json.dumps(summary))
-        encoded_email_text = urllib.parse.quote(email_text)
-        chat_link = f"/agent_chat?session_id={uuid.uuid4()}&email={client_email}&email_text={encoded_email_text}&summary_data={encoded_summary}"
         st.info("Client invited to clarify issue in chat")
-        st.markdown(f"[Continue to Chat Agent]({chat_link})")
+        st.markdown(f"[Continue to Chat Agent]({triage['chat_link']})")
@@ -0,0 +1,395 @@
+"""Multi-session load test of the Streamlit pages against mock model and calendar servers.
+
+Each virtual user goes through the pages the way a person does, driven by
+Streamlit's AppTest: it pastes an email on AI_FirstTier.py and clicks "Analyze
+and Route". When the email is routed to the chat, it opens pages/agent_chat.py
+with the session_id query parameter, accepts the privacy policy and answers
+questions until the chat ends. When it is escalated, it waits for the
+background job to book the call on the mock calendar. Users run concurrently
+in threads of one process, like the sessions of one app instance.
+
+For each number of users it reports:
+- rerun latency: wall time of a user action (widget change plus the reruns it triggers),
+- script time: wall time of a single run of a page script,
+- memory per session: growth of the process RSS per finished flow still held,
+- throughput: completed flows per second and model calls per flow.
+The saturation point is the first user count at which throughput grows less
+than 10% over the previous count, or the p95 rerun latency exceeds --slo.
+
+Usage:
+    python -m benchmarks.load_test [--users 1 2 4 8 16] [--flows 2] [--profile gpt-3.5] [--mix chat]
+                                   [--calendar-delay 0.1] [--slo 2.0] [--output load.json]
+
+With the recorded answers most emails are escalated; --mix chat keeps only the
+calm ones (Neutral/Stressed, Low/Medium), so every email goes through a full chat.
+
+The mock servers run in child processes, so their memory is not counted. The
+mock calendar always has free slots, so every level can book its calls. The
+response cache, local classifier and similar-ticket index are off, and the
+session, job and results stores are temporary files.
+"""
+import argparse
+import functools
+import gc
+import json
+import os
+import platform
+import resource
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from benchmarks.mock_server import PROFILES, RECORDINGS_PATH
+from benchmarks.run import CORPUS_PATH, load_corpus, start_mock_server, start_server_process, git_commit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TRIAGE_PAGE = os.path.join(ROOT, "AI_FirstTier.py")
+CHAT_PAGE = os.path.join(ROOT, "pages", "agent_chat.py")
+# Seconds an AppTest run may take before it counts as failed
+RUN_TIMEOUT = 120
+# Seconds a user waits for its escalation call to be booked
+BOOKING_TIMEOUT = 60
+# Throughput gain over the previous user count below which the instance is saturated
+SATURATION_GAIN = 1.10
+# Labels of the recorded answers kept by --mix chat
+CALM = {"sentiment_identified": {"Neutral", "Stressed"}, "urgency_identified": {"Low", "Medium"}}
+# The pages are run through this script, so every single script run is timed
+PAGE_SCRIPT = """
+from benchmarks.load_test import page_code, script_timer
+with script_timer():
+    exec(page_code({path!r}), {{"__name__": "__main__", "__file__": {path!r}}})
+"""
+
+_script_times = []
+_script_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=None)
+def page_code(path):
+    # Compiled once, as Streamlit caches the bytecode of its scripts
+    with open(path, encoding="utf-8") as f:
+        return compile(f.read(), path, "exec")
+
+
+@contextmanager
+def script_timer():
+    # st.rerun / st.stop end a run with an exception, which still counts as a run
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with _script_lock:
+            _script_times.append(elapsed)
+
+
+def take_script_times():
+    # The page scripts import this module by name, which is another module than __main__ under python -m
+    from benchmarks import load_test
+
+    with load_test._script_lock:
+        times = list(load_test._script_times)
+        load_test._script_times.clear()
+    return times
+
+
+@contextmanager
+def shared_runtime():
+    """One mock Streamlit runtime for every AppTest run while the load test lasts.
+
+    AppTest installs a mock runtime and patches the config for each run and
+    removes them when the run ends, which breaks the runs of other sessions in
+    flight. With the runtime and config patched here, the per-run ones are never
+    the only ones in place.
+    """
+    from unittest.mock import MagicMock, patch
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.testing.v1.util import patch_config_options
+
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    with patch.object(Runtime, "instance", classmethod(lambda cls: runtime)), \
+            patch.object(Runtime, "exists", classmethod(lambda cls: True)), \
+            patch_config_options({"global.appTest": True}):
+        yield
+
+
+def calm_recordings(path):
+    """Copy of a recordings file without the answers that escalate a ticket or end a chat; returns its path."""
+    with open(path, encoding="utf-8") as f:
+        recordings = json.load(f)
+    for name, answers in recordings.items():
+        if name != "text":
+            recordings[name] = [a for a in answers if all(a[key] in allowed for key, allowed in CALM.items() if key in a)]
+    fd, calm_path = tempfile.mkstemp(prefix="recordings_calm_", suffix=".json")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(recordings, f)
+    return calm_path
+
+
+def rss_kib():
+    """Current resident memory of this process (peak resident memory where /proc is missing)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def page_environment(workdir, base_url, calendar_port, users=1):
+    """Environment of the pages against the mock servers, with temporary stores in workdir."""
+    return {
+        "LLM_PROVIDER": "local",
+        "LLM_BASE_URL": base_url,
+        "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY") or "mock",
+        "CALENDAR_API_ROOT": f"http://127.0.0.1:{calendar_port}/",
+        "SESSION_STORE_URL": "sqlite:///" + os.path.join(workdir, "sessions.db"),
+        "JOBS_DB": os.path.join(workdir, "jobs.db"),
+        "RESULTS_DB": os.path.join(workdir, "results.db"),
+        "LLM_CACHE_SIZE": "0",
+        "LLM_CACHE_DB": "",
+        "LOCAL_CLASSIFIER_THRESHOLD": "2",
+        "SIMILAR_TICKET_INDEX": "",
+        "TRIAGE_LOG_PATH": "",
+        "LLM_POOL_SIZE": str(users * 3),
+        # Free/busy is read for every booking, as the calendar never fills up
+        "BUSY_INDEX_TTL": "0",
+    }
+
+
+class VirtualUser:
+    """One user's browser sessions; flows are run one after the other."""
+
+    def __init__(self, user, corpus, think, max_answers):
+        self.user = user
+        self.corpus = corpus
+        self.think = think
+        self.max_answers = max_answers
+        self.reruns = []
+        self.sessions = []
+
+    def _page(self, path):
+        from streamlit.testing.v1 import AppTest
+
+        page = AppTest.from_string(PAGE_SCRIPT.format(path=path), default_timeout=RUN_TIMEOUT)
+        self.sessions.append(page)
+        return page
+
+    def _run(self, page):
+        if self.think:
+            time.sleep(self.think)
+        start = time.perf_counter()
+        page.run()
+        self.reruns.append(time.perf_counter() - start)
+        if page.exception:
+            raise RuntimeError(page.exception[0].message)
+
+    @staticmethod
+    def _button(page, label):
+        return next(button for button in page.button if button.label == label)
+
+    def flow(self, n):
+        """One email from triage to chat hand-off or booked call; returns the flow's outcome."""
+        from utils.jobs import escalation_status, DONE, FAILED
+
+        emails = self.corpus["emails"]
+        conversations = self.corpus["conversations"]
+        email = emails[(self.user + n) % len(emails)]
+        answers = [turn["answer"] for turn in conversations[(self.user + n) % len(conversations)]["turns"]]
+
+        triage_page = self._page(TRIAGE_PAGE)
+        self._run(triage_page)
+        triage_page.text_area[0].input(email)
+        triage_page.text_input[0].input(f"user{self.user}@example.com")
+        self._button(triage_page, "Analyze and Route").click()
+        self._run(triage_page)
+        triage = triage_page.session_state["triage"]
+
+        outcome = {"answers": 0, "booking_s": None, "booked": None}
+        job_id = triage.get("escalation_job")
+        if triage.get("chat_link"):
+            outcome["route"] = "chat"
+            chat_page = self._page(CHAT_PAGE)
+            chat_page.query_params["session_id"] = triage["chat_link"].split("session_id=", 1)[1]
+            self._run(chat_page)
+            self._button(chat_page, "Accept and Continue").click()
+            self._run(chat_page)
+            while chat_page.text_input and outcome["answers"] < self.max_answers:
+                chat_page.text_input[0].input(answers[outcome["answers"] % len(answers)])
+                self._button(chat_page, "Submit Answer").click()
+                self._run(chat_page)
+                outcome["answers"] += 1
+            job_id = chat_page.session_state["meeting_job"]
+        else:
+            outcome["route"] = "escalation"
+
+        if job_id:
+            # The call is booked by a background worker; the page would poll for it
+            outcome["booked"] = False
+            start = time.perf_counter()
+            while time.perf_counter() - start < BOOKING_TIMEOUT:
+                status = escalation_status(job_id)[0]
+                if status in (DONE, FAILED):
+                    outcome["booking_s"] = time.perf_counter() - start
+                    outcome["booked"] = status == DONE
+                    break
+                time.sleep(0.1)
+        return outcome
+
+
+def run_level(users, flows, corpus, think, max_answers):
+    from utils.providers import add_usage_listener, remove_usage_listener
+    from utils.telemetry import percentile
+
+    calls = []
+    listener = lambda _provider, usage: calls.append(1)
+    virtual_users = [VirtualUser(user, corpus, think, max_answers) for user in range(users)]
+    errors = []
+
+    def run_user(user):
+        outcomes = []
+        for n in range(flows):
+            try:
+                outcomes.append(user.flow(n))
+            except Exception as e:
+                errors.append(f"{type(e).__name__}: {e}")
+        return outcomes
+
+    gc.collect()
+    take_script_times()
+    rss_before = rss_kib()
+    add_usage_listener(listener)
+    try:
+        with ThreadPoolExecutor(max_workers=users) as pool:
+            wall_start = time.perf_counter()
+            outcomes = [o for user_outcomes in pool.map(run_user, virtual_users) for o in user_outcomes]
+            wall = time.perf_counter() - wall_start
+    finally:
+        remove_usage_listener(listener)
+    gc.collect()
+    # Measured while every user's sessions are still held, as the server holds them until they expire
+    rss_after = rss_kib()
+    scripts = take_script_times()
+    reruns = [t for user in virtual_users for t in user.reruns]
+    bookings = [o["booking_s"] for o in outcomes if o["booked"]]
+
+    def ms(values):
+        if not values:
+            return None
+        return {name: round(percentile(values, q) * 1000, 1) for name, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))}
+
+    return {
+        "users": users,
+        "flows": len(outcomes),
+        "errors": len(errors),
+        "error_samples": sorted(set(errors))[:5],
+        "wall_s": round(wall, 3),
+        "flows_per_s": round(len(outcomes) / wall, 3),
+        "chats": sum(o["route"] == "chat" for o in outcomes),
+        "escalations": sum(o["route"] == "escalation" for o in outcomes),
+        "answers_per_chat": round(sum(o["answers"] for o in outcomes) / max(1, sum(o["route"] == "chat" for o in outcomes)), 2),
+        "model_calls_per_flow": round(len(calls) / len(outcomes), 2) if outcomes else None,
+        "rerun_ms": ms(reruns),
+        "script_ms": ms(scripts),
+        "script_runs_per_rerun": round(len(scripts) / len(reruns), 2) if reruns else None,
+        "booking_ms": ms(bookings),
+        # Failed, or not booked within BOOKING_TIMEOUT
+        "bookings_failed": sum(o["booked"] is False for o in outcomes),
+        "memory_per_session_kib": round((rss_after - rss_before) / len(outcomes), 1) if outcomes else None,
+    }
+
+
+def saturation_point(levels, slo):
+    """First user count that no longer scales, or None."""
+    previous = None
+    for level in levels:
+        if level["rerun_ms"] and level["rerun_ms"]["p95"] > slo * 1000:
+            return level["users"]
+        if previous and level["flows_per_s"] < previous["flows_per_s"] * SATURATION_GAIN:
+            return level["users"]
+        previous = level
+    return None
+
+
+def print_report(results):
+    print(f"{'users':>6}{'flows/s':>9}{'rerun p50':>11}{'rerun p95':>11}{'script p95':>12}"
+          f"{'calls/flow':>12}{'KiB/session':>13}{'errors':>8}{'not booked':>12}")
+    for r in results["levels"]:
+        print(f"{r['users']:>6}{r['flows_per_s']:>9}{r['rerun_ms']['p50']:>11}{r['rerun_ms']['p95']:>11}"
+              f"{r['script_ms']['p95']:>12}{str(r['model_calls_per_flow']):>12}"
+              f"{str(r['memory_per_session_kib']):>13}{r['errors']:>8}{r['bookings_failed']:>12}")
+        for error in r["error_samples"]:
+            print(f"       {error}")
+    saturation = results["saturation_users"]
+    print(f"Saturation: {saturation} concurrent users" if saturation
+          else "Saturation: not reached; try more users")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the Streamlit pages with concurrent simulated users.")
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 2, 4, 8, 16], help="Concurrent users per level")
+    parser.add_argument("--flows", type=int, default=2, help="Emails each user goes through per level")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="gpt-3.5", help="Mock model latency profile")
+    parser.add_argument("--recordings", default=RECORDINGS_PATH)
+    parser.add_argument("--mix", choices=["recorded", "chat"], default="recorded",
+                        help="recorded: escalations and chats as recorded; chat: every email goes to the chat")
+    parser.add_argument("--corpus", default=CORPUS_PATH)
+    parser.add_argument("--calendar-delay", type=float, default=0.1, help="Seconds every mock calendar call takes")
+    parser.add_argument("--think", type=float, default=0.0, help="Seconds a user waits before each action")
+    parser.add_argument("--max-answers", type=int, default=10, help="Answers a user gives before leaving a chat")
+    parser.add_argument("--slo", type=float, default=2.0, help="p95 rerun latency (seconds) counted as saturated")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="load_test_")
+    recordings = calm_recordings(args.recordings) if args.mix == "chat" else args.recordings
+    model, base_url = start_mock_server(args.profile, recordings)
+    calendar, calendar_port = start_server_process("benchmarks.mock_calendar", "--delay", str(args.calendar_delay),
+                                                   "--free")
+    # Set before the pages import utils, since the modules read their configuration at import time
+    os.environ.update(page_environment(workdir, base_url, calendar_port, max(args.users)))
+    # f_calendar uses anonymous credentials when there is no token.pkl in the working directory
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        corpus = load_corpus(args.corpus)
+        with shared_runtime():
+            # One flow first, so imports and connection pools are not counted in the first level
+            VirtualUser(0, corpus, 0.0, args.max_answers).flow(0)
+            levels = [run_level(users, args.flows, corpus, args.think, args.max_answers) for users in args.users]
+    finally:
+        os.chdir(cwd)
+        for process in (model, calendar):
+            process.terminate()
+            process.wait()
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "profile": args.profile,
+            "mix": args.mix,
+            "calendar_delay": args.calendar_delay,
+            "flows_per_user": args.flows,
+            "think_s": args.think,
+            "slo_s": args.slo,
+        },
+        "levels": levels,
+        "saturation_users": saturation_point(levels, args.slo),
+    }
+    print_report(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
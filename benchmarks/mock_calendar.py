@@ -0,0 +1,150 @@
+"""Local mock of the Google Calendar API for offline runs and load tests.
+
+Serves the calls utils/f_calendar.py makes: freeBusy queries, event inserts
+(also inside a batch request), and event reads. Events are kept in memory;
+a client-chosen event id that already exists gets a 409, like the real API.
+Every call waits --delay seconds first. With --free, free/busy queries never
+report the booked events, like a pool of agents that always has someone free,
+so long runs do not run out of slots.
+
+Usage:
+    python -m benchmarks.mock_calendar [--port 8001] [--delay 0.1] [--free]
+
+Point the app at it with CALENDAR_API_ROOT=http://127.0.0.1:8001/. Without a
+token.pkl in the working directory, anonymous credentials are used.
+"""
+import argparse
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+EVENTS_PATH = "/calendar/v3/calendars/primary/events"
+
+
+class MockCalendarServer:
+    """Threaded HTTP server; start() returns the root URL to use as CALENDAR_API_ROOT."""
+
+    def __init__(self, port=0, delay=0.0, free=False):
+        self.delay = delay
+        self.free = free
+        self.events = {}
+        self.requests = 0
+        self.batch_sizes = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+
+    @property
+    def root_url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}/"
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, name="mock-calendar", daemon=True).start()
+        return self.root_url
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def insert(self, event):
+        """(status, body) of an event insert."""
+        event = dict(event)
+        with self._lock:
+            if event.get("id") in self.events:
+                return 409, {"error": {"code": 409, "message": "The requested identifier already exists."}}
+            event["id"] = event.get("id") or uuid.uuid4().hex
+            event["htmlLink"] = f"{self.root_url}event?eid={event['id']}"
+            self.events[event["id"]] = event
+        return 200, event
+
+    def busy(self):
+        if self.free:
+            return []
+        with self._lock:
+            return [{"start": e["start"]["dateTime"], "end": e["end"]["dateTime"]} for e in self.events.values()]
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body, content_type="application/json"):
+                data = (body if isinstance(body, str) else json.dumps(body)).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _wait(self):
+                with server._lock:
+                    server.requests += 1
+                time.sleep(server.delay)
+
+            def do_GET(self):
+                self._wait()
+                match = re.match(EVENTS_PATH + r"/([^/?]+)", self.path)
+                with server._lock:
+                    event = server.events.get(match.group(1)) if match else None
+                if event is None:
+                    self._send(404, {"error": {"code": 404, "message": "Not Found"}})
+                else:
+                    self._send(200, event)
+
+            def do_POST(self):
+                raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                self._wait()
+                if self.path.startswith("/calendar/v3/freeBusy"):
+                    self._send(200, {"calendars": {"primary": {"busy": server.busy()}}})
+                elif self.path.startswith(EVENTS_PATH):
+                    self._send(*server.insert(json.loads(raw)))
+                elif self.path.startswith("/batch"):
+                    self._batch(raw.decode("utf-8"))
+                else:
+                    self._send(404, {"error": {"code": 404, "message": "Not Found"}})
+
+            def _batch(self, raw):
+                # multipart/mixed of inserts; each response part refers to its request's Content-ID
+                boundary = re.search(r'boundary="?([^";]+)', self.headers["Content-Type"]).group(1)
+                parts = []
+                for part in raw.split("--" + boundary):
+                    content_id = re.search(r"Content-ID: <(.+?)>", part)
+                    if not content_id:
+                        continue
+                    status, body = server.insert(json.loads(part[part.index("{"):part.rindex("}") + 1]))
+                    parts.append(f"--batch_response\r\nContent-Type: application/http\r\n"
+                                 f"Content-ID: <response-{content_id.group(1)}>\r\n\r\n"
+                                 f"HTTP/1.1 {status} {'OK' if status == 200 else 'Conflict'}\r\n"
+                                 f"Content-Type: application/json\r\n\r\n{json.dumps(body)}\r\n")
+                with server._lock:
+                    server.batch_sizes.append(len(parts))
+                self._send(200, "".join(parts) + "--batch_response--\r\n", "multipart/mixed; boundary=batch_response")
+
+        return Handler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a minimal in-memory Google Calendar API.")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--delay", type=float, default=0.1, help="Seconds every call waits")
+    parser.add_argument("--free", action="store_true", help="Report no busy times, whatever was booked")
+    args = parser.parse_args(argv)
+
+    server = MockCalendarServer(args.port, args.delay, args.free)
+    print(f"Mock calendar on {server.root_url}")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""Local OpenAI-compatible stand-in for the model API.
+
+Answers /v1/chat/completions (plain, tools / function calling, JSON mode and
+streaming) with recorded responses, after a delay taken from a latency
+profile: time to first token plus completion tokens / token rate.
+
+Usage:
+    python -m benchmarks.mock_server [--port 8000] [--profile gpt-3.5] [--recordings FILE]
+
+then run the app or the benchmarks with LLM_PROVIDER=local LLM_BASE_URL=http://localhost:8000/v1
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils.context import count_tokens
+
+RECORDINGS_PATH = os.path.join(os.path.dirname(__file__), "recordings.json")
+
+# ttft: seconds to the first token, tps: completion tokens per second (0 = no delay),
+# jitter: +/- fraction applied to the whole delay, error_rate: share of 429 answers
+PROFILES = {
+    "instant": {"ttft": 0.0, "tps": 0, "jitter": 0.0, "error_rate": 0.0},
+    "fast": {"ttft": 0.05, "tps": 200, "jitter": 0.1, "error_rate": 0.0},
+    "gpt-3.5": {"ttft": 0.35, "tps": 80, "jitter": 0.25, "error_rate": 0.0},
+    "slow": {"ttft": 1.0, "tps": 30, "jitter": 0.3, "error_rate": 0.0},
+    "flaky": {"ttft": 0.35, "tps": 80, "jitter": 0.25, "error_rate": 0.1},
+}
+
+
+def load_recordings(path=RECORDINGS_PATH):
+    """{schema name: [answer objects]} plus "text": [plain answers]."""
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _schema_name(body, prompt):
+    # tools mode names the function, json_object/prompt mode put the JSON schema (with its title) in the prompt
+    for tool in body.get("tools") or []:
+        return tool["function"]["name"]
+    marker = "matches this JSON schema:"
+    if marker in prompt:
+        try:
+            return json.loads(prompt.rsplit(marker, 1)[1]).get("title")
+        except json.JSONDecodeError:
+            return None
+    return None
+
+
+class MockModelServer:
+    """Threaded HTTP server; start() returns the base URL to use as LLM_BASE_URL."""
+
+    def __init__(self, port=0, profile="fast", recordings=None, seed=0):
+        self.profile = dict(PROFILES[profile]) if isinstance(profile, str) else dict(profile)
+        self.recordings = recordings or load_recordings()
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, name="mock-model", daemon=True).start()
+        return self.base_url
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def answer(self, body):
+        """(text, schema name) for a request; the same prompt always gets the same recording."""
+        prompt = body["messages"][-1]["content"]
+        name = _schema_name(body, prompt)
+        choices = self.recordings.get(name) or self.recordings["text"]
+        choice = choices[int(hashlib.sha256(prompt.encode("utf-8")).hexdigest(), 16) % len(choices)]
+        return (json.dumps(choice) if name in self.recordings else choice), name
+
+    def _draw(self):
+        with self._lock:
+            self.requests += 1
+            failed = self._random.random() < self.profile["error_rate"]
+            jitter = 1 + self._random.uniform(-self.profile["jitter"], self.profile["jitter"])
+        return failed, jitter
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are written separately; without this, delayed ACKs add ~40 ms per call
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, status, payload, headers=None):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                if not self.path.endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": "not found"}})
+                    return
+                failed, jitter = server._draw()
+                if failed:
+                    self._send_json(429, {"error": {"message": "rate limited (mock)", "type": "rate_limit"}},
+                                    {"retry-after": "0"})
+                    return
+
+                text, name = server.answer(body)
+                use_tool = bool(body.get("tools"))
+                usage = {"prompt_tokens": count_tokens(body["messages"][-1]["content"]),
+                         "completion_tokens": count_tokens(text)}
+                usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+                profile = server.profile
+                ttft = profile["ttft"] * jitter
+                per_token = jitter / profile["tps"] if profile["tps"] else 0.0
+
+                if body.get("stream"):
+                    self._stream(body, text, name, use_tool, usage, ttft, per_token)
+                    return
+                time.sleep(ttft + per_token * usage["completion_tokens"])
+                if use_tool:
+                    message = {"role": "assistant", "content": None, "tool_calls": [
+                        {"id": "call_0", "type": "function", "function": {"name": name, "arguments": text}}]}
+                else:
+                    message = {"role": "assistant", "content": text}
+                self._send_json(200, {
+                    "id": "chatcmpl-mock", "object": "chat.completion", "created": int(time.time()),
+                    "model": body["model"], "usage": usage,
+                    "choices": [{"index": 0, "finish_reason": "stop", "message": message}],
+                })
+
+            def _stream(self, body, text, name, use_tool, usage, ttft, per_token):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+
+                def chunk(delta=None, chunk_usage=None):
+                    payload = {"id": "chatcmpl-mock", "object": "chat.completion.chunk",
+                               "created": int(time.time()), "model": body["model"],
+                               "choices": [] if delta is None else [{"index": 0, "delta": delta, "finish_reason": None}]}
+                    if chunk_usage:
+                        payload["usage"] = chunk_usage
+                    self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+
+                time.sleep(ttft)
+                # ~4 characters per token
+                for i in range(0, len(text), 4):
+                    piece = text[i:i + 4]
+                    if use_tool:
+                        function = {"arguments": piece}
+                        if i == 0:
+                            function["name"] = name
+                        delta = {"tool_calls": [{"index": 0, "id": "call_0", "type": "function", "function": function}]}
+                    else:
+                        delta = {"content": piece}
+                    chunk(delta)
+                    time.sleep(per_token)
+                if (body.get("stream_options") or {}).get("include_usage"):
+                    chunk(chunk_usage=usage)
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+
+        return Handler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve recorded model responses on an OpenAI-compatible API.")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="gpt-3.5")
+    parser.add_argument("--recordings", default=RECORDINGS_PATH)
+    args = parser.parse_args(argv)
+
+    server = MockModelServer(args.port, args.profile, load_recordings(args.recordings))
+    print(f"Mock model server on {server.base_url} ({args.profile} profile)")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+"""Startup and rerun profile of the Streamlit pages against the mock servers.
+
+Cold start: each page is run once in a fresh interpreter under python -X
+importtime, after a blank Streamlit script has warmed Streamlit itself up. It
+reports the wall time of that first run and the modules the page imported
+(cumulative time of the top-level imports).
+
+Warm reruns: in this process, each page is run --reruns times without any input,
+which is what every widget change costs before the page does any work, and
+the script time of each run is compared with --target. The submits (triage of
+an email, chat answers) are timed too. The model calls they make are answered
+at once by the "instant" mock profile, so what is left is the page's own work.
+The first submit of each page is reported on its own: it also pays for the
+modules a process imports only once they are used (the model client when it
+was not preloaded yet, the dataframe checks of st.write_stream).
+With --cprofile, the functions that take most of the idle reruns are listed.
+
+Usage:
+    python -m benchmarks.profile_pages [--reruns 20] [--top 15] [--target 100] [--cprofile]
+                                       [--output profile.json]
+
+Every email is routed to the chat (the calm recordings of load_test --mix chat).
+"""
+import argparse
+import cProfile
+import json
+import os
+import platform
+import pstats
+import re
+import subprocess
+import sys
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from benchmarks.load_test import CHAT_PAGE, ROOT, TRIAGE_PAGE, calm_recordings, page_environment, take_script_times
+from benchmarks.mock_server import RECORDINGS_PATH
+from benchmarks.run import CORPUS_PATH, load_corpus, start_mock_server, start_server_process, git_commit
+
+# Seconds an AppTest run may take before it counts as failed
+RUN_TIMEOUT = 60
+# Pages are run through this script: every run is timed, and profiled while a profiler is set
+PAGE_SCRIPT = """
+from benchmarks.load_test import page_code, script_timer
+from benchmarks.profile_pages import profiled
+with script_timer(), profiled():
+    exec(page_code({path!r}), {{"__name__": "__main__", "__file__": {path!r}}})
+"""
+# First run of a page in a fresh interpreter; the marker separates Streamlit's imports from the page's
+COLD_SCRIPT = """
+import json, sys, time
+from streamlit.testing.v1 import AppTest
+AppTest.from_string("import streamlit as st\\nst.write('')").run()
+print("import time: page", file=sys.stderr, flush=True)
+page = AppTest.from_file({path!r}, default_timeout={timeout})
+page.query_params.update({query!r})
+start = time.perf_counter()
+page.run()
+print(json.dumps({{"first_run_ms": round((time.perf_counter() - start) * 1000, 1),
+                  "exception": page.exception[0].message if page.exception else None}}))
+"""
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+
+_profiler = None
+
+
+@contextmanager
+def profiled():
+    # Enabled in the script thread of the run, which is not the thread calling AppTest.run
+    profiler = _profiler
+    if profiler is None:
+        yield
+        return
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+
+
+def set_profiler(profiler):
+    # The page scripts import this module by name, which is another module than __main__ under python -m
+    from benchmarks import profile_pages
+
+    profile_pages._profiler = profiler
+
+
+def cold_start(path, query, workdir, top):
+    """First run of a page in a fresh interpreter: its wall time and the modules it imported."""
+    script = COLD_SCRIPT.format(path=path, timeout=RUN_TIMEOUT, query=query)
+    done = subprocess.run([sys.executable, "-X", "importtime", "-c", script], cwd=workdir,
+                          env={**os.environ, "PYTHONPATH": ROOT}, capture_output=True, text=True, timeout=RUN_TIMEOUT * 2)
+    if done.returncode:
+        raise RuntimeError(done.stderr.strip().splitlines()[-1])
+    imports = done.stderr.split("import time: page", 1)[1]
+    modules = [(name, int(cumulative) / 1000) for _self, cumulative, indent, name in IMPORT_LINE.findall(imports)
+               if not indent]
+    return {
+        **json.loads(done.stdout.strip().splitlines()[-1]),
+        "import_ms": round(sum(ms for _, ms in modules), 1),
+        "modules": len(modules),
+        "top_imports_ms": {name: round(ms, 1) for name, ms in sorted(modules, key=lambda m: -m[1])[:top]},
+    }
+
+
+def new_page(path):
+    from streamlit.testing.v1 import AppTest
+
+    return AppTest.from_string(PAGE_SCRIPT.format(path=path), default_timeout=RUN_TIMEOUT)
+
+
+def run(page):
+    page.run()
+    if page.exception:
+        raise RuntimeError(page.exception[0].message)
+
+
+def button(page, label):
+    return next(b for b in page.button if b.label == label)
+
+
+def ms(values):
+    from utils.telemetry import percentile
+
+    if not values:
+        return None
+    return {name: round(percentile(values, q) * 1000, 1) for name, q in (("p50", 0.5), ("p95", 0.95), ("max", 1.0))}
+
+
+def idle_reruns(page, reruns, profiler):
+    take_script_times()
+    set_profiler(profiler)
+    try:
+        for _ in range(reruns):
+            run(page)
+    finally:
+        set_profiler(None)
+    return take_script_times()
+
+
+def warm_reruns(corpus, reruns, submits, profiler):
+    """Script times of idle reruns and of submits on both pages, in ms percentiles, plus the first submits."""
+    emails = corpus["emails"]
+    answers = [turn["answer"] for c in corpus["conversations"] for turn in c["turns"]]
+    times = {"triage_idle": [], "triage_submit": [], "chat_idle": [], "chat_answer": []}
+    first = {}
+    chat_link = None
+    for n in range(submits):
+        triage = new_page(TRIAGE_PAGE)
+        run(triage)
+        times["triage_idle"] += idle_reruns(triage, reruns if n == 0 else 0, profiler)
+        triage.text_area[0].input(emails[n % len(emails)])
+        triage.text_input[0].input(f"profile{n}@example.com")
+        button(triage, "Analyze and Route").click()
+        run(triage)
+        submit = take_script_times()
+        if n == 0:
+            first["triage_submit"] = round(sum(submit) * 1000, 1)
+        else:
+            times["triage_submit"] += submit
+        chat_link = triage.session_state["triage"].get("chat_link") or chat_link
+
+    if chat_link is None:
+        raise RuntimeError("No email was routed to the chat")
+    chat = new_page(CHAT_PAGE)
+    chat.query_params["session_id"] = chat_link.split("session_id=", 1)[1]
+    run(chat)
+    button(chat, "Accept and Continue").click()
+    run(chat)
+    times["chat_idle"] = idle_reruns(chat, reruns, profiler)
+    for n, answer in enumerate(answers[:submits]):
+        if not chat.text_input:
+            break
+        chat.text_input[0].input(answer)
+        button(chat, "Submit Answer").click()
+        run(chat)
+        submit = take_script_times()
+        if n == 0:
+            first["chat_answer"] = round(sum(submit) * 1000, 1)
+        else:
+            times["chat_answer"] += submit
+    return {name: ms(values) for name, values in times.items()}, first, chat_link
+
+
+def top_functions(profiler, top):
+    """(function, calls, cumulative ms) of the functions with the most cumulative time."""
+    stats = pstats.Stats(profiler)
+    rows = sorted(stats.stats.items(), key=lambda item: -item[1][3])
+    return [{"function": f"{os.path.relpath(filename, ROOT) if filename.startswith(ROOT) else filename}:{line}({name})",
+             "calls": calls, "cumulative_ms": round(cumulative * 1000, 1)}
+            for (filename, line, name), (_cc, calls, _tt, cumulative, _callers) in rows[:top]]
+
+
+def print_report(results):
+    target = results["meta"]["target_ms"]
+    for page, cold in results["cold_start"].items():
+        print(f"{page}: first run {cold['first_run_ms']} ms, of which imports {cold['import_ms']} ms "
+              f"({cold['modules']} top-level modules)")
+        for name, import_ms in cold["top_imports_ms"].items():
+            print(f"    {import_ms:>9} ms  {name}")
+    print(f"{'script runs':<16}{'p50 ms':>9}{'p95 ms':>9}{'max ms':>9}")
+    for name, values in results["warm"].items():
+        if values:
+            flag = "" if values["p95"] <= target else f"  over {target} ms"
+            print(f"{name:<16}{values['p50']:>9}{values['p95']:>9}{values['max']:>9}{flag}")
+    for name, first_ms in results["first_submit_ms"].items():
+        print(f"first {name}: {first_ms} ms")
+    for row in results.get("top_functions", []):
+        print(f"{row['cumulative_ms']:>9} ms {row['calls']:>7}x  {row['function']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Profile the startup and reruns of the Streamlit pages.")
+    parser.add_argument("--reruns", type=int, default=20, help="Idle reruns timed per page")
+    parser.add_argument("--submits", type=int, default=10, help="Emails triaged and chat answers given")
+    parser.add_argument("--top", type=int, default=15, help="Imports and functions listed")
+    parser.add_argument("--target", type=float, default=100, help="p95 script time (ms) a rerun should stay under")
+    parser.add_argument("--cprofile", action="store_true", help="List the functions taking most of the idle reruns")
+    parser.add_argument("--recordings", default=RECORDINGS_PATH)
+    parser.add_argument("--corpus", default=CORPUS_PATH)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="profile_pages_")
+    model, base_url = start_mock_server("instant", calm_recordings(args.recordings))
+    calendar, calendar_port = start_server_process("benchmarks.mock_calendar", "--delay", "0", "--free")
+    os.environ.update(page_environment(workdir, base_url, calendar_port))
+    profiler = cProfile.Profile() if args.cprofile else None
+    # f_calendar uses anonymous credentials when there is no token.pkl in the working directory
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        warm, first, chat_link = warm_reruns(load_corpus(args.corpus), args.reruns, args.submits, profiler)
+        session_id = chat_link.split("session_id=", 1)[1]
+        cold = {
+            "triage": cold_start(TRIAGE_PAGE, {}, workdir, args.top),
+            "chat": cold_start(CHAT_PAGE, {"session_id": session_id}, workdir, args.top),
+        }
+    finally:
+        os.chdir(cwd)
+        for process in (model, calendar):
+            process.terminate()
+            process.wait()
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "reruns": args.reruns,
+            "submits": args.submits,
+            "target_ms": args.target,
+        },
+        "cold_start": cold,
+        "warm": warm,
+        "first_submit_ms": first,
+    }
+    if profiler is not None:
+        results["top_functions"] = top_functions(profiler, args.top)
+    print_report(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""In-memory stand-in for a Redis server, for running several app replicas locally.
+
+Implements the commands the session store uses (GET, SET [EX|PX], DEL, EXISTS,
+EXPIRE, TTL, PING, SELECT, AUTH, FLUSHDB, and WATCH/MULTI/EXEC transactions)
+over the Redis protocol. Data is lost when it stops.
+
+Usage:
+    python -m benchmarks.resp_server [--port 6379]
+
+then start the app with SESSION_STORE_URL=redis://localhost:6379/0
+"""
+import argparse
+import socketserver
+import threading
+import time
+
+
+# EXEC reply when a watched key changed
+NIL_ARRAY = object()
+
+
+class RespStandIn(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, port=0):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.data = {}       # key -> (value bytes, expires at or None)
+        self.versions = {}   # key -> writes so far, for WATCH
+        self.flushes = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"redis://127.0.0.1:{self.server_address[1]}/0"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="resp-stand-in", daemon=True).start()
+        return self.url
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def _live(self, key):
+        entry = self.data.get(key)
+        if entry is not None and entry[1] is not None and entry[1] < time.time():
+            del self.data[key]
+            return None
+        return entry
+
+    def version(self, key):
+        return self.flushes, self.versions.get(key, 0)
+
+    def _written(self, *keys):
+        for key in keys:
+            self.versions[key] = self.versions.get(key, 0) + 1
+
+    def execute(self, args):
+        with self.lock:
+            return self._execute(args)
+
+    def transaction(self, watched, queued):
+        """EXEC: the queued commands' replies, or None when a watched key was written since WATCH."""
+        with self.lock:
+            if any(self.version(key) != version for key, version in watched.items()):
+                return None
+            return [self._execute(args) for args in queued]
+
+    def _execute(self, args):
+        command = args[0].upper()
+        if command in (b"PING", b"SELECT", b"AUTH", b"CLIENT"):
+            return "+PONG" if command == b"PING" else "+OK"
+        if command == b"GET":
+            entry = self._live(args[1])
+            return None if entry is None else entry[0]
+        if command == b"SET":
+            expires = None
+            options = [a.upper() for a in args[3:]]
+            if b"EX" in options:
+                expires = time.time() + int(args[3 + options.index(b"EX") + 1])
+            if b"PX" in options:
+                expires = time.time() + int(args[3 + options.index(b"PX") + 1]) / 1000
+            self.data[args[1]] = (args[2], expires)
+            self._written(args[1])
+            return "+OK"
+        if command == b"DEL":
+            self._written(*args[1:])
+            return sum(self.data.pop(key, None) is not None for key in args[1:])
+        if command == b"EXISTS":
+            return sum(self._live(key) is not None for key in args[1:])
+        if command == b"EXPIRE":
+            entry = self._live(args[1])
+            if entry is None:
+                return 0
+            self.data[args[1]] = (entry[0], time.time() + int(args[2]))
+            self._written(args[1])
+            return 1
+        if command == b"TTL":
+            entry = self._live(args[1])
+            if entry is None:
+                return -2
+            return -1 if entry[1] is None else int(entry[1] - time.time())
+        if command == b"FLUSHDB":
+            self.data.clear()
+            self.flushes += 1
+            return "+OK"
+        return f"-ERR unknown command '{command.decode(errors='replace')}'"
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    disable_nagle_algorithm = True
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            # Inline command, e.g. typed into telnet
+            return line.split()
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def _reply(self, args):
+        # Transactions are per connection: WATCH remembers key versions, MULTI queues until EXEC
+        command = args[0].upper()
+        if command == b"WATCH":
+            with self.server.lock:
+                self.watched.update((key, self.server.version(key)) for key in args[1:])
+            return "+OK"
+        if command == b"UNWATCH":
+            self.watched = {}
+            return "+OK"
+        if command == b"MULTI":
+            self.queued = []
+            return "+OK"
+        if command in (b"EXEC", b"DISCARD"):
+            if self.queued is None:
+                return f"-ERR {command.decode()} without MULTI"
+            queued, watched = self.queued, self.watched
+            self.queued, self.watched = None, {}
+            if command == b"DISCARD":
+                return "+OK"
+            replies = self.server.transaction(watched, queued)
+            return NIL_ARRAY if replies is None else replies
+        if self.queued is not None:
+            self.queued.append(args)
+            return "+QUEUED"
+        return self.server.execute(args)
+
+    def _encode(self, reply):
+        if reply is None:
+            return b"$-1\r\n"
+        if reply is NIL_ARRAY:
+            return b"*-1\r\n"
+        if isinstance(reply, int):
+            return b":%d\r\n" % reply
+        if isinstance(reply, bytes):
+            return b"$%d\r\n%s\r\n" % (len(reply), reply)
+        if isinstance(reply, list):
+            return b"*%d\r\n" % len(reply) + b"".join(self._encode(r) for r in reply)
+        return reply.encode() + b"\r\n"
+
+    def handle(self):
+        self.watched = {}
+        self.queued = None
+        while True:
+            args = self._read_command()
+            if args is None:
+                return
+            if not args:
+                continue
+            self.wfile.write(self._encode(self._reply(args)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="In-memory Redis-protocol stand-in.")
+    parser.add_argument("--port", type=int, default=6379)
+    args = parser.parse_args(argv)
+    server = RespStandIn(args.port)
+    print(f"Redis-protocol stand-in on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""Offline benchmark of the backend against the local mock model server.
+
+Runs classify_sentiment, extract_issue_summary, detect_urgency, start_chat and
+generate_next_question over the sample corpus (benchmarks/corpus.json) and
+reports throughput, latency percentiles, tokens and memory allocations per task.
+No API key or network access is needed: the model is benchmarks/mock_server.py,
+started in a separate process so its allocations are not counted.
+
+Usage:
+    python -m benchmarks.run [--profile fast] [--iterations 5] [--concurrency 4]
+                             [--output results.json] [--compare previous.json]
+
+The response cache, the local classifier and the similar-ticket index are turned
+off (use --cache / --local-classifier / --similar-tickets to include them), so
+every call reaches the model server.
+"""
+import argparse
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from benchmarks.mock_server import PROFILES, RECORDINGS_PATH
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), "corpus.json")
+TASKS = ["classify_sentiment", "extract_issue_summary", "detect_urgency", "start_chat", "generate_next_question"]
+
+
+def load_corpus(path=CORPUS_PATH):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def build_workload(task, corpus):
+    """List of argument tuples for one pass of a task over the corpus."""
+    from utils.context import ConversationContext
+
+    emails = corpus["emails"]
+    if task == "start_chat":
+        return [(email, []) for email in emails]
+    if task == "generate_next_question":
+        return [({"email": emails[conv["email"]], "questions": [], "previous": conv["turns"],
+                  "conversation": ConversationContext()},) for conv in corpus["conversations"]]
+    return [(email,) for email in emails]
+
+
+def start_server_process(module, *args):
+    """Run `python -m module --port PORT *args` in a child process; returns (process, port) once it accepts connections."""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    process = subprocess.Popen([sys.executable, "-m", module, "--port", str(port), *args], stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return process, port
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError(f"{module} did not start")
+
+
+def start_mock_server(profile, recordings):
+    """Mock server in a child process; returns (process, base_url) once it accepts connections."""
+    process, port = start_server_process("benchmarks.mock_server", "--profile", profile, "--recordings", recordings)
+    return process, f"http://127.0.0.1:{port}/v1"
+
+
+def measure_allocations(fn, workload, samples):
+    """Peak traced memory per call and memory still held after the calls (KiB)."""
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        peaks = []
+        for args in workload[:samples]:
+            tracemalloc.reset_peak()
+            start, _ = tracemalloc.get_traced_memory()
+            fn(*args)
+            _, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - start)
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "peak_kib_per_call": round(max(peaks) / 1024, 1),
+        "mean_peak_kib_per_call": round(sum(peaks) / len(peaks) / 1024, 1),
+        "retained_kib": round((after - before) / 1024, 1),
+    }
+
+
+def run_task(task, fn, workload, iterations, concurrency, alloc_samples):
+    from utils.providers import add_usage_listener, remove_usage_listener
+    from utils.telemetry import percentile
+
+    usage = {"model_calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
+    usage_lock = threading.Lock()
+
+    def on_usage(provider, call_usage):
+        with usage_lock:
+            usage["model_calls"] += 1
+            usage["prompt_tokens"] += call_usage.get("prompt_tokens") or 0
+            usage["completion_tokens"] += call_usage.get("completion_tokens") or 0
+
+    def timed(args):
+        start = time.perf_counter()
+        result = fn(*args)
+        failed = isinstance(result, dict) and "error" in result
+        return time.perf_counter() - start, failed
+
+    # One warm-up pass opens the connection pool and fills lazy caches
+    for args in workload[:1]:
+        fn(*args)
+
+    calls = workload * iterations
+    add_usage_listener(on_usage)
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            wall_start = time.perf_counter()
+            results = list(pool.map(timed, calls))
+            wall = time.perf_counter() - wall_start
+    finally:
+        remove_usage_listener(on_usage)
+
+    latencies = [latency for latency, _ in results]
+    report = {
+        "calls": len(calls),
+        # Fewer than calls when identical requests in flight were coalesced
+        "model_calls": usage["model_calls"],
+        "errors": sum(failed for _, failed in results),
+        "wall_s": round(wall, 3),
+        "throughput_per_s": round(len(calls) / wall, 2),
+        "latency_ms": {name: round(percentile(latencies, q) * 1000, 1)
+                       for name, q in (("p50", 0.5), ("p90", 0.9), ("p95", 0.95), ("p99", 0.99))},
+        "prompt_tokens_per_call": round(usage["prompt_tokens"] / len(calls), 1),
+        "completion_tokens_per_call": round(usage["completion_tokens"] / len(calls), 1),
+    }
+    report["latency_ms"]["mean"] = round(sum(latencies) / len(latencies) * 1000, 1)
+    report["latency_ms"]["max"] = round(max(latencies) * 1000, 1)
+    report["allocations"] = measure_allocations(fn, workload, alloc_samples)
+    return report
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(results, baseline=None):
+    header = f"{'task':<24}{'calls/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'tok in':>8}{'tok out':>8}{'peak KiB':>10}"
+    print(header)
+    for task, r in results["tasks"].items():
+        line = (f"{task:<24}{r['throughput_per_s']:>9}{r['latency_ms']['p50']:>9}{r['latency_ms']['p95']:>9}"
+                f"{r['latency_ms']['p99']:>9}{r['prompt_tokens_per_call']:>8}{r['completion_tokens_per_call']:>8}"
+                f"{r['allocations']['peak_kib_per_call']:>10}")
+        old = (baseline or {}).get("tasks", {}).get(task)
+        if old:
+            def change(new, before):
+                return f"{(new - before) / before * 100:+.1f}%" if before else "n/a"
+            line += (f"   vs {baseline['meta'].get('commit')}: throughput {change(r['throughput_per_s'], old['throughput_per_s'])},"
+                     f" p95 {change(r['latency_ms']['p95'], old['latency_ms']['p95'])}")
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the backend against a local mock model server.")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="fast")
+    parser.add_argument("--iterations", type=int, default=5, help="Passes over the corpus per task")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--tasks", nargs="+", choices=TASKS, default=TASKS)
+    parser.add_argument("--corpus", default=CORPUS_PATH)
+    parser.add_argument("--recordings", default=RECORDINGS_PATH)
+    parser.add_argument("--server-url", help="Use an already running server instead of starting the mock")
+    parser.add_argument("--alloc-samples", type=int, default=3, help="Calls per task traced for allocations")
+    parser.add_argument("--cache", action="store_true", help="Keep the LLM response cache on")
+    parser.add_argument("--local-classifier", action="store_true", help="Let the local classifier answer")
+    parser.add_argument("--similar-tickets", action="store_true",
+                        help="Reuse summaries of near-duplicate emails (starting from an empty index)")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", help="Earlier results file to compare with")
+    args = parser.parse_args(argv)
+
+    # Set before utils is imported, since the modules read their configuration at import time
+    if not args.cache:
+        os.environ["LLM_CACHE_SIZE"] = "0"
+        os.environ["LLM_CACHE_DB"] = ""
+    if not args.local_classifier:
+        os.environ["LOCAL_CLASSIFIER_THRESHOLD"] = "2"
+    os.environ["SIMILAR_TICKET_INDEX"] = (
+        os.path.join(tempfile.mkdtemp(prefix="ticket_index_"), "index.jsonl") if args.similar_tickets else "")
+    os.environ["TRIAGE_LOG_PATH"] = ""
+
+    process = None
+    base_url = args.server_url
+    if base_url is None:
+        process, base_url = start_mock_server(args.profile, args.recordings)
+    try:
+        from utils import backend
+        from utils.providers import LocalHTTPProvider, set_provider
+
+        provider = LocalHTTPProvider(base_url=base_url, pool_size=max(args.concurrency, 1))
+        set_provider(provider)
+        corpus = load_corpus(args.corpus)
+
+        results = {
+            "meta": {
+                "commit": git_commit(),
+                "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "profile": args.profile if args.server_url is None else args.server_url,
+                "iterations": args.iterations,
+                "concurrency": args.concurrency,
+                "structured_mode": provider.structured_mode,
+                "cache": args.cache,
+                "local_classifier": args.local_classifier,
+                "similar_tickets": args.similar_tickets,
+            },
+            "tasks": {},
+        }
+        for task in args.tasks:
+            results["tasks"][task] = run_task(task, getattr(backend, task), build_workload(task, corpus),
+                                              args.iterations, args.concurrency, args.alloc_samples)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""Before/after benchmark of the compact structured-output schemas.
+
+Runs every triage task on a few sample emails twice: with the original
+prompts (JSON skeleton in the prompt, email echoed back, regex parsing) and
+with the compact schemas sent through native function calling / JSON mode.
+Reports completion tokens and latency per task.
+
+Usage:
+    python -m benchmarks.structured_outputs [--repeat 3] [--output results.json]
+
+The configured provider is used (LLM_PROVIDER / LLM_BASE_URL), so point it at
+a local mock server to run it offline. The response cache is bypassed.
+"""
+import argparse
+import json
+import re
+import statistics
+import time
+
+from langchain.prompts import PromptTemplate
+
+from utils import backend
+from utils.providers import get_provider, add_usage_listener, remove_usage_listener
+from utils.schemas import SentimentResult, IssueSummary, UrgencyResult, function_schema, parse_structured
+
+SAMPLE_EMAILS = [
+    "Hi, since this morning none of our team can log in to the dashboard. We get 'Error 500' after "
+    "entering the password. We tried Chrome and Firefox and cleared the cache. Our quarterly report "
+    "is due tomorrow, please help as soon as possible.",
+    "Hello, I would like to know how to change the billing address on our account. No rush, thanks!",
+    "This is the third time I am writing about the same sync problem. Files uploaded from the "
+    "desktop client never show up on mobile. Your last answer did not help at all and I am "
+    "seriously considering cancelling our subscription.",
+]
+
+# Prompts as they were before the compact schemas, kept here for comparison
+LEGACY_PROMPTS = {
+    "sentiment": PromptTemplate.from_template(
+        """
+    You are an empathetic customer service agent. 
+    Classify the following email sentiment as Neutral, Angry, Frustrated, or Stressed.
+    Return the output as a raw JSON string without markdown formatting or triple backticks in the following structure:
+     {{
+        "email_text": {email},
+        "reasoning": "Step-by-step reasoning for your conclusion",
+        "sentiment_identified": "Neutral" | "Angry" | "Frustrated" | "Stressed"
+        }}
+
+    Email to Review:
+        {email}
+    """),
+    "issue_summary": PromptTemplate.from_template(
+        """
+    You are a technical customer service agent. 
+    Summarize the following email to help identify the main issue.
+    Suggest 5 questions to get more information from the customer, so issue can be better identified.
+    Return the output as raw JSON string without markdown formatting or triple backticks in the following structure:
+     {{
+        "email_text": {email},
+        "summary": summary,
+        "reasoning": "Step-by-step reasoning for your questions",
+        "questions": [{{"Q1": question 1,
+                        "Q2": question 2,
+                        "Q3": question 3,
+                        "Q4": question 4,
+                        "Q5": question 5}}]
+        }}
+
+    Email to Review:
+        {email}
+    """),
+    "urgency": PromptTemplate.from_template(
+        """
+    You are a technical customer service agent. 
+    Based on this email, how urgent is the issue? Respond with one of the following levels: Low, Medium, High, Critical.
+    Return the output as raw JSON string without markdown formatting or triple backticks in the following structure:
+     {{
+        "email_text": {email},
+        "reasoning": "Step-by-step reasoning for your conclusion",
+        "urgency_identified": "Low" | "Medium" | "High" | "Critical"
+        }}
+
+    Email to Review:
+        {email}
+    """),
+}
+
+COMPACT = {
+    "sentiment": (backend.prompt_sentiment, SentimentResult),
+    "issue_summary": (backend.prompt_issue_extraction, IssueSummary),
+    "urgency": (backend.prompt_urgency, UrgencyResult),
+}
+
+
+def legacy_parse(text):
+    match = re.search(r'{.*}', text, re.DOTALL)
+    try:
+        return json.loads(match.group(0) if match else text)
+    except Exception:
+        return None
+
+
+def run_variant(variant, task, emails, repeat):
+    provider = get_provider()
+    usage = []
+    listener = lambda _provider, u: usage.append(u)
+    add_usage_listener(listener)
+    latencies, valid = [], 0
+    try:
+        for _ in range(repeat):
+            for email in emails:
+                start = time.perf_counter()
+                if variant == "legacy":
+                    text = provider.complete(LEGACY_PROMPTS[task].format(email=email))
+                    ok = legacy_parse(text) is not None
+                else:
+                    prompt_template, model_cls = COMPACT[task]
+                    text = provider.complete(prompt_template.format(email=email), schema=function_schema(model_cls))
+                    ok = "error" not in parse_structured(model_cls, text)
+                latencies.append(time.perf_counter() - start)
+                valid += ok
+    finally:
+        remove_usage_listener(listener)
+    calls = len(latencies)
+    return {
+        "calls": calls,
+        "valid_rate": round(valid / calls, 3),
+        "latency_p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "latency_mean_ms": round(statistics.mean(latencies) * 1000, 1),
+        "completion_tokens_mean": round(statistics.mean(u["completion_tokens"] for u in usage), 1) if usage else None,
+        "prompt_tokens_mean": round(statistics.mean(u["prompt_tokens"] for u in usage), 1) if usage else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare legacy prompts with the compact schemas.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for task in COMPACT:
+        results[task] = {variant: run_variant(variant, task, SAMPLE_EMAILS, args.repeat)
+                         for variant in ("legacy", "compact")}
+
+    print(f"{'task':<14}{'variant':<9}{'p50 ms':>9}{'compl. tok':>12}{'prompt tok':>12}{'valid':>7}")
+    for task, variants in results.items():
+        for variant, r in variants.items():
+            print(f"{task:<14}{variant:<9}{r['latency_p50_ms']:>9}{str(r['completion_tokens_mean']):>12}"
+                  f"{str(r['prompt_tokens_mean']):>12}{r['valid_rate']:>7}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
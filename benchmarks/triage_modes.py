@@ -0,0 +1,170 @@
+"""Quality and latency comparison of the separate and fused triage modes.
+
+Triages the same emails with the three separate calls (sentiment, issue
+summary, urgency, sent concurrently) and with the single fused call. It reports
+per-email latency, model calls and tokens, so the throughput under a given
+RPM/TPM limit can be compared. For quality it reports the share of valid
+answers and how often the two modes agree on sentiment and urgency. When the
+emails carry "sentiment" / "urgency" labels, it also reports each mode's
+accuracy against them.
+
+Usage:
+    python -m benchmarks.triage_modes [--input labelled.jsonl] [--repeat 3] [--output results.json]
+    python -m benchmarks.triage_modes --mock fast
+
+INPUT is a JSONL file with "email_text" (or "email") per line; the sample corpus
+is used without it. The configured provider is used (LLM_PROVIDER /
+LLM_BASE_URL); --mock PROFILE starts the local mock server instead. The response
+cache, local classifier and similar-ticket index are bypassed.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+from benchmarks.run import load_corpus
+from utils import backend
+from utils.providers import (get_provider, set_provider, create_provider, add_usage_listener, remove_usage_listener,
+                             run_async)
+from utils.schemas import SentimentResult, IssueSummary, UrgencyResult, TriageResult, function_schema, parse_structured
+from utils.telemetry import percentile
+
+SEPARATE = [
+    (backend.prompt_sentiment, SentimentResult),
+    (backend.prompt_issue_extraction, IssueSummary),
+    (backend.prompt_urgency, UrgencyResult),
+]
+
+
+def load_emails(path):
+    """[(email, {"sentiment": label, "urgency": label})] from a JSONL file, or the sample corpus."""
+    if not path:
+        return [(email, {}) for email in load_corpus()["emails"]]
+    emails = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            email = record.get("email_text") or record.get("email")
+            if email:
+                emails.append((email, {task: record.get(task) for task in ("sentiment", "urgency")
+                                       if isinstance(record.get(task), str)}))
+    return emails
+
+
+async def _ask(provider, prompt, model_cls):
+    return parse_structured(model_cls, await provider.acomplete(prompt, schema=function_schema(model_cls)))
+
+
+async def triage_separate(provider, email):
+    return await asyncio.gather(*[_ask(provider, template.format(email=email), model_cls)
+                                  for template, model_cls in SEPARATE])
+
+
+async def triage_fused(provider, email):
+    return backend.split_triage(await _ask(provider, backend.prompt_triage.format(email=email), TriageResult))
+
+
+def run_mode(mode, emails, repeat):
+    """Latency, tokens and answers of one mode; emails are triaged one after the other."""
+    provider = get_provider()
+    triage = triage_fused if mode == "fused" else triage_separate
+    usage = []
+    listener = lambda _provider, u: usage.append(u)
+    add_usage_listener(listener)
+    latencies, answers = [], []
+    try:
+        for _ in range(repeat):
+            for email, _labels in emails:
+                start = time.perf_counter()
+                answers.append(run_async(triage(provider, email)))
+                latencies.append(time.perf_counter() - start)
+    finally:
+        remove_usage_listener(listener)
+    triaged = len(latencies)
+    prompt_tokens = sum(u.get("prompt_tokens") or 0 for u in usage)
+    completion_tokens = sum(u.get("completion_tokens") or 0 for u in usage)
+    return {
+        "emails": triaged,
+        "calls_per_email": round(len(usage) / triaged, 2),
+        "latency_p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "latency_p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "prompt_tokens_per_email": round(prompt_tokens / triaged, 1),
+        "completion_tokens_per_email": round(completion_tokens / triaged, 1),
+        # Emails a 1,000 requests-per-minute / 1M tokens-per-minute budget gets through
+        "emails_per_1k_requests": round(1000 * triaged / len(usage), 1) if usage else None,
+        "emails_per_1m_tokens": round(1e6 * triaged / (prompt_tokens + completion_tokens), 1)
+        if prompt_tokens + completion_tokens else None,
+        "valid_rate": round(sum(all("error" not in a for a in answer) for answer in answers) / triaged, 3),
+        "questions_mean": round(statistics.mean(len(answer[1].get("questions") or []) for answer in answers), 2),
+    }, answers
+
+
+def _label(answer, task):
+    return answer.get(f"{task}_identified")
+
+
+def compare(emails, answers, repeat):
+    """Agreement between the modes and accuracy against the labels, per task."""
+    labels = [labels for _ in range(repeat) for _email, labels in emails]
+    report = {}
+    for i, task in ((0, "sentiment"), (2, "urgency")):
+        pairs = [(_label(s[i], task), _label(f[i], task)) for s, f in zip(answers["separate"], answers["fused"])]
+        report[task] = {"agreement": round(sum(a == b and a is not None for a, b in pairs) / len(pairs), 3)}
+        labelled = [(j, l[task]) for j, l in enumerate(labels) if l.get(task)]
+        for mode in answers:
+            report[task][f"{mode}_accuracy"] = round(
+                sum(_label(answers[mode][j][i], task) == label for j, label in labelled) / len(labelled), 3
+            ) if labelled else None
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the separate and fused triage modes.")
+    parser.add_argument("--input", help="JSONL with email_text and optional sentiment/urgency labels")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--mock", metavar="PROFILE", help="Run against the local mock server with this latency profile")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    emails = load_emails(args.input)
+    if not emails:
+        parser.error(f"No emails found in {args.input}")
+    server = None
+    if args.mock:
+        from benchmarks.mock_server import MockModelServer
+
+        server = MockModelServer(profile=args.mock)
+        set_provider(create_provider("local", base_url=server.start()))
+
+    try:
+        results, answers = {}, {}
+        for mode in backend.TRIAGE_MODES:
+            results[mode], answers[mode] = run_mode(mode, emails, args.repeat)
+        results["comparison"] = compare(emails, answers, args.repeat)
+    finally:
+        if server is not None:
+            server.stop()
+
+    print(f"{'mode':<10}{'calls':>7}{'p50 ms':>9}{'p95 ms':>9}{'prompt tok':>12}{'compl. tok':>12}"
+          f"{'per 1k req':>12}{'valid':>7}")
+    for mode in backend.TRIAGE_MODES:
+        r = results[mode]
+        print(f"{mode:<10}{r['calls_per_email']:>7}{r['latency_p50_ms']:>9}{r['latency_p95_ms']:>9}"
+              f"{r['prompt_tokens_per_email']:>12}{r['completion_tokens_per_email']:>12}"
+              f"{str(r['emails_per_1k_requests']):>12}{r['valid_rate']:>7}")
+    for task, r in results["comparison"].items():
+        accuracy = ", ".join(f"{key.split('_')[0]} accuracy {value}" for key, value in r.items()
+                             if key.endswith("accuracy") and value is not None)
+        print(f"{task}: modes agree on {r['agreement']:.0%}" + (f" ({accuracy})" if accuracy else ""))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,176 +1,122 @@
 import streamlit as st
-import json
+import os
 from datetime import datetime, timedelta, timezone
-import urllib.parse
-from typing import TypedDict
-from utils.backend import classify_sentiment, start_chat, generate_next_question
-from utils.f_calendar import create_calendar_event
-from langgraph.graph import StateGraph
-from langchain_core.runnables import RunnableLambda
+from utils.chat_graph import ChatState, get_chat_app, start_chat_node, next_question_context, take_pending_turn
+from utils.context import ConversationContext
+from utils.speculation import start_turn
+from utils.session_store import get_session_store
+from utils.jobs import escalation_status, DONE, FAILED
+from utils.rate_limiter import request_context
+from utils.resilience import deadline_after
+from utils.results_store import get_results_store
+from utils.sufficiency import CHAT_SUFFICIENCY, CHAT_SUFFICIENCY_THRESHOLD
+
+# Start classifying an answer as soon as the answer box changes (Enter / focus out)
+CHAT_PREGENERATE = os.getenv("CHAT_PREGENERATE", "0") == "1"
+# Seconds between checks of the background job booking the call
+ESCALATION_POLL_SECONDS = float(os.getenv("ESCALATION_POLL_SECONDS", "2"))
+# Seconds the model calls of one chat turn may take; late answers are replaced by degraded defaults
+CHAT_TURN_DEADLINE = float(os.getenv("CHAT_TURN_DEADLINE", "20"))
 
 # ==== Session Init ====
 for key, default in {
     "question_counter": 0,
     "interactions": [],
     "frustration_detected": False,
+    "sufficiency": 0.0,
     "finished": False,
     "chat_started": False,
     "privacy_accepted": False,
     "chat_input": "",
     "clear_input": False,
-    "meeting_link": ""
+    "meeting_link": "",
+    "meeting_job": "",
+    "conversation": None,
+    "pending_turn": None,
+    "session_id": None,
+    "session": {},
+    "restored_session": None
 }.items():
     if key not in st.session_state:
         st.session_state[key] = default
 
+# ==== Load Session ====
+# The link only carries session_id; email, summary and chat state are in the session store.
+# The session is read once per browser session, not on every rerun.
+store = get_session_store()
+session_id = st.query_params.get("session_id", "")
+if st.session_state["session_id"] != session_id:
+    session = store.load_session(session_id)
+    if session is None:
+        st.error("This chat link is invalid or has expired.")
+        st.stop()
+    st.session_state.update({
+        "session_id": session_id,
+        "session": session,
+        "privacy_accepted": session.get("privacy_accepted", False),
+        # Running summary of older turns, kept for the whole chat
+        "conversation": ConversationContext.from_dict(session.get("conversation") or {})
+    })
+
 # === Privacy Acceptance ===
 if not st.session_state["privacy_accepted"]:
     #st.title("AI Support Chat Agent")
     st.info("Before we begin, please accept our [Privacy Policy] (https://www.AI_first_tier.com/privacy_policy).")
     if st.button("Accept and Continue"):
         st.session_state["privacy_accepted"] = True
+        store.update_session(session_id, privacy_accepted=True)
 
     else:
         st.stop()
 
 # ==== Load Parameters ====
-query_params = st.query_params
-client_email = urllib.parse.unquote(query_params.get("email", ["{}"]))
-email_text = urllib.parse.unquote(query_params.get("email_text", [""]))
-summary_data = json.loads(urllib.parse.unquote(query_params.get("summary_data", ["{}"])))
+session = st.session_state["session"]
+client_email = session.get("client_email", "")
+email_text = session.get("email_text", "")
+summary_data = session.get("summary") or {}
+
+def chat_request():
+    # Model calls of this chat queue as interactive work of this session, ranked by the ticket urgency
+    return request_context(call_type="chat", session=session_id, urgency=session.get("urgency"))
 
 st.title("AI Support Chat Agent")
 st.markdown(f"**Client Email:** {client_email}")
 st.markdown(f"**Issue Summary:** {summary_data.get('summary', 'Not available')}")
 
-# ==== Define State ====
-class ChatState(TypedDict):
-    email: str
-    summary: dict
-    question_count: int
-    interactions: list
-    finished: bool
-    frustration_detected: bool
-    meeting_link: str
-
-# ==== Nodes ====
-def start_chat_node(state: ChatState) -> ChatState:
-    #print(f"Start Chat at {datetime.now()}")
-    if not state["interactions"]:
-        result = start_chat(state["email"], state["summary"].get('questions', {}))
-        first_q = result["interaction"]["Q1"]["question_asked"]
-        state["interactions"].append({"question": first_q, "answer": "", "sentiment": ""})
-        state["question_count"] += 1
-    return state
-
-
-
-def ask_next(state: ChatState) -> ChatState:
-    if state["finished"] == False:
-        print("ASK_NEXT")
-        context = {
-            "email": state["email"],
-            "questions": state["summary"].get("questions", {}),
-            "previous": state["interactions"]
-        }
-        q = generate_next_question(context)["question"]
-        state["interactions"].append({"question": q, "answer": "", "sentiment": ""})
-        state["question_count"] += 1
-    return state
-
-def wait_for_input(state: ChatState) -> ChatState:
-    #print("WAIT")
-    #Place holder to give control back to Streamlit
-    return state
-
-def record_response(state: ChatState) -> ChatState:
-    #print("RECORD RESPONSE")
-    user_input = st.session_state.get("chat_input", "").strip()
-    if user_input and state["interactions"]: #and not state["interactions"][-1]["answer"]:
-        for interaction in state["interactions"]:
-            if interaction["answer"]== "":
-                sentiment_data = classify_sentiment(user_input)
-                sentiment = sentiment_data.get("sentiment_identified", "Neutral")
-                interaction.update({
-                    "answer": user_input,
-                    "sentiment": sentiment
-                })
-                if sentiment in ["Frustrated", "Angry"]:
-                    state["frustration_detected"] = True
-                    state["finished"] = True
-                break
-    return state
-
-def check_completion(state: ChatState) -> ChatState:
-    print("CHECK COMPLETION")
-    print(state["question_count"])
-    print(state["frustration_detected"])
-    if state["frustration_detected"]:
-        print("Meeting because sentiment")
-        state["__branch__"] = "schedule"
-    elif state["question_count"] >= 10:
-        print("Meeting because question counts")
-        state["finished"] = True
-        state["__branch__"] = "schedule"
-    else:
-        print("Continue")
-        state["__branch__"] = "continue"
-        print(state["__branch__"])
-    return state
-
-def schedule_meeting(state: ChatState) -> ChatState:
-
-    print("SCHEDULE", state["frustration_detected"], state["finished"])
-    if state["frustration_detected"] in ["Frustrated", "Angry"] or state["finished"] == True:
-        urgency = {
-            "email_text": state["email"],
-            "reasoning": "Frustrated or completed all questions",
-            "urgency_identified": "High_Chat" if state["frustration_detected"] else "Medium_Chat"
-        }
-        link = create_calendar_event(client_email, state["summary"], urgency, state["interactions"])
-        state["meeting_link"] = link or ""
-        state["finished"] = True
-    return state
-
-def end_chat(state: ChatState) -> ChatState:
-    print("END")
-    st.success("Thank you for your responses. Our team will follow up.")
-    return state
-
 # ==== Graph ====
-graph = StateGraph(ChatState)
-
-ask_node = RunnableLambda(ask_next)
-record_node = RunnableLambda(record_response)
-check_node = RunnableLambda(check_completion)
-schedule_node = RunnableLambda(schedule_meeting)
-end_node = RunnableLambda(end_chat)
-wait_node = RunnableLambda(wait_for_input)
-
-graph.add_node("ask_next", ask_node)
-graph.add_node("wait_for_input", wait_node)
-graph.add_node("record_response", record_node)
-graph.add_node("check_completion", check_node)
-graph.add_node("schedule_meeting", schedule_node)
-graph.add_node("end_chat", end_node)
-
-graph.set_entry_point("record_response")
-#st.markdown("ENTRY POINT OK")
-
-graph.add_edge("record_response", "check_completion")
-
-
-graph.add_conditional_edges("check_completion", {
-    "continue": ask_node,
-    "schedule": schedule_node
-})
-#st.markdown("CONDITIONAL EDGE OK")
-graph.add_edge("ask_next", "wait_for_input")
-graph.add_edge("schedule_meeting", "end_chat")
-
-#st.markdown("END OK")
-
-app = graph.compile()
+# Nodes and state are in utils/chat_graph.py; the graph is compiled once per process
+def pregenerate_turn():
+    # on_change of the answer box: start classifying and generating before Submit is clicked
+    answer = st.session_state.get("chat_input", "").strip()
+    previous = take_pending_turn()
+    if previous is not None:
+        previous.cancel()
+    if answer and st.session_state.interactions:
+        answered = [dict(i) for i in st.session_state.interactions]
+        answered[-1].update({"answer": answer, "sentiment": ""})
+        with chat_request(), deadline_after(CHAT_TURN_DEADLINE):
+            st.session_state["pending_turn"] = start_turn(answer, next_question_context(answered))
+
+# Every run is checkpointed in the session store under the session id
+app = get_chat_app()
+graph_config = {"configurable": {"thread_id": session_id}}
+
+# ==== Restore ====
+# A chat started on another connection or app replica continues from its checkpoint
+if st.session_state["restored_session"] != session_id:
+    saved = app.get_state(graph_config).values
+    if saved:
+        st.session_state.update({
+            "question_counter": saved["question_count"],
+            "interactions": saved["interactions"],
+            "frustration_detected": saved["frustration_detected"],
+            "sufficiency": saved.get("sufficiency", 0.0),
+            "finished": saved["finished"],
+            "meeting_link": saved.get("meeting_link") or session.get("meeting_link", ""),
+            "meeting_job": saved.get("meeting_job", ""),
+            "chat_started": True
+        })
+    st.session_state["restored_session"] = session_id
 
 if not st.session_state.chat_started:
     
@@ -182,10 +128,14 @@ if not st.session_state.chat_started:
         interactions=st.session_state["interactions"],
         finished=st.session_state["finished"],
         frustration_detected=st.session_state["frustration_detected"],
-        meeting_link=""
+        sufficiency=st.session_state["sufficiency"],
+        meeting_link="",
+        meeting_job=""
     )
     
-    updated_state = start_chat_node(init_state)
+    with chat_request():
+        updated_state = start_chat_node(init_state)
+    app.update_state(graph_config, updated_state, as_node="wait_for_input")
 
     st.session_state.update({
         "question_counter": updated_state["question_count"],
@@ -213,7 +163,8 @@ if not st.session_state.finished:
                 del st.session_state["chat_input"]
             st.session_state["clear_input"] = False
 
-        st.text_input(f"Q{st.session_state.question_counter-1}: {latest['question']}", key="chat_input")
+        st.text_input(f"Q{st.session_state.question_counter-1}: {latest['question']}", key="chat_input",
+                      on_change=pregenerate_turn if CHAT_PREGENERATE else None)
 
     if st.button("Submit Answer"):
 
@@ -223,31 +174,70 @@ if not st.session_state.finished:
             question_count=st.session_state["question_counter"],
             interactions=st.session_state["interactions"],
             finished=st.session_state["finished"],
-            frustration_detected=st.session_state["frustration_detected"]
+            frustration_detected=st.session_state["frustration_detected"],
+            sufficiency=st.session_state["sufficiency"],
+            meeting_link=st.session_state["meeting_link"],
+            meeting_job=st.session_state["meeting_job"]
         )
 
-        result = app.invoke(state)
+        answered_before = sum(1 for i in state["interactions"] if i["answer"])
+        with chat_request(), deadline_after(CHAT_TURN_DEADLINE):
+            result = app.invoke(state, graph_config)
+        store.update_session(session_id, conversation=st.session_state["conversation"].to_dict())
+        results = get_results_store()
+        if results is not None:
+            # Transcript turns for the results dashboard
+            for turn, item in enumerate(result["interactions"]):
+                if item["answer"] and turn >= answered_before:
+                    results.record_turn(session_id, turn + 1, item["question"], item["answer"], item["sentiment"])
         # Update Streamlit state
         st.session_state.update({
-            "question_counter": state["question_count"],
-            "interactions": state["interactions"],
-            "frustration_detected": state["frustration_detected"],
-            "finished": state["finished"],
+            "question_counter": result["question_count"],
+            "interactions": result["interactions"],
+            "frustration_detected": result["frustration_detected"],
+            "sufficiency": result["sufficiency"],
+            "finished": result["finished"],
+            "meeting_link": result.get("meeting_link") or st.session_state["meeting_link"],
+            "meeting_job": result.get("meeting_job") or st.session_state["meeting_job"],
             #"chat_input": "",
             "clear_input": True
         })
         st.rerun()
 
 # Show meeting link if available
-
+meeting_pending = bool(st.session_state["meeting_job"]) and not st.session_state["meeting_link"]
+
+# Only this panel reruns while the call is being booked
+@st.fragment(run_every=ESCALATION_POLL_SECONDS if meeting_pending else None)
+def meeting_panel():
+    if not st.session_state["meeting_link"]:
+        status, link, error = escalation_status(st.session_state["meeting_job"])
+        if status == FAILED:
+            st.error(f"The call could not be scheduled: {error}")
+            return
+        if status != DONE:
+            st.info("Scheduling a 15-min call…")
+            return
+        st.session_state["meeting_link"] = link
+        store.update_session(session_id, meeting_link=link)
+        # Full rerun, which also stops the polling
+        st.rerun()
+    st.success("15-min call scheduled.")
+    st.markdown(f"[Join Google Meet]({st.session_state['meeting_link']})")
 
 # Show chat history
 st.markdown("### Chat History")
+if CHAT_SUFFICIENCY != "off" and st.session_state["sufficiency"]:
+    st.caption(f"Information collected: {st.session_state['sufficiency']:.0%} "
+               f"(hand-off at {CHAT_SUFFICIENCY_THRESHOLD:.0%})")
+prompt_tokens = st.session_state["conversation"].prompt_tokens
+if prompt_tokens:
+    st.caption(f"Prompt tokens per turn: {', '.join(str(t) for t in prompt_tokens)}")
 for i, item in enumerate(st.session_state.interactions):
     st.markdown(f"**Q{i+1}:** {item['question']}")
     st.markdown(f"**A:** {item['answer']}  \n*Sentiment:* {item['sentiment']}")
 
-    if i == 10 or item['sentiment'] in ["Frustrated", "Angry"]:
-        st.success("15-min call scheduled.")
-        st.markdown(f"[Join Google Meet]({st.session_state['meeting_link']})")
+    if st.session_state.finished and i == len(st.session_state.interactions) - 1 and (
+            st.session_state["meeting_job"] or st.session_state["meeting_link"]):
+        meeting_panel()
 
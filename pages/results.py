@@ -0,0 +1,76 @@
+import os
+import tempfile
+import time
+
+import pandas as pd
+import streamlit as st
+
+from utils.results_store import get_results_store, SLA_TARGETS
+
+# ==== Results dashboard ====
+# Reads the results store (RESULTS_DB); every query is filtered and limited in SQL.
+st.title("Triage Results")
+
+store = get_results_store()
+if store is None:
+    st.info("The results store is disabled (RESULTS_DB is empty).")
+    st.stop()
+
+with st.sidebar:
+    days = st.number_input("Last days", min_value=1, max_value=3650, value=7)
+    urgency = st.multiselect("Urgency", list(SLA_TARGETS))
+    sentiment = st.multiselect("Sentiment", ["Neutral", "Angry", "Frustrated", "Stressed"])
+    client_email = st.text_input("Client email").strip()
+    bucket = st.selectbox("Trend per", ["day", "hour", "week", "month"])
+
+filters = {
+    "since": time.time() - days * 86400,
+    "urgency": urgency or None,
+    "sentiment": sentiment or None,
+    "client_email": client_email or None,
+}
+
+by_urgency = store.counts("urgency", **filters)
+total = sum(row["tickets"] for row in by_urgency)
+if not total:
+    st.info("No tickets in this period. Analyze an email or run utils.batch_triage, then come back.")
+    st.stop()
+
+breaches = store.sla_breaches(limit=500, **filters)
+escalated = sum(row["tickets"] for row in store.counts("escalated", **filters) if row["escalated"])
+chats = store.chat_turn_stats(**filters)
+col1, col2, col3, col4 = st.columns(4)
+col1.metric("Tickets", total)
+col2.metric("Escalated", escalated)
+col3.metric("SLA breaches", len(breaches))
+col4.metric("Avg. chat turns", chats["avg_turns"] if chats["sessions"] else "–")
+
+st.markdown("### Tickets per urgency")
+trend = pd.DataFrame(store.counts("urgency", bucket, **filters))
+st.bar_chart(trend.pivot_table(index="period", columns="urgency", values="tickets", fill_value=0))
+
+st.markdown("### Tickets per sentiment")
+st.bar_chart(pd.DataFrame(store.counts("sentiment", **filters)).set_index("sentiment"))
+
+st.markdown("### Latest tickets")
+tickets = pd.DataFrame(store.query_tickets(limit=200, **filters))
+for column in ("created", "scheduled"):
+    tickets[column] = pd.to_datetime(tickets[column], unit="s", utc=True)
+st.dataframe(tickets, hide_index=True, use_container_width=True)
+
+if breaches:
+    with st.expander(f"SLA breaches (targets in seconds: {SLA_TARGETS})"):
+        st.dataframe(pd.DataFrame(breaches), hide_index=True, use_container_width=True)
+
+with st.expander("Chat transcript"):
+    session_ids = [s for s in tickets["session_id"].dropna().unique()]
+    selected = st.selectbox("Session", session_ids) if session_ids else None
+    if selected:
+        st.dataframe(pd.DataFrame(store.transcript(selected)), hide_index=True, use_container_width=True)
+
+if st.button("Prepare Parquet export"):
+    # Written in chunks to a temporary file, so large periods do not have to fit in memory
+    path = os.path.join(tempfile.mkdtemp(prefix="results_"), "tickets.parquet")
+    rows = store.export(path, **filters)
+    with open(path, "rb") as f:
+        st.download_button(f"Download {rows} tickets (Parquet)", f, file_name="tickets.parquet")
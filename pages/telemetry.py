@@ -0,0 +1,78 @@
+import json
+
+import pandas as pd
+import streamlit as st
+
+from utils.backend import cache_stats
+from utils.similar_tickets import index_stats
+from utils.rate_limiter import rate_limiter
+from utils.preprocess import preprocess_stats
+from utils.sufficiency import chat_stats
+from utils.resilience import resilience_stats
+from utils.telemetry import telemetry
+
+# ==== Telemetry dashboard ====
+# Figures are per process: every Streamlit session served by this server is included.
+st.title("Telemetry")
+st.caption("Latency, token spend and cache use of every model call, chat node and calendar call since the server started.")
+
+summary = telemetry.summary()
+if not summary:
+    st.info("No calls recorded yet. Analyze an email or answer a chat question, then come back.")
+    st.stop()
+
+df = pd.DataFrame(summary)
+kinds = sorted(df["kind"].unique())
+selected = st.multiselect("Show", kinds, default=kinds)
+df = df[df["kind"].isin(selected)]
+
+col1, col2, col3, col4 = st.columns(4)
+col1.metric("Calls", int(df["calls"].sum()))
+col2.metric("Tokens", int(df["prompt_tokens"].sum() + df["completion_tokens"].sum()))
+col3.metric("Cost (USD)", f"{df['cost_usd'].sum():.4f}")
+col4.metric("Errors", int(df["errors"].sum()))
+
+st.markdown("### Latency per task (ms)")
+st.bar_chart(df.set_index("task")[["p50_ms", "p95_ms"]], stack=False)
+
+st.markdown("### Token spend per task")
+st.bar_chart(df.set_index("task")[["prompt_tokens", "completion_tokens"]])
+
+st.markdown("### Details")
+st.dataframe(df, hide_index=True, use_container_width=True)
+
+with st.expander("Recent calls"):
+    st.dataframe(pd.DataFrame(telemetry.recent(200)[::-1]), hide_index=True, use_container_width=True)
+
+with st.expander("LLM response cache"):
+    st.json(cache_stats())
+
+with st.expander("Rate limiter"):
+    limiter = rate_limiter.stats()
+    st.caption("Priority class 0 is served first: urgency rank (Critical 0 .. Low 3) times 3, plus call rank "
+               "(chat 0, triage 1, batch 2).")
+    st.json({k: v for k, v in limiter.items() if k != "priorities"})
+    if limiter["priorities"]:
+        st.dataframe(pd.DataFrame(limiter["priorities"]), hide_index=True, use_container_width=True)
+
+with st.expander("Email preprocessing"):
+    st.json(preprocess_stats())
+
+with st.expander("Chat length"):
+    st.caption("Answered turns per finished chat, by why it ended (frustration, sufficient detail, question limit).")
+    st.json(chat_stats())
+
+with st.expander("Resilience"):
+    st.caption("Circuit breaker state and hedged requests. Degraded answers are counted as cache \"degraded\" above.")
+    st.json(resilience_stats())
+
+with st.expander("Similar-ticket index"):
+    st.json(index_stats())
+
+col1, col2, col3 = st.columns(3)
+col1.download_button("OpenMetrics", telemetry.openmetrics(), file_name="metrics.txt")
+col2.download_button("Recent calls (JSONL)", "\n".join(json.dumps(r) for r in telemetry.recent()),
+                     file_name="telemetry.jsonl")
+if col3.button("Reset"):
+    telemetry.reset()
+    st.rerun()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The tests import utils/ and benchmarks/ from the repository root, like the pages do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,72 @@
+import asyncio
+import json
+
+from utils import batch_triage
+from utils.batch_triage import RateLimitGate, load_completed, triage_record
+
+RECORD = {"id": "1", "email_text": "My invoice is wrong, please fix it.", "client_email": "a@example.com"}
+
+
+def run_record(monkeypatch, sentiment, summary, urgency):
+    async def answer(value):
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    monkeypatch.setattr(batch_triage, "classify_sentiment_async", lambda email: answer(sentiment))
+    monkeypatch.setattr(batch_triage, "extract_issue_summary_async", lambda email: answer(summary))
+    monkeypatch.setattr(batch_triage, "detect_urgency_async", lambda email: answer(urgency))
+    return asyncio.run(triage_record(RECORD, RateLimitGate(), max_retries=0, mode="separate"))
+
+
+def test_answers_are_a_success(monkeypatch):
+    result = run_record(monkeypatch, {"sentiment_identified": "Neutral"}, {"summary": "Invoice"},
+                        {"urgency_identified": "Low"})
+    assert result["error"] is None
+    assert result["urgency"] == {"urgency_identified": "Low"}
+
+
+def test_error_payloads_and_degraded_answers_are_failures(monkeypatch, tmp_path):
+    result = run_record(monkeypatch, {"error": "Invalid JSON"}, {"summary": "Invoice"},
+                        {"urgency_identified": "Medium", "degraded": True, "reasoning": "circuit open"})
+    assert result["sentiment"] is None and result["urgency"] is None
+    assert "Invalid JSON" in result["error"] and "Degraded" in result["error"]
+
+    output = tmp_path / "results.jsonl"
+    output.write_text(json.dumps(result) + "\n")
+    assert load_completed(str(output)) == set()
+
+
+def test_raised_errors_are_failures(monkeypatch):
+    result = run_record(monkeypatch, ValueError("boom"), {"summary": "Invoice"}, {"urgency_identified": "Low"})
+    assert result["sentiment"] is None
+    assert result["error"] == "ValueError: boom"
+
+
+def test_failing_items_do_not_stop_the_workers(monkeypatch, tmp_path):
+    source = tmp_path / "emails.jsonl"
+    source.write_text("".join(json.dumps({"id": str(i), "email_text": f"Email {i}"}) + "\n" for i in range(8)))
+    output = tmp_path / "results.jsonl"
+
+    async def triage(record, gate, max_retries, mode):
+        if record["id"] == "3":
+            raise RuntimeError("preprocessing broke")
+        return {"id": record["id"], "client_email": "", "email_text": record["email_text"],
+                "sentiment": {"sentiment_identified": "Neutral"}, "summary": {"summary": "Invoice"},
+                "urgency": {"urgency_identified": "Low"}, "tokens_saved": 1, "error": None}
+
+    class Store:
+        def record_triage(self, ticket_id, result, client_email, email_text, source):
+            if ticket_id == "5":
+                raise OSError("database is locked")
+
+    monkeypatch.setattr(batch_triage, "triage_record", triage)
+    monkeypatch.setattr(batch_triage, "get_results_store", lambda: Store())
+    # One worker and a two-item queue: the producer would hang if that worker died
+    counts = asyncio.run(asyncio.wait_for(batch_triage.run_batch(str(source), str(output), concurrency=1), 5))
+
+    assert counts == {"processed": 8, "skipped": 0, "failed": 2, "tokens_saved": 7}
+    errors = {record["id"]: record["error"] for record in map(json.loads, output.read_text().splitlines())}
+    assert errors["3"] == "RuntimeError: preprocessing broke"
+    assert errors["5"] == "Results store: OSError: database is locked"
+    assert load_completed(str(output)) == {"0", "1", "2", "4", "6", "7"}
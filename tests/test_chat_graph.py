@@ -0,0 +1,93 @@
+from typing import TypedDict
+
+import pytest
+import streamlit as st
+from langgraph.checkpoint.base import empty_checkpoint
+from langgraph.graph import StateGraph
+
+from utils import chat_graph, providers
+from utils.backend import DEGRADED_GREETING
+from utils.chat_graph import StoreCheckpointer
+from utils.providers import LLMProvider, ProviderError
+from utils.resilience import CircuitBreaker
+from utils.session_store import SQLiteSessionStore
+from utils.speculation import start_turn
+
+CONFIG = {"configurable": {"thread_id": "session1", "checkpoint_ns": ""}}
+
+
+def new_saver(tmp_path):
+    return StoreCheckpointer(SQLiteSessionStore(str(tmp_path / "sessions.db")))
+
+
+def test_put_get_tuple_and_put_writes_round_trip(tmp_path):
+    saver = new_saver(tmp_path)
+    checkpoint = empty_checkpoint()
+    checkpoint["channel_values"] = {"question_count": 2}
+    saved = saver.put(CONFIG, checkpoint, {"source": "loop", "step": 1}, {})
+    saver.put_writes(saved, [("interactions", [{"question": "Hi"}])], task_id="task1")
+    saver.put_writes(saved, [("finished", True)], task_id="task2")
+
+    loaded = saver.get_tuple(CONFIG)
+    assert loaded.config["configurable"]["checkpoint_id"] == checkpoint["id"]
+    assert loaded.checkpoint["channel_values"] == {"question_count": 2}
+    assert loaded.metadata["step"] == 1
+    assert loaded.pending_writes == [("task1", "interactions", [{"question": "Hi"}]), ("task2", "finished", True)]
+    assert [t.config for t in saver.list(CONFIG)] == [loaded.config]
+    assert saver.get_tuple({"configurable": {**CONFIG["configurable"], "checkpoint_id": "other"}}) is None
+
+
+def test_writes_of_a_replaced_checkpoint_are_dropped(tmp_path):
+    saver = new_saver(tmp_path)
+    first = saver.put(CONFIG, empty_checkpoint(), {"step": 1}, {})
+    second_checkpoint = empty_checkpoint()
+    saver.put(first, second_checkpoint, {"step": 2}, {})
+    saver.put_writes(first, [("finished", True)], task_id="late")
+
+    loaded = saver.get_tuple(CONFIG)
+    assert loaded.checkpoint["id"] == second_checkpoint["id"]
+    assert loaded.parent_config["configurable"]["checkpoint_id"] == first["configurable"]["checkpoint_id"]
+    assert loaded.pending_writes == []
+
+
+def test_another_replica_resumes_the_graph(tmp_path):
+    class State(TypedDict):
+        count: int
+
+    graph = StateGraph(State)
+    graph.add_node("increment", lambda state: {"count": state["count"] + 1})
+    graph.set_entry_point("increment")
+    graph.set_finish_point("increment")
+
+    graph.compile(checkpointer=new_saver(tmp_path)).invoke({"count": 1}, CONFIG)
+    replica = graph.compile(checkpointer=new_saver(tmp_path))
+    assert replica.get_state(CONFIG).values == {"count": 2}
+
+
+def test_empty_greeting_falls_back_to_the_degraded_one(monkeypatch):
+    monkeypatch.setattr(chat_graph, "start_chat", lambda email, questions: {"message": ""})
+    state = chat_graph.start_chat_node({"email": "Hi", "summary": {}, "interactions": [], "question_count": 1})
+    assert state["interactions"] == [{"question": DEGRADED_GREETING, "answer": "", "sentiment": ""}]
+    assert state["question_count"] == 2
+
+
+class FailingProvider(LLMProvider):
+    name = "failing"
+
+    def _complete_once(self, prompt, schema=None, **params):
+        raise ProviderError("Bad request", 400)
+
+
+@pytest.mark.parametrize("speculative", [True, False])
+def test_failed_question_falls_back_to_a_suggested_one(monkeypatch, speculative):
+    monkeypatch.setattr(providers, "_provider", FailingProvider("test", max_retries=0))
+    monkeypatch.setattr(providers, "breaker", CircuitBreaker(failures=0))
+    interactions = [{"question": "Hi", "answer": "Chrome", "sentiment": "Neutral"}]
+    context = {"email": "My login fails", "questions": ["Which browser do you use?", "Since when?"],
+               "previous": interactions, "conversation": None}
+    monkeypatch.setattr(chat_graph, "next_question_context", lambda interactions: context)
+    st.session_state["pending_turn"] = start_turn("Chrome", context) if speculative else None
+
+    state = chat_graph.ask_next({"finished": False, "interactions": list(interactions), "question_count": 2})
+    assert state["interactions"][-1]["question"] == "Which browser do you use?"
+    assert state["question_count"] == 3
@@ -0,0 +1,102 @@
+import functools
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from benchmarks.mock_calendar import MockCalendarServer
+from utils import f_calendar
+from utils.scheduler import BusyIndex
+
+
+class ExpiringCredentials:
+    refresh_token = "refresh"
+
+    def __init__(self, expires_in):
+        self.expiry = datetime.now(timezone.utc).replace(tzinfo=None) + expires_in
+        self.refreshes = []
+
+    def refresh(self, request):
+        self.refreshes.append(request)
+        self.expiry += timedelta(hours=1)
+
+
+def test_token_is_refreshed_outside_the_service_lock(monkeypatch):
+    credentials = ExpiringCredentials(timedelta(minutes=1))
+    monkeypatch.setattr(f_calendar, "_credentials", credentials)
+    monkeypatch.setattr(f_calendar, "_save_credentials", lambda credentials: None)
+    # Would deadlock if the refresh still needed _lock, held here as by a thread building the service
+    with f_calendar._lock:
+        assert f_calendar.get_credentials() is credentials
+    assert len(credentials.refreshes) == 1
+    assert f_calendar.get_credentials() is credentials
+    assert len(credentials.refreshes) == 1
+
+
+def test_calendar_calls_time_out_before_the_job_lease(monkeypatch):
+    from utils.jobs import JOB_LEASE
+
+    monkeypatch.setattr(f_calendar, "_credentials", ExpiringCredentials(timedelta(hours=1)))
+    monkeypatch.delattr(f_calendar._local, "http", raising=False)
+    http = f_calendar._authorized_http()
+    assert http.http.timeout == f_calendar.CALENDAR_TIMEOUT < JOB_LEASE
+
+
+@pytest.fixture
+def calendar(monkeypatch):
+    from google.auth.credentials import AnonymousCredentials
+
+    server = MockCalendarServer()
+    monkeypatch.setattr(f_calendar, "CALENDAR_API_ROOT", server.start())
+    monkeypatch.setattr(f_calendar, "_credentials", AnonymousCredentials())
+    monkeypatch.setattr(f_calendar, "_service", None)
+    monkeypatch.delattr(f_calendar._local, "http", raising=False)
+    index = BusyIndex(f_calendar.fetch_busy)
+    # A day of slots, so a batch of more than 50 calls fits
+    monkeypatch.setattr(index, "find_and_reserve", functools.partial(index.find_and_reserve, search_hours=24))
+    monkeypatch.setattr(f_calendar, "busy_index", index)
+    yield server
+    server.stop()
+
+
+def escalation(email, urgency="Medium", **extra):
+    return {"client_email": email, "summary": {"summary": "Login fails"}, "urgency": urgency, **extra}
+
+
+def test_batch_books_the_most_urgent_escalations_first(calendar):
+    urgencies = ["Low", "Medium", "Critical", "High_Chat", "High"]
+    results = f_calendar.create_calendar_events_batch([escalation(f"{u}@example.com", u) for u in urgencies])
+
+    assert all(result["link"] and result["error"] is None for result in results)
+    starts = {urgency: result["start"] for urgency, result in zip(urgencies, results)}
+    assert sorted(starts, key=starts.get) == ["Critical", "High", "High_Chat", "Medium", "Low"]
+    assert len(calendar.events) == 5
+    assert f_calendar.busy_index.stats()["reserved"] == 0
+
+
+def test_batch_is_split_into_chunks_of_fifty(calendar):
+    results = f_calendar.create_calendar_events_batch([escalation(f"user{i}@example.com") for i in range(51)])
+
+    assert calendar.batch_sizes == [f_calendar.MAX_BATCH_SIZE, 1]
+    assert all(result["link"] for result in results)
+    assert len({result["start"] for result in results}) == 51
+
+
+def test_conflict_on_one_item_keeps_the_rest_of_the_batch(calendar):
+    booked = f_calendar.create_calendar_events_batch([escalation("retry@example.com", event_id="job1")])[0]
+    free_before = f_calendar.busy_index.find_slot()
+
+    results = f_calendar.create_calendar_events_batch([
+        escalation("new@example.com", "Low"),
+        escalation("retry@example.com", "Critical", event_id="job1"),
+    ])
+
+    # The retried escalation gets a 409 and resolves to the event it already has
+    assert (results[1]["link"], results[1]["error"]) == (booked["link"], None)
+    # Events are stored to the second
+    assert datetime.fromisoformat(results[1]["start"]) == datetime.fromisoformat(booked["start"]).replace(microsecond=0)
+    assert results[0]["link"] and results[0]["error"] is None
+    assert len(calendar.events) == 2
+    # Being more urgent it held the first free slot for the batch, then gave it back
+    assert results[0]["start"] > free_before[0].isoformat()
+    assert f_calendar.busy_index.find_slot()[0] == free_before[0]
+    assert f_calendar.busy_index.stats()["reserved"] == 0
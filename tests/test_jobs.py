@@ -0,0 +1,81 @@
+import time
+
+from utils import jobs
+from utils.jobs import DONE, FAILED, QUEUED, RUNNING, JobQueue, RetryableJobError
+
+
+def new_queue(tmp_path, **kwargs):
+    return JobQueue(path=str(tmp_path / "jobs.db"), workers=1, **kwargs)
+
+
+def idle_queue(tmp_path, **kwargs):
+    # submit() does not start the workers: the test claims and runs the jobs itself
+    queue = new_queue(tmp_path, **kwargs)
+    queue.start = lambda: None
+    return queue
+
+
+def test_failures_are_retried_until_max_attempts(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "retry_delay", lambda attempts: 0)
+    queue = idle_queue(tmp_path, max_attempts=3)
+    queue.register("flaky", lambda payload, job_id: (_ for _ in ()).throw(RetryableJobError("No slot")))
+    job_id = queue.submit("flaky", {})
+    for attempt in (1, 2):
+        queue._run(*queue._claim())
+        job = queue.get(job_id)
+        assert (job["status"], job["attempts"], job["error"]) == (QUEUED, attempt, "No slot")
+    queue._run(*queue._claim())
+    assert queue.get(job_id)["status"] == FAILED
+    assert queue._claim() is None
+
+
+def test_expired_lease_is_reclaimed_and_counted(tmp_path):
+    queue = idle_queue(tmp_path, max_attempts=2, lease_seconds=0)
+    queue.register("crash", lambda payload, job_id: {"ok": True})
+    job_id = queue.submit("crash", {})
+
+    # The worker that claimed the job dies without finishing it
+    assert queue._claim()[3] == 1
+    time.sleep(0.01)
+    reclaimed = queue._claim()
+    assert (reclaimed[0], reclaimed[3]) == (job_id, 2)
+    assert queue.get(job_id)["status"] == RUNNING
+
+    # Its second run dies too: max_attempts is used up, so it fails instead of running again
+    time.sleep(0.01)
+    assert queue._claim() is None
+    job = queue.get(job_id)
+    assert (job["status"], job["attempts"]) == (FAILED, 2)
+    assert "Lease expired" in job["error"]
+
+
+def test_workers_run_submitted_jobs(tmp_path):
+    queue = new_queue(tmp_path)
+    queue.register("echo", lambda payload, job_id: {"echo": payload["text"]})
+    try:
+        job_id = queue.submit("echo", {"text": "hi"})
+        deadline = time.time() + 5
+        while queue.get(job_id)["status"] != DONE and time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        queue.stop()
+    assert queue.get(job_id)["result"] == {"echo": "hi"}
+
+
+def test_lease_is_renewed_while_the_handler_runs(tmp_path):
+    queue = idle_queue(tmp_path, lease_seconds=0.3)
+    reclaimed = []
+
+    def slow(payload, job_id):
+        # Outlives the lease several times over; another worker must not take the job meanwhile
+        for _ in range(4):
+            time.sleep(0.25)
+            reclaimed.append(queue._claim())
+        return {"ok": True}
+
+    queue.register("slow", slow)
+    job_id = queue.submit("slow", {})
+    queue._run(*queue._claim())
+    assert reclaimed == [None] * 4
+    job = queue.get(job_id)
+    assert (job["status"], job["attempts"]) == (DONE, 1)
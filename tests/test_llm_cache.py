@@ -0,0 +1,195 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from utils.llm_cache import LLMCache
+from utils.providers import DeadlineExceeded
+from utils.resilience import deadline_after
+
+
+def new_cache():
+    return LLMCache(max_entries=16, db_path="")
+
+
+def test_get_or_call_shares_one_call_and_its_error():
+    cache = new_cache()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def fail():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        raise ValueError("model down")
+
+    errors = []
+
+    def follower():
+        try:
+            cache.get_or_call("k", fail)
+        except ValueError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=follower)
+    leader.start()
+    started.wait(5)
+    other = threading.Thread(target=follower)
+    other.start()
+    deadline = time.monotonic() + 5
+    while cache.stats()["coalesced"] == 0 and time.monotonic() < deadline:
+        time.sleep(0.001)
+    release.set()
+    leader.join(5)
+    other.join(5)
+    assert len(calls) == 1
+    assert len(errors) == 2
+
+
+def test_aget_or_call_coalesces_and_caches():
+    cache = new_cache()
+    calls = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "answer"
+
+    async def main():
+        return await asyncio.gather(*(cache.aget_or_call("k", call) for _ in range(3)))
+
+    assert asyncio.run(main()) == ["answer"] * 3
+    assert len(calls) == 1
+    assert cache.get("k") == "answer"
+
+
+def test_aget_or_call_followers_get_the_leader_exception():
+    cache = new_cache()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("model down")
+
+    async def main():
+        return await asyncio.gather(*(cache.aget_or_call("k", fail) for _ in range(2)), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert [type(r) for r in results] == [ValueError, ValueError]
+
+
+def test_cancelled_leader_hands_the_call_to_a_follower():
+    cache = new_cache()
+    calls = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return f"answer {len(calls)}"
+
+    async def main():
+        leader = asyncio.create_task(cache.aget_or_call("k", call))
+        await asyncio.sleep(0.01)
+        followers = [asyncio.create_task(cache.aget_or_call("k", call)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await asyncio.gather(*followers)
+
+    # One follower makes the second call, the other follows it; neither sees the cancellation
+    assert asyncio.run(main()) == ["answer 2", "answer 2"]
+    assert len(calls) == 2
+
+
+def test_async_calls_use_the_sqlite_tier_from_a_thread(tmp_path, monkeypatch):
+    cache = LLMCache(db_path=str(tmp_path / "cache.db"))
+    threads = []
+    for name in ("_disk_get", "_disk_set"):
+        original = getattr(cache, name)
+
+        def traced(*args, original=original):
+            threads.append(threading.current_thread())
+            return original(*args)
+        monkeypatch.setattr(cache, name, traced)
+
+    async def call():
+        return "answer"
+
+    async def main():
+        first = await cache.aget_or_call("k", call)
+        cache._memory.clear()
+        return first, await cache.aget("k")
+
+    assert asyncio.run(main()) == ("answer", "answer")
+    assert threads and threading.main_thread() not in threads
+
+
+def test_leader_deadline_hands_the_call_to_a_follower():
+    cache = new_cache()
+    calls = []
+
+    async def call():
+        calls.append(1)
+        if len(calls) == 1:
+            await asyncio.sleep(0.01)
+            raise DeadlineExceeded("the leader's own deadline")
+        return "answer"
+
+    async def main():
+        return await asyncio.gather(cache.aget_or_call("k", call), cache.aget_or_call("k", call),
+                                    return_exceptions=True)
+
+    leader, follower = asyncio.run(main())
+    assert isinstance(leader, DeadlineExceeded)
+    assert follower == "answer" and len(calls) == 2
+
+
+def test_sync_leader_deadline_hands_the_call_to_a_follower():
+    cache = new_cache()
+    started = threading.Event()
+    results = []
+
+    def leader_call():
+        started.set()
+        time.sleep(0.05)
+        raise DeadlineExceeded("the leader's own deadline")
+
+    def run(fn):
+        try:
+            results.append(cache.get_or_call("k", fn))
+        except DeadlineExceeded as e:
+            results.append(e)
+
+    leader = threading.Thread(target=run, args=(leader_call,))
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=run, args=(lambda: "answer",))
+    follower.start()
+    leader.join(5)
+    follower.join(5)
+    assert [type(r) for r in results] == [DeadlineExceeded, str]
+    assert cache.get("k") == "answer"
+
+
+def test_sync_follower_waits_no_longer_than_its_deadline():
+    cache = new_cache()
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(5)
+        return "answer"
+
+    leader = threading.Thread(target=cache.get_or_call, args=("k", slow))
+    leader.start()
+    started.wait(5)
+    start = time.monotonic()
+    with deadline_after(0.05), pytest.raises(DeadlineExceeded):
+        cache.get_or_call("k", slow)
+    assert time.monotonic() - start < 1
+    release.set()
+    leader.join(5)
+    assert cache.get("k") == "answer"
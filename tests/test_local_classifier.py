@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from utils import local_classifier
+from utils.local_classifier import TfidfLogisticClassifier, predict_confident
+
+TEXTS = ["the site is down and I am furious", "this is unacceptable, I am furious about the outage",
+         "furious, the outage cost us money", "thanks, just a quick question about billing",
+         "a quick question about my invoice, thanks", "quick question: where is the billing page"] * 3
+LABELS = ["Angry", "Angry", "Angry", "Neutral", "Neutral", "Neutral"] * 3
+
+
+def test_fit_save_load_predict_round_trip(tmp_path):
+    model = TfidfLogisticClassifier().fit(TEXTS, LABELS)
+    assert model.predict("I am furious about the outage")[0] == "Angry"
+    assert model.predict("quick question about billing")[0] == "Neutral"
+
+    path = str(tmp_path / "sentiment_classifier.npz")
+    model.save(path)
+    loaded = TfidfLogisticClassifier.load(path)
+    assert loaded.labels == ["Angry", "Neutral"]
+    assert loaded.vocabulary == model.vocabulary
+    for text in ("I am furious about the outage", "quick question about billing", "unrelated words"):
+        assert np.allclose(loaded.predict_proba(text), model.predict_proba(text))
+
+
+def test_pickled_model_files_are_refused(tmp_path, monkeypatch, capsys):
+    path = tmp_path / "sentiment_classifier.npz"
+    np.savez(path, terms=np.array(["down"], dtype=object), idf=np.ones(1), labels=np.array(["Angry"], dtype=object),
+             weights=np.ones((1, 1)), bias=np.zeros(1))
+    with pytest.raises(ValueError):
+        TfidfLogisticClassifier.load(str(path))
+
+    monkeypatch.setattr(local_classifier, "model_path", lambda task: str(path))
+    monkeypatch.setattr(local_classifier, "_models", {})
+    assert predict_confident("sentiment", "the site is down") is None
+    assert "retrain" in capsys.readouterr().err
@@ -0,0 +1,48 @@
+from utils.preprocess import preprocess_email, strip_quoted, strip_signature
+
+CONTACT = "Jane Doe\nSupport Lead | Acme Inc.\nTel: +1 (555) 123-4567\njane@acme.com\nwww.acme.com"
+
+
+def test_sign_off_and_contact_block_are_cut():
+    text = f"Hi,\nThe nightly export stopped working.\nThanks!\n{CONTACT}"
+    assert strip_signature(text) == "Hi,\nThe nightly export stopped working."
+    assert strip_signature(f"The nightly export stopped working.\n--\n{CONTACT}") == "The nightly export stopped working."
+
+
+def test_text_after_a_sign_off_is_kept():
+    text = "Hi,\nThe nightly export stopped working.\nThanks!\nAlso, the error code is 500 and it happens every night.\nJane"
+    assert strip_signature(text) == text
+
+
+def test_stack_trace_after_a_delimiter_is_kept():
+    text = ("The import crashes on every file:\n--\nTraceback (most recent call last):\n"
+            '  File "import.py", line 12, in <module>\nValueError: invalid row 42')
+    assert strip_signature(text) == text
+
+
+def test_digit_heavy_lines_are_not_a_contact_block():
+    text = "The sync is stuck.\nThanks\nJob 8812-4471-0093 at 2024-05-01 03:00"
+    assert strip_signature(text) == text
+
+
+def test_preprocess_keeps_the_customer_text():
+    cleaned, report = preprocess_email("Hi,\nThe export fails.\nThanks!\nAlso, the error code is 500.\n\n"
+                                       "On Mon, 1 Jan 2024, Support <help@example.com> wrote:\n> How can we help?")
+    assert cleaned == "Hi,\nThe export fails.\nThanks!\nAlso, the error code is 500."
+    assert report["tokens_saved"] > 0
+
+
+def test_forward_with_a_note_keeps_the_forwarded_message():
+    text = ("Hi support, see below\n---------- Forwarded message ---------\nFrom: Jane Doe <jane@acme.com>\n"
+            "Date: Mon, 1 Jan 2024 at 09:12\nSubject: Outage\nTo: help@example.com\n\n"
+            "Our production API returns 503 on every call since 9:00.\n\n"
+            "On Sun, 31 Dec 2023, Support <help@example.com> wrote:\nHow can we help?")
+    kept = strip_quoted(text)
+    assert kept.startswith("Hi support, see below")
+    assert "Our production API returns 503 on every call since 9:00." in kept
+    assert "How can we help?" not in kept
+
+
+def test_reply_header_below_a_note_is_still_cut():
+    text = "The export is still failing.\nFrom: Support <help@example.com>\nSent: Monday\nSubject: Re: export\nOld text"
+    assert strip_quoted(text) == "The export is still failing."
@@ -0,0 +1,140 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from utils import providers
+from utils.providers import DeadlineExceeded, LLMProvider, OpenAICompatibleProvider, ProviderError, run_async
+from utils.resilience import deadline_after, remaining
+
+
+class TimedProvider(LLMProvider):
+    """Answers the n-th request after delays[n] seconds."""
+
+    def __init__(self, *delays):
+        super().__init__("test", max_retries=0)
+        self.delays = list(delays)
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _complete_once(self, prompt, schema=None, **params):
+        with self._lock:
+            n, self.calls = self.calls, self.calls + 1
+        time.sleep(self.delays[n])
+        return f"answer {n}", {}
+
+
+class FixedLatency:
+    def __init__(self, delay):
+        self.delay = delay
+        self.hedges = []
+
+    def hedge_delay(self, key):
+        return self.delay
+
+    def record(self, key, seconds):
+        pass
+
+    def record_hedge(self, won):
+        self.hedges.append(won)
+
+
+@pytest.fixture
+def hedging(monkeypatch):
+    def hedge_after(delay):
+        monkeypatch.setattr(providers, "latency", FixedLatency(delay))
+        return providers.latency
+
+    return hedge_after
+
+
+def test_run_async_keeps_one_async_client():
+    provider = OpenAICompatibleProvider(api_key="test", base_url="http://127.0.0.1:9/v1")
+
+    async def client():
+        return provider._async_client()
+
+    assert run_async(client()) is run_async(client())
+
+
+def test_run_async_carries_the_callers_context():
+    async def left():
+        return remaining()
+
+    assert run_async(left()) is None
+    with deadline_after(30):
+        assert 0 < run_async(left()) <= 30
+
+
+def test_slow_request_is_hedged(hedging):
+    latency = hedging(0.05)
+    assert TimedProvider(1.0, 0.0)._attempt("hi", None, {}, 0) == ("answer 1", {})
+    assert latency.hedges == [True]
+
+
+def test_hedge_delay_starts_when_the_request_is_sent(hedging, monkeypatch):
+    latency = hedging(0.2)
+    # A busy primary pool: the request waits 0.3 s for a thread, then answers in 0.1 s
+    pool = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(providers, "_primary_executor", pool)
+    pool.submit(time.sleep, 0.3)
+    provider = TimedProvider(0.1, 0.0)
+    assert provider._attempt("hi", None, {}, 0) == ("answer 0", {})
+    assert provider.calls == 1 and latency.hedges == []
+
+
+def test_no_hedge_while_the_hedge_pool_is_full(hedging, monkeypatch):
+    latency = hedging(0.01)
+    monkeypatch.setattr(providers, "_hedge_slots", threading.BoundedSemaphore(1))
+    providers._hedge_slots.acquire()
+    provider = TimedProvider(0.1, 0.0)
+    assert provider._attempt("hi", None, {}, 0) == ("answer 0", {})
+    assert provider.calls == 1 and latency.hedges == []
+
+
+def test_hedged_wait_is_bounded_without_a_deadline(hedging, monkeypatch):
+    hedging(0.05)
+    monkeypatch.setattr(providers, "LLM_CONNECT_TIMEOUT", 0.1)
+    monkeypatch.setattr(providers, "LLM_READ_TIMEOUT", 0.1)
+    start = time.monotonic()
+    with pytest.raises(ProviderError) as error:
+        TimedProvider(1.0, 1.0)._attempt("hi", None, {}, 0)
+    assert error.value.retryable and time.monotonic() - start < 0.5
+
+    with deadline_after(0.15), pytest.raises(DeadlineExceeded):
+        TimedProvider(1.0, 1.0)._attempt("hi", None, {}, 0)
+
+
+def test_triage_keeps_blocking_steps_off_the_shared_loop(monkeypatch):
+    from utils import backend
+
+    threads = {}
+
+    def blocking(name, value=None):
+        def step(*args):
+            threads[name] = threading.current_thread().name
+            return value
+        return step
+
+    async def answer(prompt, model_cls):
+        return {"summary": "Export fails", "questions": [], "reasoning": "",
+                "sentiment_identified": "Neutral", "sentiment_reasoning": "",
+                "urgency_identified": "Low", "urgency_reasoning": ""}
+
+    def preprocess(email):
+        threads["preprocess"] = threading.current_thread().name
+        return email, {}
+
+    monkeypatch.setattr(backend, "preprocess_email", preprocess)
+    monkeypatch.setattr(backend, "local_label", blocking("local_label"))
+    monkeypatch.setattr(backend, "similar_summary", blocking("similar_summary"))
+    monkeypatch.setattr(backend, "log_label", blocking("log_label"))
+    monkeypatch.setattr(backend, "remember", blocking("remember"))
+    monkeypatch.setattr(backend, "invoke_structured_async", answer)
+    for mode in ("separate", "fused"):
+        threads.clear()
+        result = run_async(backend.triage_email("The export fails.", mode=mode))
+        assert result["summary"]["summary"] == "Export fails"
+        assert set(threads) == {"preprocess", "local_label", "similar_summary", "log_label", "remember"}
+        assert "llm-loop" not in threads.values()
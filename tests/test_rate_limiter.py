@@ -0,0 +1,16 @@
+from utils.rate_limiter import current_request, priority_for, request_context
+
+
+def test_urgency_comes_before_call_type():
+    order = [("Critical", "batch"), ("High", "chat"), ("High", "triage"), ("Medium", "chat"), ("Low", "chat")]
+    priorities = [priority_for(urgency, call_type) for urgency, call_type in order]
+    assert priorities == sorted(priorities) and len(set(priorities)) == len(priorities)
+    assert priority_for() == priority_for("Medium", "triage")
+
+
+def test_request_context_is_reset_after_the_block():
+    with request_context(call_type="chat", session="s1", urgency="High"):
+        with request_context(urgency=None, session="s2"):
+            assert current_request() == {"call_type": "chat", "session": "s2", "urgency": "High"}
+        assert current_request()["session"] == "s1"
+    assert current_request() == {}
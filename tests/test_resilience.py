@@ -0,0 +1,49 @@
+import time
+
+from utils.resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, deadline_after, remaining
+
+
+def test_circuit_opens_probes_and_closes():
+    breaker = CircuitBreaker(failures=2, cooldown=0.05)
+    assert breaker.allow() == 0
+    breaker.record_failure()
+    assert breaker.state == CLOSED and breaker.allow() == 0
+    breaker.record_failure()
+    assert breaker.state == OPEN and breaker.trips == 1
+    assert breaker.allow() > 0 and breaker.rejected == 1
+
+    time.sleep(0.06)
+    assert breaker.allow() == 0
+    assert breaker.state == HALF_OPEN
+    # Only one probe goes out while half open
+    assert breaker.allow() > 0
+
+    breaker.record_success()
+    assert breaker.state == CLOSED and breaker.failures == 0
+    assert breaker.allow() == 0
+
+
+def test_failed_probe_opens_the_circuit_again():
+    breaker = CircuitBreaker(failures=1, cooldown=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow() == 0
+    breaker.record_failure()
+    assert breaker.state == OPEN and breaker.trips == 2
+    assert breaker.allow() > 0
+
+
+def test_disabled_breaker_never_opens():
+    breaker = CircuitBreaker(failures=0)
+    for _ in range(10):
+        breaker.record_failure()
+    assert breaker.state == CLOSED and breaker.allow() == 0
+
+
+def test_nested_deadlines_only_shorten():
+    with deadline_after(10):
+        with deadline_after(30):
+            assert remaining() <= 10
+        with deadline_after(1):
+            assert remaining() <= 1
+    assert remaining() is None
@@ -0,0 +1,120 @@
+import time
+
+import pytest
+
+from utils import results_store
+from utils.results_store import ResultsStore
+
+START = 1_760_000_000.0
+
+
+class Clock:
+    """Stands in for the time module in results_store; only time() is moved by the tests."""
+
+    def __init__(self):
+        self.now = START
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def perf_counter(self):
+        return time.perf_counter()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(results_store, "time", clock)
+    return clock
+
+
+def triage(urgency, sentiment="Neutral"):
+    return {"sentiment": {"sentiment_identified": sentiment}, "summary": {"summary": "Login fails"},
+            "urgency": {"urgency_identified": urgency} if urgency else None, "tokens_saved": 3}
+
+
+def escalate(store, clock, ticket_id, urgency, booked_after=None):
+    store.record_triage(ticket_id, triage(urgency), f"{ticket_id}@example.com", "Email text")
+    store.record_escalation(ticket_id, f"job-{ticket_id}")
+    if booked_after is not None:
+        clock.now += booked_after
+        store.record_scheduled(f"job-{ticket_id}", f"https://calendar/{ticket_id}")
+        clock.now -= booked_after
+
+
+def test_sla_breaches_per_urgency(tmp_path, clock):
+    store = ResultsStore(str(tmp_path / "results.db"))
+    escalate(store, clock, "critical-late", "Critical", booked_after=1200)
+    escalate(store, clock, "high-on-time", "High", booked_after=600)
+    escalate(store, clock, "medium-unbooked", "Medium")
+    escalate(store, clock, "low-unbooked", "Low")
+    escalate(store, clock, "chat-unbooked", "High_Chat")
+    escalate(store, clock, "unknown-unbooked", "Urgent")
+    escalate(store, clock, "no-urgency", None)
+    store.record_triage("not-escalated", triage("Critical"))
+    store.flush()
+
+    breached = {row["id"] for row in store.sla_breaches(now=START + 2 * 3600)}
+    # Low has a day; Medium and the unlisted urgencies get SLA_DEFAULT_TARGET (four hours)
+    assert breached == {"critical-late", "chat-unbooked"}
+    breached = {row["id"] for row in store.sla_breaches(now=START + 5 * 3600)}
+    assert breached == {"critical-late", "chat-unbooked", "medium-unbooked", "unknown-unbooked", "no-urgency"}
+    assert {row["id"] for row in store.sla_breaches(now=START + 5 * 3600, urgency="Critical")} == {"critical-late"}
+
+
+def test_sla_breaches_follow_configured_targets(tmp_path, clock, monkeypatch):
+    monkeypatch.setattr(results_store, "SLA_TARGETS", {"Low": 60, "Critical": 30})
+    monkeypatch.setattr(results_store, "SLA_DEFAULT_TARGET", 600.0)
+    store = ResultsStore(str(tmp_path / "results.db"))
+    escalate(store, clock, "critical", "Critical", booked_after=45)
+    escalate(store, clock, "low", "Low", booked_after=45)
+    escalate(store, clock, "high", "High", booked_after=45)
+    store.flush()
+    assert [row["id"] for row in store.sla_breaches(now=START + 3600)] == ["critical"]
+
+
+def test_before_pages_through_every_ticket_once(tmp_path, clock):
+    store = ResultsStore(str(tmp_path / "results.db"))
+    for i in range(7):
+        # Pairs of tickets share a timestamp, so pages must also order by id
+        clock.now = START + i // 2
+        store.record_triage(f"t{i}", triage("Low"))
+    store.flush()
+
+    pages, before = [], None
+    while True:
+        page = store.query_tickets(limit=3, before=before)
+        if not page:
+            break
+        pages.append([row["id"] for row in page])
+        before = (page[-1]["created"], page[-1]["id"])
+    assert pages == [["t6", "t5", "t4"], ["t3", "t2", "t1"], ["t0"]]
+    after_t5 = store.query_tickets(limit=10, before=(START + 2, "t5"))
+    assert [row["id"] for row in after_t5] == ["t4", "t3", "t2", "t1", "t0"]
+
+
+def test_parquet_export_round_trip(tmp_path, clock):
+    pq = pytest.importorskip("pyarrow.parquet")
+    store = ResultsStore(str(tmp_path / "results.db"))
+    escalate(store, clock, "a", "High", booked_after=90)
+    clock.now += 10
+    store.record_triage("b", triage("Low", "Negative"), "b@example.com", "Second email")
+    store.flush()
+
+    path = str(tmp_path / "tickets.parquet")
+    assert store.export(path, chunk_rows=1) == 2
+    table = pq.read_table(path)
+    assert table.column_names == results_store.TICKET_COLUMNS
+    rows = table.to_pylist()
+    assert [row["id"] for row in rows] == ["a", "b"]
+    assert [row["escalated"] for row in rows] == [True, False]
+    assert rows[0]["created"].timestamp() == START
+    assert rows[0]["scheduled"].timestamp() == START + 90
+    assert rows[1]["scheduled"] is None
+    assert (rows[1]["urgency"], rows[1]["sentiment"], rows[1]["email_text"]) == ("Low", "Negative", "Second email")
+
+    assert store.export(str(tmp_path / "low.parquet"), include_text=False, urgency="Low") == 1
+    assert "email_text" not in pq.read_table(str(tmp_path / "low.parquet")).column_names
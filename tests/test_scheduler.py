@@ -0,0 +1,102 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from utils.scheduler import BusyIndex
+
+NOW = datetime(2026, 3, 2, 9, 0, tzinfo=timezone.utc)
+
+
+def at(minutes):
+    return NOW + timedelta(minutes=minutes)
+
+
+class FakeCalendar:
+    """Busy list served by fetch_busy; tests edit it like other clients booking calls."""
+
+    def __init__(self, *busy, delay=0):
+        self.busy = list(busy)
+        self.delay = delay
+        self.fetches = 0
+
+    def fetch_busy(self, time_min, time_max):
+        self.fetches += 1
+        time.sleep(self.delay)
+        return [(start, end) for start, end in self.busy if end > time_min and start < time_max]
+
+
+def new_index(calendar):
+    return BusyIndex(calendar.fetch_busy, clock=lambda: NOW)
+
+
+def test_find_and_reserve_skips_busy_times_and_held_slots():
+    calendar = FakeCalendar((at(0), at(20)), (at(30), at(60)))
+    index = new_index(calendar)
+    first = index.find_and_reserve(duration_minutes=15)
+    # 20-30 is too short, so the first slot starts when the second meeting ends
+    assert (first.start, first.end) == (at(60), at(75))
+    second = index.find_and_reserve(duration_minutes=15)
+    assert (second.start, second.end) == (at(75), at(90))
+    assert index.find_slot(duration_minutes=15) == (at(90), at(105))
+    assert index.stats() == {"busy_intervals": 2, "reserved": 2, "refreshes": 1}
+
+
+def test_release_gives_the_slot_back_and_confirm_keeps_it():
+    index = new_index(FakeCalendar())
+    released = index.find_and_reserve()
+    index.release(released)
+    confirmed = index.find_and_reserve()
+    assert confirmed.start == released.start == at(5)
+    index.confirm(confirmed)
+    assert index.find_slot() == (at(20), at(35))
+    assert index.stats()["reserved"] == 0
+
+
+def test_window_full_returns_none():
+    index = new_index(FakeCalendar((at(0), at(120))))
+    assert index.find_and_reserve(search_hours=2) is None
+
+
+def test_refresh_keeps_reservations_that_are_not_booked_yet():
+    calendar = FakeCalendar((at(0), at(20)))
+    index = new_index(calendar)
+    held = index.find_and_reserve()
+    assert (held.start, held.end) == (at(20), at(35))
+
+    # Another client books 30-50, overlapping the held slot, before this insert lands
+    calendar.busy.append((at(30), at(50)))
+    index.invalidate()
+    following = index.find_and_reserve()
+    assert calendar.fetches == 2
+    assert (following.start, following.end) == (at(50), at(65))
+    assert index.stats() == {"busy_intervals": 2, "reserved": 2, "refreshes": 2}
+
+    # The refreshed busy list does not contain the held slot, yet it stays taken until released
+    calendar.busy.remove((at(30), at(50)))
+    index.invalidate()
+    assert index.find_slot() == (at(35), at(50))
+    index.release(held)
+    assert index.find_slot() == (at(20), at(35))
+
+
+def test_concurrent_find_and_reserve_get_different_slots():
+    # A slow freebusy call keeps the first caller inside the lock while the second arrives
+    index = new_index(FakeCalendar((at(0), at(10)), delay=0.05))
+    barrier = threading.Barrier(2)
+    reservations = []
+
+    def book():
+        barrier.wait()
+        reservations.append(index.find_and_reserve())
+
+    threads = [threading.Thread(target=book) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    first, second = sorted(reservations, key=lambda reservation: reservation.start)
+    assert (first.start, first.end) == (at(10), at(25))
+    assert (second.start, second.end) == (at(25), at(40))
+    assert first.token != second.token
+    assert index.refreshes == 1
@@ -0,0 +1,57 @@
+import threading
+
+import pytest
+
+from benchmarks.resp_server import RespStandIn
+from utils.session_store import RedisSessionStore, SQLiteSessionStore
+
+
+@pytest.fixture
+def resp_url():
+    server = RespStandIn()
+    url = server.start()
+    yield url
+    server.stop()
+
+
+def update_concurrently(stores, session_id, fields=40):
+    # Every thread sets its own field; a lost update would drop some of them
+    def update(n):
+        stores[n % len(stores)].update_session(session_id, **{f"field{n}": n})
+
+    threads = [threading.Thread(target=update, args=(n,)) for n in range(fields)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    return stores[0].load_session(session_id)
+
+
+def test_sqlite_update_session_keeps_concurrent_fields(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    # Two stores on one file stand for two app processes
+    stores = [SQLiteSessionStore(path), SQLiteSessionStore(path)]
+    session_id = stores[0].create_session({"client_email": "a@example.com"})
+    session = update_concurrently(stores, session_id)
+    assert session["client_email"] == "a@example.com"
+    assert all(session[f"field{n}"] == n for n in range(40))
+
+
+def test_redis_update_session_keeps_concurrent_fields(resp_url):
+    stores = [RedisSessionStore(resp_url), RedisSessionStore(resp_url)]
+    session_id = stores[0].create_session({"client_email": "a@example.com"})
+    session = update_concurrently(stores, session_id)
+    assert session["client_email"] == "a@example.com"
+    assert all(session[f"field{n}"] == n for n in range(40))
+
+
+@pytest.mark.parametrize("kind", ["sqlite", "redis"])
+def test_update_returning_none_keeps_the_value(kind, tmp_path, resp_url):
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db")) if kind == "sqlite" else RedisSessionStore(resp_url)
+    store.set("k", {"a": 1})
+    assert store.update("k", lambda value: None) is None
+    assert store.get("k") == {"a": 1}
+    with pytest.raises(ValueError):
+        store.update("k", lambda value: (_ for _ in ()).throw(ValueError("bad")))
+    assert store.update("k", lambda value: {**value, "b": 2}) == {"a": 1, "b": 2}
+    assert store.get("k") == {"a": 1, "b": 2}
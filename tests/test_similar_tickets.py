@@ -0,0 +1,38 @@
+import json
+
+from utils import backend, similar_tickets
+from utils.similar_tickets import SimilarTicketIndex, shareable_questions
+
+ISSUE = "since this morning I cannot log in to the dashboard, the login page shows error 502 for our whole team."
+OUTAGE = f"Hi, {ISSUE} Jane"
+SAME_OUTAGE = f"Hello, {ISSUE} Bob"
+QUESTIONS = ["Which browser do you use?", "Is order 123456 affected?", "Can you email me at help@example.com?",
+             "Does the error show on every login?"]
+
+
+def test_index_is_off_by_default():
+    assert similar_tickets.SIMILAR_TICKET_INDEX == ""
+
+
+def test_entries_keep_no_text_of_the_email(tmp_path):
+    path = tmp_path / "index.jsonl"
+    index = SimilarTicketIndex(str(path))
+    index.add(OUTAGE, QUESTIONS)
+    stored = path.read_text(encoding="utf-8")
+    assert "jane" not in stored.lower() and "dashboard" not in stored and "123456" not in stored
+    assert json.loads(stored)["questions"] == ["Which browser do you use?", "Does the error show on every login?"]
+
+    # Another process replays the file and finds the ticket
+    similarity, ticket = SimilarTicketIndex(str(path)).search(SAME_OUTAGE)[0]
+    assert similarity >= similar_tickets.SIMILAR_TICKET_THRESHOLD
+    assert ticket["questions"] == shareable_questions(QUESTIONS)
+
+
+def test_similar_summary_shows_only_the_current_email(monkeypatch):
+    index = SimilarTicketIndex()
+    index.add(OUTAGE, QUESTIONS)
+    monkeypatch.setattr(similar_tickets, "get_index", lambda: index)
+    result = backend.similar_summary(SAME_OUTAGE)
+    assert result["source"] == "similar"
+    assert "Jane" not in result["summary"] and result["summary"].startswith("Hello")
+    assert result["questions"] == shareable_questions(QUESTIONS)
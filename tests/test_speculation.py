@@ -0,0 +1,46 @@
+from utils import speculation
+from utils.context import ConversationContext
+
+
+def fake_stream(context, result=None):
+    # Like stream_next_question: the prompt is counted on the context's conversation
+    context["conversation"].record_prompt("What browser do you use?")
+    yield "What browser "
+    yield "do you use?"
+    if result is not None:
+        result["question"] = "What browser do you use?"
+
+
+def start(monkeypatch, conversation):
+    monkeypatch.setattr(speculation, "CHAT_SPECULATION", True)
+    monkeypatch.setattr(speculation, "stream_next_question", fake_stream)
+    monkeypatch.setattr(speculation, "classify_sentiment", lambda answer: {"sentiment_identified": "Neutral"})
+    context = {"email": "My login fails", "questions": [], "conversation": conversation,
+               "previous": [{"question": "Hi", "answer": "Chrome", "sentiment": ""}]}
+    return speculation.start_turn("Chrome", context)
+
+
+def test_used_turn_carries_its_conversation_updates(monkeypatch):
+    conversation = ConversationContext()
+    turn = start(monkeypatch, conversation)
+    assert "".join(turn.question_deltas()) == "What browser do you use?"
+    assert turn.conversation is not conversation
+    assert len(turn.conversation.prompt_tokens) == 1
+
+
+def test_discarded_turns_leave_the_session_conversation_alone(monkeypatch):
+    conversation = ConversationContext()
+    for _ in range(3):
+        turn = start(monkeypatch, conversation)
+        turn.cancel()
+        turn.sentiment()
+    assert conversation.prompt_tokens == []
+
+
+def test_copy_is_independent():
+    conversation = ConversationContext.from_dict({"summary": "Login issue", "folded": 2, "prompt_tokens": [10]},
+                                                 token_budget=300)
+    copy = conversation.copy()
+    copy.record_prompt("more")
+    assert (copy.summary, copy.folded, copy.token_budget) == ("Login issue", 2, 300)
+    assert conversation.prompt_tokens == [10]
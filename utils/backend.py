@@ -1,139 +1,267 @@
 import json
-from langchain.prompts import PromptTemplate
-#import boto3
+import asyncio
+import functools
 from dotenv import load_dotenv
 import re
 import os
-from openai import OpenAI
+import threading
 import streamlit as st
+from utils.llm_cache import llm_cache, make_key
+from utils.local_classifier import predict_confident
+from utils.similar_tickets import find_similar, remember
+from utils.preprocess import preprocess_email
+from utils.providers import get_provider, CircuitOpenError, DeadlineExceeded
+from utils.rate_limiter import current_request
+from utils.resilience import accepts_deadline, deadline_after
+from utils.context import CONTEXT_EMAIL_TOKENS, clip_to_tokens, format_turn
+from utils.telemetry import instrument, annotate
+from utils.schemas import (SentimentResult, IssueSummary, UrgencyResult, TriageResult, Greeting, NextQuestion,
+                           SufficiencyResult, function_schema, parse_structured)
 
 load_dotenv()
 
-## AWS Sagemaker: NOVA
-
-# bedrock = boto3.client(service_name="bedrock-runtime",
-#                          region_name = "us-east-1")
-# MODEL_ID = "amazon.nova-lite-v1:0"
-
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-MODEL_OPEN_AI = "gpt-3.5-turbo"
-
-def invoke_nova(prompt):
-
-    body = json.dumps({
-        "messages": [
-            {
-                "role": "user",
-                "content": [
-                    {"text": prompt}
-                ]
-            }
-        ]
-     }).encode("utf-8")
-
-    try:
-        response = bedrock.invoke_model(
-            modelId=MODEL_ID,
-            body=body,
-            accept="application/json",
-            contentType="application/json"
-        )
-        response_body = json.loads(response.get('body').read().decode('utf-8'))
-        result = response_body["output"]["message"]["content"][0]["text"]
-
-    except Exception as e:
-         return f"Error: {e}"
-    
-    match = re.search(r'```(?:json)?\s*([\s\S])+?\s*```', result, re.DOTALL)
-
-    if match:
-        result = match.group(1)
-
-    try:
-        validation_result = json.loads(result)
-    
-    except json.JSONDecodeError:
-        validation_result = {"email_text": "Unknown", "reasoning": "Model output could not be parsed"}
-
-    return validation_result
-
-def invoke_chatgpt(prompt):
-    response = client.chat.completions.create(
-    model=MODEL_OPEN_AI,
-    messages=[{"role": "user", "content": prompt}]
-    )  
-    return response.choices[0].message.content
+# Model provider (OpenAI, Bedrock or a local OpenAI-compatible server) is chosen
+# with LLM_PROVIDER / LLM_MODEL / LLM_BASE_URL, see utils/providers.py
+
+# Per-call timeout (seconds) for the concurrent triage calls
+TRIAGE_CALL_TIMEOUT = float(os.getenv("TRIAGE_CALL_TIMEOUT", "30"))
+# "separate": one call each for sentiment, summary and urgency; "fused": a single call for all three
+TRIAGE_MODE = os.getenv("TRIAGE_MODE", "separate")
+TRIAGE_MODES = ("separate", "fused")
+# Extra seconds the triage waits for a call past its deadline, so the call's own deadline ends it first
+DEADLINE_GRACE = 1.0
+# JSONL file collecting LLM labels to train the local classifiers (disabled when empty)
+TRIAGE_LOG_PATH = os.getenv("TRIAGE_LOG_PATH", "")
+_log_lock = threading.Lock()
+
+def _on_miss(call):
+    """Wrap a model call so the running telemetry span records a cache miss when it is made."""
+    def wrapped():
+        annotate(cache="miss")
+        return call()
+    return wrapped
+
+def invoke_llm(prompt):
+    provider = get_provider()
+    key = make_key(f"{provider.name}:{provider.model}", prompt)
+    annotate(cache="hit")
+    return llm_cache.get_or_call(key, _on_miss(lambda: provider.complete(prompt)))
+
+async def invoke_llm_async(prompt):
+    provider = get_provider()
+    key = make_key(f"{provider.name}:{provider.model}", prompt)
+    annotate(cache="hit")
+    return await llm_cache.aget_or_call(key, _on_miss(lambda: provider.acomplete(prompt)))
+
+def _structured_key(provider, prompt, model_cls):
+    return make_key(f"{provider.name}:{provider.model}", prompt,
+                    schema=model_cls.__name__, mode=provider.structured_mode)
+
+def invoke_structured(prompt, model_cls):
+    """Ask for a model_cls object (native function calling / JSON mode) and return it validated."""
+    provider = get_provider()
+    key = _structured_key(provider, prompt, model_cls)
+    annotate(cache="hit")
+    text = llm_cache.get_or_call(key, _on_miss(lambda: provider.complete(prompt, schema=function_schema(model_cls))))
+    result = parse_structured(model_cls, text)
+    if "error" in result:
+        llm_cache.delete(key)
+    return result
+
+async def invoke_structured_async(prompt, model_cls):
+    provider = get_provider()
+    key = _structured_key(provider, prompt, model_cls)
+    annotate(cache="hit")
+    text = await llm_cache.aget_or_call(key, _on_miss(lambda: provider.acomplete(prompt, schema=function_schema(model_cls))))
+    result = parse_structured(model_cls, text)
+    if "error" in result:
+        await llm_cache.adelete(key)
+    return result
+
+def stream_structured(prompt, model_cls):
+    """Yield the raw JSON of a model_cls answer as it is generated; a cached answer is yielded at once."""
+    provider = get_provider()
+    key = _structured_key(provider, prompt, model_cls)
+    cached = llm_cache.get(key)
+    if cached is not None:
+        annotate(cache="hit")
+        yield cached
+        return
+    annotate(cache="miss")
+    chunks = []
+    for delta in provider.stream(prompt, schema=function_schema(model_cls)):
+        chunks.append(delta)
+        yield delta
+    llm_cache.set(key, "".join(chunks))
+
+def cache_stats():
+    """Hit/miss counters of the LLM response cache."""
+    return llm_cache.stats()
+
+# DEGRADED ANSWERS
+# While the circuit is open or a call misses its deadline, interactive callers get
+# a default answer marked "degraded" instead of an error. Batch runs get the
+# error, so they retry instead of storing defaults.
+DEGRADED_SENTIMENT = "Neutral"
+DEGRADED_URGENCY = "Medium"
+DEGRADED_GREETING = "Hello and thank you for being our customer! Could you tell us more about the issue?"
+DEGRADED_QUESTION = "Could you share any other detail that may help us resolve the issue (error messages, steps, times)?"
+# Tokens of the email used as the summary of a degraded answer
+DEGRADED_SUMMARY_TOKENS = 60
+
+def degrades_to(fallback):
+    """Decorator returning fallback(error, *args, **kwargs) on an open circuit or a missed deadline."""
+    def decorator(fn):
+        def handle(error, args, kwargs):
+            if current_request().get("call_type") == "batch":
+                raise error
+            annotate(cache="degraded")
+            return fallback(error, *args, **kwargs)
+
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                try:
+                    return await fn(*args, **kwargs)
+                except (CircuitOpenError, DeadlineExceeded) as e:
+                    return handle(e, args, kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            try:
+                return fn(*args, **kwargs)
+            except (CircuitOpenError, DeadlineExceeded) as e:
+                return handle(e, args, kwargs)
+        return wrapper
+    return decorator
+
+def _degraded(error):
+    return {"reasoning": f"Default answer, the model is unavailable ({error})", "source": "degraded", "degraded": True}
+
+def degraded_label(task, label):
+    return lambda error, *args, **kwargs: {**_degraded(error), f"{task}_identified": label}
+
+def degraded_summary(error, email, *args, **kwargs):
+    return {**_degraded(error), "summary": clip_to_tokens(email, DEGRADED_SUMMARY_TOKENS), "questions": []}
+
+def degraded_triage(error, email, *args, **kwargs):
+    return (degraded_label("sentiment", DEGRADED_SENTIMENT)(error), degraded_summary(error, email),
+            degraded_label("urgency", DEGRADED_URGENCY)(error))
+
+def degraded_question(error, context, *args, **kwargs):
+    """First suggested question not asked yet, or a generic one."""
+    asked = {i.get("question") for i in context.get("previous", [])}
+    questions = context.get("questions") or []
+    suggested = [q for q in (questions if isinstance(questions, list) else []) if isinstance(q, str) and q not in asked]
+    return {**_degraded(error), "question": suggested[0] if suggested else DEGRADED_QUESTION}
 
 #USEFULE FUNCTIONS
-def wrap_json_output(text):
-    """Extract valid JSON from messy model output."""
+def partial_json_string(text, field):
+    """Best-effort value of a string field in a JSON object that is still being generated."""
+    match = re.search(r'"%s"\s*:\s*"' % re.escape(field), text)
+    if not match:
+        return ""
+    raw = []
+    i = match.end()
+    while i < len(text):
+        char = text[i]
+        if char == '"':
+            break
+        if char == "\\":
+            escape = text[i:i + 6] if text[i + 1:i + 2] == "u" else text[i:i + 2]
+            if len(escape) < (6 if escape[1:2] == "u" else 2):
+                # Escape sequence not complete yet
+                break
+            raw.append(escape)
+            i += len(escape)
+            continue
+        raw.append(char)
+        i += 1
     try:
-        # Attempt to extract a clean JSON block from output
-        match = re.search(r'{.*}', text, re.DOTALL)
-        if match:
-            return json.loads(match.group(0))
-        else:
-            return json.loads(text)  # fallback
-    except Exception as e:
-        return {"error": f"JSON parsing failed: {e}", "raw": text}
+        return json.loads('"' + "".join(raw) + '"')
+    except json.JSONDecodeError:
+        return "".join(raw)
+
+def local_label(task, text):
+    """Answer from the local classifier when it is confident enough, otherwise None."""
+    prediction = predict_confident(task, text)
+    if prediction is None:
+        return None
+    annotate(cache="local")
+    label, confidence = prediction
+    return {
+        "reasoning": f"Local classifier ({confidence:.2f} confidence)",
+        f"{task}_identified": label,
+        "source": "local"
+    }
+
+def similar_summary(email):
+    """Questions of a near-duplicate earlier email with a summary clipped from this one, otherwise None."""
+    match = find_similar(email)
+    if match is None:
+        return None
+    annotate(cache="similar")
+    similarity, ticket = match
+    # The other ticket is another customer's: only its questions are reused, the summary is this email's own
+    return {
+        "summary": clip_to_tokens(email, DEGRADED_SUMMARY_TOKENS),
+        "reasoning": f"Questions of a similar ticket ({similarity:.2f} similarity)",
+        "questions": ticket["questions"],
+        "source": "similar",
+        "similar_to": ticket["id"],
+        "similarity": round(similarity, 3),
+    }
+
+def log_label(task, text, result):
+    """Append an LLM label to TRIAGE_LOG_PATH as training data for the local classifier."""
+    label = result.get(f"{task}_identified") if isinstance(result, dict) else None
+    if not TRIAGE_LOG_PATH or not label:
+        return
+    with _log_lock, open(TRIAGE_LOG_PATH, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"task": task, "text": text, "label": label}, ensure_ascii=False) + "\n")
 
 # PROMPTS
-prompt_sentiment = PromptTemplate.from_template(
-    """
+# Answers are requested with the schemas in utils/schemas.py, so the prompts only
+# describe the task. The email is never echoed back in the answer. Plain str.format
+# templates: langchain's PromptTemplate took half a second to import for the same result.
+prompt_sentiment = """
     You are an empathetic customer service agent. 
     Classify the following email sentiment as Neutral, Angry, Frustrated, or Stressed.
-    Return the output as a raw JSON string without markdown formatting or triple backticks in the following structure:
-     {{
-        "email_text": {email},
-        "reasoning": "Step-by-step reasoning for your conclusion",
-        "sentiment_identified": "Neutral" | "Angry" | "Frustrated" | "Stressed"
-        }}
 
     Email to Review:
         {email}
     """
-)
 
-prompt_issue_extraction = PromptTemplate.from_template(
-    """
+prompt_issue_extraction = """
     You are a technical customer service agent. 
     Summarize the following email to help identify the main issue.
     Suggest 5 questions to get more information from the customer, so issue can be better identified.
-    Return the output as raw JSON string without markdown formatting or triple backticks in the following structure:
-     {{
-        "email_text": {email},
-        "summary": summary,
-        "reasoning": "Step-by-step reasoning for your questions",
-        "questions": [{{"Q1": question 1,
-                        "Q2": question 2,
-                        "Q3": question 3,
-                        "Q4": question 4,
-                        "Q5": question 5}}]
-        }}
 
     Email to Review:
         {email}
     """
-)
 
-prompt_urgency = PromptTemplate.from_template(
-    """
+prompt_urgency = """
     You are a technical customer service agent. 
     Based on this email, how urgent is the issue? Respond with one of the following levels: Low, Medium, High, Critical.
-    Return the output as raw JSON string without markdown formatting or triple backticks in the following structure:
-     {{
-        "email_text": {email},
-        "reasoning": "Step-by-step reasoning for your conclusion",
-        "urgency_identified": "Low" | "Medium" | "High" | "Critical"
-        }}
 
     Email to Review:
         {email}
     """
-)
 
-prompt_greeting = PromptTemplate.from_template(
+prompt_triage = """
+    You are a technical customer service agent.
+    Review the following email:
+    - Summarize it to help identify the main issue, and suggest 5 questions to get more information from the customer, so issue can be better identified.
+    - Classify its sentiment as Neutral, Angry, Frustrated, or Stressed.
+    - Rate how urgent the issue is: Low, Medium, High, or Critical.
+
+    Email to Review:
+        {email}
     """
+
+prompt_greeting = """
     You are a sympathetic customer support agent who has been contacted with the client who has sent an email to the helpdesk.
     This is the email from the client {email}.
     You have also been provided with suggested clarification questions:
@@ -143,23 +271,11 @@ prompt_greeting = PromptTemplate.from_template(
     Continue the conversation with a polite greeting and the first clarification question. You either can consider any of the questions provided before or ask a new one.
     The objective of this first question should be to clarify the issue presented.
     Only ask **one** question for now. Do not simulate the user's answer.
-    Assess the answer and identify the sentiment.
-    Return only the greeting and the first question in this format:
-
-    {{
-        "email_text": {email},
-        "interaction": {{
-            "Q1": {{"question_asked": "...", 
-                "answer_received": "",
-                "reasoning": "Step-by-step reasoning for asking this question",
-                "sentiment_identified": ""
-    }}
 
     Make sure you greet the customer and thank him/her for being our customer.
-    """)
-
-prompt_next_question = PromptTemplate.from_template(
     """
+
+prompt_next_question = """
     You are a helpful AI support agent in a live conversation.
     You have received the following customer email:
     
@@ -172,62 +288,272 @@ prompt_next_question = PromptTemplate.from_template(
     {interaction_history}
 
     Your task is to ask ONE new, meaningful, non-redundant question that can help the technical team understand and resolve the issue faster.
+    """
+
+prompt_sufficiency = """
+    You are a technical customer service agent deciding whether a clarification chat can end.
+    You have received the following customer email:
+
+    {email}
+
+    These questions were suggested to understand the issue:
+    {suggested_questions}
 
-    Return only this JSON (do not include any markdown formattin or backticks):
+    Here is the chat so far:
+    {interaction_history}
 
-    {{
-        "question": "...",
-        "reasoning": "Explain why this new question is useful given the history.
-    }}
+    Score from 0 to 1 how much of the information the technical team needs to start working on the issue
+    the customer has given. 1 means more questions would not help.
+    """
+
+prompt_history_summary = """
+    You are keeping notes of a customer support chat.
+    Current notes (may be empty):
+    {summary}
+
+    New question/answer turns:
+    {turns}
+
+    Update the notes so they keep every fact the customer gave (versions, errors, steps tried, dates)
+    and which questions were already asked. Be concise: at most 120 words, plain text, no JSON.
     """
-)
 
 #FUNCTIONS AGENT
    
+@instrument()
+@accepts_deadline
+@degrades_to(degraded_label("sentiment", DEGRADED_SENTIMENT))
 def classify_sentiment(email):
+    local = local_label("sentiment", email)
+    if local:
+        return local
     prompt = prompt_sentiment.format(email=email)
-    #response = invoke_nova(prompt)
-    response = invoke_chatgpt(prompt)
-    return wrap_json_output(response)
+    result = invoke_structured(prompt, SentimentResult)
+    log_label("sentiment", email, result)
+    return result
 
+@instrument()
+@accepts_deadline
+@degrades_to(degraded_summary)
 def extract_issue_summary(email):
+    similar = similar_summary(email)
+    if similar:
+        return similar
     prompt = prompt_issue_extraction.format(email=email)
-    #response = invoke_nova(prompt)
-    response = invoke_chatgpt(prompt)
-    return wrap_json_output(response)
+    result = invoke_structured(prompt, IssueSummary)
+    remember(email, result)
+    return result
 
 
+@instrument()
+@accepts_deadline
+@degrades_to(degraded_label("urgency", DEGRADED_URGENCY))
 def detect_urgency(email):
+    local = local_label("urgency", email)
+    if local:
+        return local
     prompt = prompt_urgency.format(email=email)
-    #response = invoke_nova(prompt)
-    response = invoke_chatgpt(prompt)
-    return wrap_json_output(response)
+    result = invoke_structured(prompt, UrgencyResult)
+    log_label("urgency", email, result)
+    return result
 
 
+@instrument()
+@accepts_deadline
+@degrades_to(lambda error, *args, **kwargs: {**_degraded(error), "message": DEGRADED_GREETING})
 def start_chat(email, questions):
     prompt = prompt_greeting.format(email=email, questions=questions)
-    #response = invoke_nova(prompt)
-    response = invoke_chatgpt(prompt)
-    return wrap_json_output(response)
+    return invoke_structured(prompt, Greeting)
 
 
-def generate_next_question(context):
+@instrument()
+@accepts_deadline
+# Without a new summary the older turns are kept verbatim
+@degrades_to(lambda error, summary, turns, **kwargs: f"{summary or ''}\n{turns}".strip())
+def summarize_history(summary, turns):
+    prompt = prompt_history_summary.format(summary=summary or "(none)", turns=turns)
+    return invoke_llm(prompt).strip()
+
+def build_next_question_prompt(context):
     email = context.get("email", "")
     suggested = context.get("questions", {})
     previous = context.get("previous", {})
+    # Optional utils.context.ConversationContext kept per chat session
+    conversation = context.get("conversation")
 
-    history_str = "\n".join([
-        f"Q{i+1}: {qa['question']} | A: {qa['answer']} | Sentiment: {qa['sentiment']}"
-        for i, qa in enumerate(previous)
-    ])
+    if conversation is not None:
+        email = clip_to_tokens(email, CONTEXT_EMAIL_TOKENS)
+        history_str = conversation.render(previous, summarize_history)
+    else:
+        history_str = "\n".join([format_turn(i + 1, qa) for i, qa in enumerate(previous)])
 
     prompt = prompt_next_question.format(email=email, 
                                          suggested_questions=json.dumps(suggested),
                                          interaction_history = history_str
                                          )
-    
-    #response = invoke_nova(prompt)
-    response = invoke_chatgpt(prompt)
-    return wrap_json_output(response)
+    if conversation is not None:
+        conversation.record_prompt(prompt)
+    return prompt
+
+@instrument()
+@accepts_deadline
+@degrades_to(degraded_question)
+def generate_next_question(context):
+    prompt = build_next_question_prompt(context)
+    return invoke_structured(prompt, NextQuestion)
+
+@instrument()
+@accepts_deadline
+# utils.sufficiency falls back to the local score on an error
+@degrades_to(lambda error, *args, **kwargs: {"error": f"Degraded: {error}", "degraded": True})
+def assess_sufficiency(context):
+    """{"reasoning", "score"} of a generate_next_question context, judged by the model."""
+    previous = context.get("previous", [])
+    prompt = prompt_sufficiency.format(email=clip_to_tokens(context.get("email", ""), CONTEXT_EMAIL_TOKENS),
+                                       suggested_questions=json.dumps(context.get("questions", {})),
+                                       interaction_history="\n".join(format_turn(i + 1, qa) for i, qa in enumerate(previous)))
+    return invoke_structured(prompt, SufficiencyResult)
+
+@instrument()
+@accepts_deadline
+def stream_next_question(context, result=None):
+    """Yield the "question" field of the next-question JSON while it is being generated.
+
+    Once the stream ends, the fully parsed response is stored in result (a dict) if given.
+    When the model is unavailable a degraded question is yielded instead, or the
+    part already yielded is kept as the question.
+    """
+    buffer = ""
+    emitted = ""
+    try:
+        prompt = build_next_question_prompt(context)
+        for delta in stream_structured(prompt, NextQuestion):
+            buffer += delta
+            question = partial_json_string(buffer, "question")
+            if len(question) > len(emitted) and question.startswith(emitted):
+                yield question[len(emitted):]
+                emitted = question
+    except (CircuitOpenError, DeadlineExceeded) as e:
+        annotate(cache="degraded")
+        fallback = degraded_question(e, context)
+        if emitted:
+            fallback["question"] = emitted
+        else:
+            yield fallback["question"]
+        if result is not None:
+            result.update(fallback)
+        return
+    if result is not None:
+        result.update(parse_structured(NextQuestion, buffer))
+
+
+#FUNCTIONS AGENT (ASYNC)
+# Pages run these on one event loop shared by every session (utils.providers.run_async),
+# so file, SQLite and NumPy work (local labels, ticket index, label log) runs in a thread
+
+@instrument("classify_sentiment")
+@accepts_deadline
+@degrades_to(degraded_label("sentiment", DEGRADED_SENTIMENT))
+async def classify_sentiment_async(email):
+    local = await asyncio.to_thread(local_label, "sentiment", email)
+    if local:
+        return local
+    prompt = prompt_sentiment.format(email=email)
+    result = await invoke_structured_async(prompt, SentimentResult)
+    await asyncio.to_thread(log_label, "sentiment", email, result)
+    return result
+
+@instrument("extract_issue_summary")
+@accepts_deadline
+@degrades_to(degraded_summary)
+async def extract_issue_summary_async(email):
+    similar = await asyncio.to_thread(similar_summary, email)
+    if similar:
+        return similar
+    prompt = prompt_issue_extraction.format(email=email)
+    result = await invoke_structured_async(prompt, IssueSummary)
+    await asyncio.to_thread(remember, email, result)
+    return result
+
+@instrument("detect_urgency")
+@accepts_deadline
+@degrades_to(degraded_label("urgency", DEGRADED_URGENCY))
+async def detect_urgency_async(email):
+    local = await asyncio.to_thread(local_label, "urgency", email)
+    if local:
+        return local
+    prompt = prompt_urgency.format(email=email)
+    result = await invoke_structured_async(prompt, UrgencyResult)
+    await asyncio.to_thread(log_label, "urgency", email, result)
+    return result
+
+def split_triage(result):
+    """(sentiment, summary, urgency) dicts shaped like the separate calls' answers, from a TriageResult."""
+    if "error" in result:
+        return result, result, result
+    return (
+        {"reasoning": result["sentiment_reasoning"], "sentiment_identified": result["sentiment_identified"]},
+        {"summary": result["summary"], "questions": result["questions"]},
+        {"reasoning": result["urgency_reasoning"], "urgency_identified": result["urgency_identified"]},
+    )
+
+@instrument("triage_fused")
+@accepts_deadline
+@degrades_to(degraded_triage)
+async def triage_fused_async(email):
+    """(sentiment, summary, urgency) from one model call.
+
+    Confident local labels and a similar ticket's summary are still used first;
+    the call is skipped when they cover all three.
+    """
+    sentiment, summary, urgency = await asyncio.to_thread(
+        lambda: (local_label("sentiment", email), similar_summary(email), local_label("urgency", email)))
+    if sentiment and summary and urgency:
+        return sentiment, summary, urgency
+    prompt = prompt_triage.format(email=email)
+    fused = split_triage(await invoke_structured_async(prompt, TriageResult))
+    if not sentiment:
+        sentiment = fused[0]
+        await asyncio.to_thread(log_label, "sentiment", email, sentiment)
+    if not summary:
+        summary = fused[1]
+        await asyncio.to_thread(remember, email, summary)
+    if not urgency:
+        urgency = fused[2]
+        await asyncio.to_thread(log_label, "urgency", email, urgency)
+    return sentiment, summary, urgency
+
+async def _isolated(coro, timeout):
+    """Await a single triage call so its failure or timeout does not affect the others."""
+    try:
+        return await asyncio.wait_for(coro, timeout)
+    except asyncio.TimeoutError:
+        return {"error": f"Model call timed out after {timeout}s"}
+    except Exception as e:
+        return {"error": f"Model call failed: {e}"}
 
+@instrument()
+async def triage_email(email, timeout=TRIAGE_CALL_TIMEOUT, mode=TRIAGE_MODE):
+    """Clean the email, then get its sentiment, summary and urgency.
 
+    mode "separate" runs the three calls concurrently, "fused" makes one call
+    (TRIAGE_MODE). timeout is the deadline of the whole triage: answers still
+    missing by then are degraded defaults. "email" in the result is the cleaned
+    text, "preprocessing" the tokens it saved.
+    """
+    if mode not in TRIAGE_MODES:
+        raise ValueError(f"Unknown triage mode '{mode}', expected one of {TRIAGE_MODES}")
+    # Parsing and cleaning run off the event loop, which every session's calls share
+    email, preprocessing = await asyncio.to_thread(preprocess_email, email)
+    with deadline_after(timeout):
+        if mode == "fused":
+            fused = await _isolated(triage_fused_async(email), timeout + DEADLINE_GRACE)
+            sentiment, summary, urgency = fused if isinstance(fused, tuple) else (fused, fused, fused)
+        else:
+            sentiment, summary, urgency = await asyncio.gather(
+                _isolated(classify_sentiment_async(email), timeout + DEADLINE_GRACE),
+                _isolated(extract_issue_summary_async(email), timeout + DEADLINE_GRACE),
+                _isolated(detect_urgency_async(email), timeout + DEADLINE_GRACE),
+            )
+    return {"sentiment": sentiment, "summary": summary, "urgency": urgency, "mode": mode,
+            "email": email, "preprocessing": preprocessing}
@@ -0,0 +1,263 @@
+"""Bulk triage of a mailbox backlog.
+
+Usage:
+    python -m utils.batch_triage INPUT --output results.jsonl [--concurrency 8] [--mode fused]
+
+INPUT can be an mbox file, a directory of .eml files or a JSONL file with
+one {"id", "email_text", "client_email"} object per line. Results are
+appended to the output file one line per email, so an interrupted run can
+be restarted with the same arguments and picks up where it stopped.
+With --mode fused (or TRIAGE_MODE=fused) each email takes one model call
+instead of three, so a rate-limited run gets through three times as many.
+"""
+import argparse
+import asyncio
+import email
+import email.policy
+import email.utils
+import hashlib
+import json
+import mailbox
+import os
+import sys
+import time
+
+from dotenv import load_dotenv
+
+from utils.backend import (classify_sentiment_async, extract_issue_summary_async, detect_urgency_async,
+                           triage_fused_async, TRIAGE_MODE, TRIAGE_MODES)
+from utils.preprocess import preprocess_email
+from utils.providers import ProviderError, backoff_delay
+from utils.rate_limiter import request_context
+from utils.results_store import get_results_store
+
+load_dotenv()
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_MAX_RETRIES = 3
+
+
+# ==== Input readers (all lazy, one email in memory at a time) ====
+def _message_text(msg):
+    if msg.is_multipart():
+        for part in msg.walk():
+            if part.get_content_type() == "text/plain" and not part.get_filename():
+                return part.get_content()
+        for part in msg.walk():
+            if part.get_content_type() == "text/html":
+                return part.get_content()
+        return ""
+    return msg.get_content()
+
+
+def _email_record(msg, fallback_id):
+    text = _message_text(msg)
+    return {
+        "id": (msg.get("Message-ID") or fallback_id).strip(),
+        "email_text": f"Subject: {msg.get('Subject', '')}\n\n{text}".strip(),
+        "client_email": email.utils.parseaddr(msg.get("From", ""))[1],
+    }
+
+
+def iter_mbox(path):
+    box = mailbox.mbox(path, factory=lambda f: email.message_from_binary_file(f, policy=email.policy.default))
+    for key in box.iterkeys():
+        yield _email_record(box[key], f"{os.path.basename(path)}:{key}")
+
+
+def iter_eml_dir(path):
+    for name in sorted(os.listdir(path)):
+        if not name.lower().endswith(".eml"):
+            continue
+        with open(os.path.join(path, name), "rb") as f:
+            msg = email.message_from_binary_file(f, policy=email.policy.default)
+        yield _email_record(msg, name)
+
+
+def iter_jsonl(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            text = item.get("email_text", "")
+            yield {
+                "id": str(item.get("id") or hashlib.sha1(text.encode("utf-8")).hexdigest()),
+                "email_text": text,
+                "client_email": item.get("client_email", ""),
+            }
+
+
+def iter_emails(path):
+    if os.path.isdir(path):
+        return iter_eml_dir(path)
+    if path.endswith(".jsonl"):
+        return iter_jsonl(path)
+    return iter_mbox(path)
+
+
+def load_completed(output_path):
+    """Ids already triaged successfully in a previous run."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Last line of an interrupted run may be cut short
+                continue
+            if not record.get("error"):
+                done.add(record["id"])
+    return done
+
+
+# ==== Rate limit handling ====
+class RateLimitGate:
+    """Shared pause: when one call is rate limited every worker waits before its next call."""
+
+    def __init__(self):
+        self.resume_at = 0.0
+
+    async def wait(self):
+        delay = self.resume_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds):
+        self.resume_at = max(self.resume_at, time.monotonic() + seconds)
+
+
+async def call_with_backoff(fn, email_text, gate, max_retries):
+    """Retry on top of the provider's own retries, pausing every worker on a 429."""
+    for attempt in range(max_retries + 1):
+        await gate.wait()
+        try:
+            return await fn(email_text)
+        except ProviderError as e:
+            if attempt == max_retries or not e.retryable:
+                raise
+            delay = backoff_delay(attempt + 2, e.retry_after)
+            if e.status_code == 429:
+                gate.pause(delay)
+            await asyncio.sleep(delay)
+
+
+def failure(result):
+    """Why a call's result is not an answer (raised, an {"error"} payload or a degraded default), or None."""
+    if isinstance(result, BaseException):
+        return f"{type(result).__name__}: {result}"
+    if isinstance(result, dict) and result.get("error"):
+        return str(result["error"])
+    if isinstance(result, dict) and result.get("degraded"):
+        return f"Degraded: {result.get('reasoning', '')}"
+    return None
+
+
+async def triage_record(record, gate, max_retries, mode=TRIAGE_MODE):
+    calls = [classify_sentiment_async, extract_issue_summary_async, detect_urgency_async]
+    email_text, preprocessing = preprocess_email(record["email_text"])
+    # The whole run is one low-priority session for the rate limiter, behind live chats and triage
+    with request_context(call_type="batch", session="batch"):
+        if mode == "fused":
+            try:
+                results = await call_with_backoff(triage_fused_async, email_text, gate, max_retries)
+            except Exception as e:
+                results = [e, e, e]
+        else:
+            results = await asyncio.gather(
+                *[call_with_backoff(fn, email_text, gate, max_retries) for fn in calls],
+                return_exceptions=True,
+            )
+    # Failed answers are left out and make the record an error, so a resumed run triages it again
+    failures = [failure(r) for r in results]
+    sentiment, summary, urgency = (None if f else r for r, f in zip(results, failures))
+    errors = list(dict.fromkeys(f for f in failures if f))
+    return {
+        "id": record["id"],
+        "client_email": record["client_email"],
+        # Cleaned text the calls saw; utils.similar_tickets build reads it
+        "email_text": email_text,
+        "sentiment": sentiment,
+        "summary": summary,
+        "urgency": urgency,
+        "tokens_saved": preprocessing["tokens_saved"],
+        "error": "; ".join(errors) or None,
+    }
+
+
+# ==== Pipeline ====
+async def run_batch(input_path, output_path, concurrency=DEFAULT_CONCURRENCY, max_retries=DEFAULT_MAX_RETRIES,
+                    mode=TRIAGE_MODE):
+    done = load_completed(output_path)
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+    gate = RateLimitGate()
+    counts = {"processed": 0, "skipped": 0, "failed": 0, "tokens_saved": 0}
+    results = get_results_store()
+
+    with open(output_path, "a", encoding="utf-8") as out:
+
+        async def worker():
+            while True:
+                record = await queue.get()
+                if record is None:
+                    return
+                # Any failure is recorded against the item; a worker that died here would leave the
+                # producer blocked on the full queue
+                try:
+                    result = await triage_record(record, gate, max_retries, mode)
+                except Exception as e:
+                    result = {"id": record["id"], "client_email": record["client_email"],
+                              "email_text": record["email_text"], "sentiment": None, "summary": None,
+                              "urgency": None, "tokens_saved": 0, "error": failure(e)}
+                if results is not None and not result["error"]:
+                    try:
+                        results.record_triage(result["id"], result, result["client_email"], result["email_text"],
+                                              source="batch")
+                    except Exception as e:
+                        # Written as an error, so a resumed run stores it again
+                        result["error"] = f"Results store: {failure(e)}"
+                try:
+                    out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                    out.flush()
+                except Exception as e:
+                    print(f"Could not write the result of {record['id']}: {failure(e)}", file=sys.stderr)
+                    result["error"] = result["error"] or failure(e)
+                counts["processed"] += 1
+                counts["tokens_saved"] += result["tokens_saved"]
+                if result["error"]:
+                    counts["failed"] += 1
+
+        workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+        for record in iter_emails(input_path):
+            if record["id"] in done:
+                counts["skipped"] += 1
+                continue
+            await queue.put(record)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Triage a backlog of support emails.")
+    parser.add_argument("input", help="mbox file, directory of .eml files or .jsonl file")
+    parser.add_argument("--output", "-o", default="triage_results.jsonl")
+    parser.add_argument("--concurrency", "-c", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--max-retries", type=int, default=DEFAULT_MAX_RETRIES)
+    parser.add_argument("--mode", choices=TRIAGE_MODES, default=TRIAGE_MODE,
+                        help="fused: one model call per email instead of three")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    counts = asyncio.run(run_batch(args.input, args.output, args.concurrency, args.max_retries, args.mode))
+    elapsed = time.perf_counter() - start
+    print(f"Processed {counts['processed']} emails ({counts['failed']} failed, "
+          f"{counts['skipped']} already done) in {elapsed:.1f}s; preprocessing saved "
+          f"{counts['tokens_saved']} input tokens per call", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
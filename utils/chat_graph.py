@@ -0,0 +1,319 @@
+import base64
+import threading
+import uuid
+from typing import TypedDict
+
+import streamlit as st
+from langchain_core.runnables import RunnableLambda
+from langgraph.checkpoint.base import BaseCheckpointSaver, CheckpointTuple, get_checkpoint_id, get_checkpoint_metadata
+from langgraph.graph import StateGraph
+
+from utils.backend import DEGRADED_GREETING, degraded_question, start_chat, stream_next_question
+from utils.jobs import submit_escalation
+from utils.results_store import get_results_store
+from utils.session_store import get_session_store
+from utils.speculation import start_turn
+from utils.sufficiency import should_stop, record_chat_end
+from utils.telemetry import instrument
+
+# CHAT GRAPH
+# The LangGraph state machine of the clarification chat. It is compiled once per
+# process (get_chat_app) and shared by every Streamlit session: the nodes take
+# the per-session values (session id, email, summary) from st.session_state and
+# the state, never from module globals. Its checkpoints live in the session
+# store, under thread_id = session_id. LangGraph is only imported by the chat page.
+
+
+# ==== Checkpointer ====
+def _encode(typed):
+    type_name, data = typed
+    return [type_name, base64.b64encode(data).decode("ascii")]
+
+
+def _decode(encoded):
+    return encoded[0], base64.b64decode(encoded[1])
+
+
+class StoreCheckpointer(BaseCheckpointSaver):
+    """Keeps the latest checkpoint of every chat (thread_id = session_id) in a SessionStore.
+
+    Only the latest checkpoint and its pending writes are kept: the chat resumes
+    from it, it does not need the history.
+    """
+
+    def __init__(self, store, serde=None):
+        super().__init__(serde=serde)
+        self.store = store
+
+    @staticmethod
+    def _key(config):
+        configurable = config["configurable"]
+        return f"checkpoint:{configurable['thread_id']}:{configurable.get('checkpoint_ns', '')}"
+
+    def get_tuple(self, config):
+        record = self.store.get(self._key(config))
+        if record is None:
+            return None
+        checkpoint_id = get_checkpoint_id(config)
+        if checkpoint_id and checkpoint_id != record["id"]:
+            return None
+        configurable = config["configurable"]
+        thread_id, checkpoint_ns = configurable["thread_id"], configurable.get("checkpoint_ns", "")
+
+        def config_for(checkpoint_id):
+            return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns,
+                                     "checkpoint_id": checkpoint_id}}
+
+        checkpoint = self.serde.loads_typed(_decode(record["checkpoint"]))
+        checkpoint["pending_sends"] = []
+        return CheckpointTuple(
+            config=config_for(record["id"]),
+            checkpoint=checkpoint,
+            metadata=self.serde.loads_typed(_decode(record["metadata"])),
+            parent_config=config_for(record["parent_id"]) if record["parent_id"] else None,
+            pending_writes=[(task_id, channel, self.serde.loads_typed(_decode(value)))
+                            for task_id, channel, value in record["writes"]],
+        )
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        if config is None:
+            return
+        checkpoint = self.get_tuple(config)
+        if checkpoint is None:
+            return
+        before_id = get_checkpoint_id(before) if before else None
+        if before_id and checkpoint.config["configurable"]["checkpoint_id"] >= before_id:
+            return
+        if filter and not all(checkpoint.metadata.get(k) == v for k, v in filter.items()):
+            return
+        if limit is None or limit > 0:
+            yield checkpoint
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        checkpoint = {k: v for k, v in checkpoint.items() if k != "pending_sends"}
+        self.store.set(self._key(config), {
+            "id": checkpoint["id"],
+            "parent_id": config["configurable"].get("checkpoint_id"),
+            "checkpoint": _encode(self.serde.dumps_typed(checkpoint)),
+            "metadata": _encode(self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))),
+            "writes": [],
+        })
+        return {"configurable": {"thread_id": config["configurable"]["thread_id"],
+                                 "checkpoint_ns": config["configurable"].get("checkpoint_ns", ""),
+                                 "checkpoint_id": checkpoint["id"]}}
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        encoded = [[task_id, channel, _encode(self.serde.dumps_typed(value))] for channel, value in writes]
+
+        def add_writes(record):
+            # Writes of a checkpoint that has been replaced meanwhile are dropped
+            if record is None or record["id"] != config["configurable"].get("checkpoint_id"):
+                return None
+            record["writes"].extend(encoded)
+            return record
+
+        # Atomic, so concurrent tasks (or replicas) do not drop each other's writes
+        self.store.update(self._key(config), add_writes)
+
+    def delete_thread(self, thread_id):
+        self.store.delete(f"checkpoint:{thread_id}:")
+
+
+# ==== State ====
+class ChatState(TypedDict):
+    email: str
+    summary: dict
+    question_count: int
+    interactions: list
+    finished: bool
+    frustration_detected: bool
+    # 0..1 information-sufficiency score after the latest answer (utils/sufficiency.py)
+    sufficiency: float
+    meeting_link: str
+    meeting_job: str
+
+# ==== Nodes ====
+@instrument(kind="node")
+def start_chat_node(state: ChatState) -> ChatState:
+    #print(f"Start Chat at {datetime.now()}")
+    if not state["interactions"]:
+        result = start_chat(state["email"], state["summary"].get('questions', {}))
+        # Failed calls already answer with the degraded greeting; this covers an empty message
+        first_q = result.get("message") or DEGRADED_GREETING
+        state["interactions"].append({"question": first_q, "answer": "", "sentiment": ""})
+        state["question_count"] += 1
+    return state
+
+
+
+def next_question_context(interactions):
+    session = st.session_state["session"]
+    return {
+        "email": session.get("email_text", ""),
+        "questions": (session.get("summary") or {}).get("questions", {}),
+        "previous": interactions,
+        "conversation": st.session_state["conversation"]
+    }
+
+def take_pending_turn():
+    turn = st.session_state.get("pending_turn")
+    st.session_state["pending_turn"] = None
+    return turn
+
+@instrument(kind="node")
+def ask_next(state: ChatState) -> ChatState:
+    if state["finished"] == False:
+        turn = take_pending_turn()
+        # Show the question while it is being generated instead of after the full response
+        if turn is not None and turn.has_question:
+            context = turn.context
+            streamed = st.write_stream(turn.question_deltas())
+            result = turn.result
+            if turn.conversation is not None:
+                st.session_state["conversation"] = turn.conversation
+        else:
+            context = next_question_context(state["interactions"])
+            result = {}
+            try:
+                streamed = st.write_stream(stream_next_question(context, result))
+            except Exception as e:
+                # Failures the stream does not degrade itself, e.g. a provider error after the retries
+                streamed, result["error"] = "", str(e)
+        q = result.get("question") or streamed
+        if "error" in result or not isinstance(q, str) or not q.strip():
+            # A suggested question not asked yet, as degrades_to answers when the model is unavailable
+            q = degraded_question(result.get("error") or "empty question", context)["question"]
+        state["interactions"].append({"question": q, "answer": "", "sentiment": ""})
+        state["question_count"] += 1
+    return state
+
+@instrument(kind="node")
+def wait_for_input(state: ChatState) -> ChatState:
+    #print("WAIT")
+    #Place holder to give control back to Streamlit
+    return state
+
+@instrument(kind="node")
+def record_response(state: ChatState) -> ChatState:
+    #print("RECORD RESPONSE")
+    user_input = st.session_state.get("chat_input", "").strip()
+    if user_input and state["interactions"]: #and not state["interactions"][-1]["answer"]:
+        for interaction in state["interactions"]:
+            if interaction["answer"]== "":
+                interaction.update({"answer": user_input, "sentiment": ""})
+                # Sentiment and the speculative next question run in parallel
+                turn = take_pending_turn()
+                if turn is None or turn.answer != user_input:
+                    if turn is not None:
+                        turn.cancel()
+                    answered = [dict(i) for i in state["interactions"]]
+                    turn = start_turn(user_input, next_question_context(answered))
+                st.session_state["pending_turn"] = turn
+
+                sentiment_data = turn.sentiment()
+                sentiment = sentiment_data.get("sentiment_identified", "Neutral")
+                interaction["sentiment"] = sentiment
+                if sentiment in ["Frustrated", "Angry"]:
+                    state["frustration_detected"] = True
+                    state["finished"] = True
+                break
+    return state
+
+@instrument(kind="node")
+def assess_sufficiency(state: ChatState) -> ChatState:
+    # Scored on the turn record_response just started; no new answer, no new score
+    turn = st.session_state.get("pending_turn")
+    if not state["finished"] and turn is not None:
+        state["sufficiency"] = turn.sufficiency()["score"]
+    return state
+
+@instrument(kind="node")
+def check_completion(state: ChatState) -> ChatState:
+    # Ends once enough detail is collected, or at the question limit
+    if not state["frustration_detected"] and should_stop(state):
+        state["finished"] = True
+    if state["finished"]:
+        # The chat ends here, so the speculative question is not needed
+        turn = take_pending_turn()
+        if turn is not None:
+            turn.cancel()
+    return state
+
+def route_after_check(state: ChatState) -> str:
+    return "schedule" if state["finished"] else "continue"
+
+@instrument(kind="node")
+def schedule_meeting(state: ChatState) -> ChatState:
+
+    if state["frustration_detected"] in ["Frustrated", "Angry"] or state["finished"] == True:
+        reason = "frustration" if state["frustration_detected"] else should_stop(state) or "max_questions"
+        record_chat_end(sum(1 for i in state["interactions"] if i["answer"]), reason)
+        urgency = {
+            "email_text": state["email"],
+            "reasoning": {"frustration": "Frustrated customer",
+                          "sufficient": "Enough detail collected"}.get(reason, "Completed all questions"),
+            "urgency_identified": "High_Chat" if state["frustration_detected"] else "Medium_Chat"
+        }
+        job_id = uuid.uuid4().hex
+        results = get_results_store()
+        if results is not None:
+            # Queued before the job exists, so the booking is recorded after the escalation
+            results.record_escalation(st.session_state["session_id"], job_id)
+        # Booked by a background worker; the page polls the job for the Meet link
+        client_email = st.session_state["session"].get("client_email", "")
+        state["meeting_job"] = submit_escalation(client_email, state["summary"], urgency, state["interactions"], job_id=job_id)
+        state["finished"] = True
+    return state
+
+@instrument(kind="node")
+def end_chat(state: ChatState) -> ChatState:
+    st.success("Thank you for your responses. Our team will follow up.")
+    return state
+
+# ==== Graph ====
+def build_chat_graph():
+    graph = StateGraph(ChatState)
+
+    ask_node = RunnableLambda(ask_next)
+    record_node = RunnableLambda(record_response)
+    sufficiency_node = RunnableLambda(assess_sufficiency)
+    check_node = RunnableLambda(check_completion)
+    schedule_node = RunnableLambda(schedule_meeting)
+    end_node = RunnableLambda(end_chat)
+    wait_node = RunnableLambda(wait_for_input)
+
+    graph.add_node("ask_next", ask_node)
+    graph.add_node("wait_for_input", wait_node)
+    graph.add_node("record_response", record_node)
+    graph.add_node("assess_sufficiency", sufficiency_node)
+    graph.add_node("check_completion", check_node)
+    graph.add_node("schedule_meeting", schedule_node)
+    graph.add_node("end_chat", end_node)
+
+    graph.set_entry_point("record_response")
+
+    graph.add_edge("record_response", "assess_sufficiency")
+    graph.add_edge("assess_sufficiency", "check_completion")
+
+
+    graph.add_conditional_edges("check_completion", route_after_check, {
+        "continue": "ask_next",
+        "schedule": "schedule_meeting"
+    })
+    graph.add_edge("ask_next", "wait_for_input")
+    graph.add_edge("schedule_meeting", "end_chat")
+
+    return graph
+
+
+_app = None
+_app_lock = threading.Lock()
+
+
+def get_chat_app():
+    """Compiled chat graph shared by every Streamlit session of this process."""
+    global _app
+    with _app_lock:
+        if _app is None:
+            _app = build_chat_graph().compile(checkpointer=StoreCheckpointer(get_session_store()))
+        return _app
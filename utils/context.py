@@ -0,0 +1,96 @@
+import os
+
+# CONVERSATION CONTEXT
+# Keeps the interaction history sent to generate_next_question within a fixed
+# token budget: the last turns stay verbatim, older turns are folded into a
+# running summary that is kept per session and only updated every few turns.
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "800"))
+CONTEXT_KEEP_TURNS = int(os.getenv("CONTEXT_KEEP_TURNS", "3"))
+CONTEXT_EMAIL_TOKENS = int(os.getenv("CONTEXT_EMAIL_TOKENS", "600"))
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _encoding = None
+
+
+def count_tokens(text):
+    """Exact count with tiktoken when installed, otherwise the usual ~4 characters per token."""
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return max(1, len(text) // 4)
+
+
+def clip_to_tokens(text, max_tokens, keep="start"):
+    """Cut text down to roughly max_tokens, keeping its start or its end."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    if _encoding is not None:
+        tokens = _encoding.encode(text)
+        tokens = tokens[:max_tokens] if keep == "start" else tokens[-max_tokens:]
+        clipped = _encoding.decode(tokens)
+    else:
+        clipped = text[:max_tokens * 4] if keep == "start" else text[-max_tokens * 4:]
+    return clipped + " [...]" if keep == "start" else "[...] " + clipped
+
+
+def format_turn(number, qa):
+    return f"Q{number}: {qa['question']} | A: {qa['answer']} | Sentiment: {qa['sentiment']}"
+
+
+class ConversationContext:
+    """Per-session history window: running summary of old turns + last K turns verbatim."""
+
+    def __init__(self, token_budget=CONTEXT_TOKEN_BUDGET, keep_turns=CONTEXT_KEEP_TURNS):
+        self.token_budget = token_budget
+        self.keep_turns = keep_turns
+        self.summary = ""
+        self.folded = 0          # number of turns already folded into the summary
+        self.prompt_tokens = []  # prompt size of every generated question
+
+    def _fold(self, turns, until, summarize):
+        if until <= self.folded:
+            return
+        new_turns = "\n".join(format_turn(self.folded + i + 1, qa) for i, qa in enumerate(turns[self.folded:until]))
+        self.summary = summarize(self.summary, new_turns)
+        self.folded = until
+
+    def render(self, interactions, summarize):
+        """History string for the prompt; summarize(previous_summary, new_turns) -> str."""
+        turns = list(interactions)
+        # Fold in blocks of keep_turns so the summary is not rewritten on every turn
+        if len(turns) - self.folded > 2 * self.keep_turns:
+            self._fold(turns, len(turns) - self.keep_turns, summarize)
+
+        recent = [format_turn(self.folded + i + 1, qa) for i, qa in enumerate(turns[self.folded:])]
+        # Still over budget (long answers): fold more, down to a single verbatim turn
+        while len(recent) > 1 and count_tokens(self.summary) + count_tokens("\n".join(recent)) > self.token_budget:
+            self._fold(turns, self.folded + 1, summarize)
+            recent = recent[1:]
+
+        summary = clip_to_tokens(self.summary, self.token_budget // 2) if self.summary else ""
+        lines = [f"Summary of earlier turns: {summary}"] if summary else []
+        return "\n".join(lines + recent)
+
+    def to_dict(self):
+        return {"summary": self.summary, "folded": self.folded, "prompt_tokens": self.prompt_tokens}
+
+    @classmethod
+    def from_dict(cls, data, **kwargs):
+        context = cls(**kwargs)
+        context.summary = data.get("summary", "")
+        context.folded = data.get("folded", 0)
+        context.prompt_tokens = list(data.get("prompt_tokens", []))
+        return context
+
+    def copy(self):
+        return ConversationContext.from_dict(self.to_dict(), token_budget=self.token_budget,
+                                             keep_turns=self.keep_turns)
+
+    def record_prompt(self, prompt):
+        tokens = count_tokens(prompt)
+        self.prompt_tokens.append(tokens)
+        return tokens
@@ -3,26 +3,52 @@ import streamlit as st
 from datetime import datetime, timedelta, timezone
 import pickle
 import os
+import threading
 
-from google.auth.transport.requests import Request
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+from utils.scheduler import BusyIndex
+from utils.telemetry import instrument
 
 # GOOGLE CALENDAR
 CALENDAR_ID = 'primary'
+SERVICE_ACCOUNT_FILE = 'oauth_credentials.json'
+SCOPES = ['https://www.googleapis.com/auth/calendar']
+TOKEN_PATH = "token.pkl"
+# Refresh the access token this long before it actually expires
+REFRESH_MARGIN = timedelta(minutes=5)
+# Point the client at another server (e.g. a local mock of the Calendar API)
+CALENDAR_API_ROOT = os.getenv("CALENDAR_API_ROOT", "")
+# Socket timeout of every Calendar call, kept well under JOB_LEASE (utils/jobs.py)
+# so a stuck call fails the job attempt before another worker reclaims it
+CALENDAR_TIMEOUT = float(os.getenv("CALENDAR_TIMEOUT", "30"))
+# Google accepts at most 50 calls per batch request
+MAX_BATCH_SIZE = 50
+# Earlier slots go to the more urgent escalations
+URGENCY_RANK = {"Critical": 0, "High": 1, "High_Chat": 2, "Medium": 3, "Medium_Chat": 4, "Low": 5}
 #st.set_page_config(page_title = 'AI Support Agent Simulator', layout = "centered")
-#@st.cache_resource
 
-def get_calendar_service():
-    SERVICE_ACCOUNT_FILE = 'oauth_credentials.json'
-    SCOPES = ['https://www.googleapis.com/auth/calendar']
+# Nothing here runs at import time: credentials and the service are created on
+# the first calendar call and then shared by every session of the process.
+_credentials = None
+_service = None
+_lock = threading.Lock()
+# Token refreshes go over the network, so they take their own lock instead of _lock
+_refresh_lock = threading.Lock()
+_local = threading.local()
+
+def _load_credentials():
+    from google.auth.transport.requests import Request
+    from google_auth_oauthlib.flow import InstalledAppFlow
 
     credentials = None
-    token_path = "token.pkl"
+
+    if CALENDAR_API_ROOT and not os.path.exists(TOKEN_PATH):
+        # Local mock server: no OAuth needed
+        from google.auth.credentials import AnonymousCredentials
+        return AnonymousCredentials()
 
     #---- For personal account use ----
-    if os.path.exists(token_path):
-        with open(token_path, "rb") as token:
+    if os.path.exists(TOKEN_PATH):
+        with open(TOKEN_PATH, "rb") as token:
             credentials = pickle.load(token)
 
     if not credentials or not credentials.valid:
@@ -36,8 +62,7 @@ def get_calendar_service():
             
             credentials = flow.run_local_server(port=8765)
 
-        with open(token_path, "wb") as token:
-            pickle.dump(credentials, token)
+        _save_credentials(credentials)
 
     #---- For service accounts use -----
     #SCOPES = ['https://www.googleapis.com/auth/calendar']
@@ -46,47 +71,90 @@ def get_calendar_service():
     #     SERVICE_ACCOUNT_FILE, scopes = SCOPES
     # )
 
-    return build('calendar', 'v3', credentials = credentials)
+    return credentials
 
-calendar_service = get_calendar_service()
+def _save_credentials(credentials):
+    with open(TOKEN_PATH, "wb") as token:
+        pickle.dump(credentials, token)
 
-def find_next_available_slot(duration_minutes = 15, search_hours = 2):
-    now = datetime.now(timezone.utc)
-    end_search = now + timedelta(hours = search_hours)
-    check_start = now + timedelta(minutes = 5)
+def _needs_refresh(credentials):
+    expiry = getattr(credentials, "expiry", None)
+    # google-auth keeps expiry as a naive UTC datetime
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return bool(expiry and expiry - now < REFRESH_MARGIN and getattr(credentials, "refresh_token", None))
 
-    body = {
-        "timeMin": check_start.isoformat(),
-        "timeMax": end_search.isoformat(),
-        "timeZone": "UTC",
-        "items":[{"id": "primary"}]
-    }
+def get_credentials():
+    """Shared credentials, refreshed ahead of expiry so concurrent requests never race on a 401 refresh.
 
-    freebusy_result = calendar_service.freebusy().query(body = body).execute()
-    busy_times = freebusy_result["calendars"]["primary"]["busy"]
+    Only the threads that find the token about to expire wait on _refresh_lock;
+    everyone else returns the current credentials without taking a lock.
+    """
+    global _credentials
+    credentials = _credentials
+    if credentials is not None and not _needs_refresh(credentials):
+        return credentials
+    with _refresh_lock:
+        if _credentials is None:
+            _credentials = _load_credentials()
+        elif _needs_refresh(_credentials):
+            from google.auth.transport.requests import Request
+            _credentials.refresh(Request())
+            _save_credentials(_credentials)
+        return _credentials
 
-    busy_sorted = sorted(busy_times, key=lambda b: b["start"])
-    free_start = check_start
+def get_calendar_service():
+    """Process-wide Calendar client, built from the discovery document bundled with googleapiclient."""
+    global _service
+    credentials = get_credentials()
+    with _lock:
+        if _service is None:
+            from googleapiclient.discovery import build
+            client_options = {"api_endpoint": CALENDAR_API_ROOT.rstrip("/") + "/calendar/v3/"} if CALENDAR_API_ROOT else None
+            _service = build('calendar', 'v3', credentials = credentials,
+                             static_discovery = True, cache_discovery = False,
+                             client_options = client_options)
+        return _service
 
-    for busy in busy_sorted:
-        busy_start = datetime.fromisoformat(busy["start"].replace("Z","+00:00"))
-        busy_end = datetime.fromisoformat(busy["end"].replace("Z","+00:00"))
+def _authorized_http():
+    # httplib2 connections are not thread-safe, so each thread gets its own
+    import google_auth_httplib2
+    import httplib2
 
-        if free_start + timedelta(minutes=duration_minutes) <= busy_start:
-            return free_start, free_start + timedelta(minutes=duration_minutes)
-        
-        if busy_end > free_start:
-            free_start = busy_end
+    credentials = get_credentials()
+    http = getattr(_local, "http", None)
+    if http is None or http.credentials is not credentials:
+        http = _local.http = google_auth_httplib2.AuthorizedHttp(credentials, http=httplib2.Http(timeout=CALENDAR_TIMEOUT))
+    return http
 
-    # Check at the end of busy times
-    if free_start + timedelta(minutes=duration_minutes) <= end_search:
-        return free_start, free_start + timedelta(minutes=duration_minutes)
+def execute(request):
+    """Execute a Calendar API request on this thread's connection."""
+    return request.execute(http=_authorized_http())
 
-    return None, None #None available slot found
+@instrument(kind="calendar")
+def fetch_busy(time_min, time_max):
+    body = {
+        "timeMin": time_min.isoformat(),
+        "timeMax": time_max.isoformat(),
+        "timeZone": "UTC",
+        "items":[{"id": CALENDAR_ID}]
+    }
+
+    freebusy_result = execute(get_calendar_service().freebusy().query(body = body))
+    busy_times = freebusy_result["calendars"][CALENDAR_ID]["busy"]
+
+    return [(datetime.fromisoformat(busy["start"].replace("Z","+00:00")),
+             datetime.fromisoformat(busy["end"].replace("Z","+00:00")))
+            for busy in busy_times]
 
-def create_calendar_event(client_email, summary, urgency = "Medium", interaction = None):
+# Shared by every session so concurrent escalations reserve different slots
+busy_index = BusyIndex(fetch_busy)
 
-    urgency_level = urgency.get("urgency_identified")
+def find_next_available_slot(duration_minutes = 15, search_hours = 2):
+    """Next free slot, without reserving it. Use busy_index.find_and_reserve when booking."""
+    return busy_index.find_slot(duration_minutes, search_hours)
+
+def build_event(client_email, summary, urgency, interaction, start_time, end_time):
+    urgency_level = urgency.get("urgency_identified") if isinstance(urgency, dict) else urgency
     suggested_questions = summary.get("questions", "No questions provided") if isinstance(summary, dict) else str(summary)
     summary_text = summary.get("summary", "No summary provided") if isinstance(summary, dict) else str(summary)
     
@@ -94,12 +162,8 @@ def create_calendar_event(client_email, summary, urgency = "Medium", interaction
         f"After analyzing the issue, AI agent suggests starting with these questions {suggested_questions}"
         f"Interaction in chat: {interaction}"
     )
-    start_time, end_time = find_next_available_slot()
-
-    if not start_time:
-        return None
 
-    event = {
+    return {
         'summary': f"{urgency_level} - Support Call: {client_email}",
         'description': f"{description_text}",
         'start': {'dateTime': start_time.replace(microsecond=0).isoformat(),
@@ -109,8 +173,109 @@ def create_calendar_event(client_email, summary, urgency = "Medium", interaction
         # when changing to Google Workspace domain
         #,'attendees': [{'email': client_email}],
     }
-    import pprint
-    pprint.pprint(event)
-    created_event = calendar_service.events().insert(calendarId = CALENDAR_ID, body=event).execute()
-    print(created_event.get('htmlLink'))
-    return created_event.get('htmlLink')
\ No newline at end of file
+
+@instrument(kind="calendar")
+def create_calendar_event(client_email, summary, urgency = "Medium", interaction = None, event_id = None):
+
+    reservation = busy_index.find_and_reserve()
+
+    if not reservation:
+        return None
+
+    event = build_event(client_email, summary, urgency, interaction, reservation.start, reservation.end)
+    if event_id:
+        # A client-chosen id makes retried inserts idempotent: the duplicate gets a 409
+        event['id'] = event_id
+    try:
+        created_event = execute(get_calendar_service().events().insert(calendarId = CALENDAR_ID, body=event))
+    except Exception as e:
+        busy_index.release(reservation)
+        if event_id and getattr(getattr(e, "resp", None), "status", None) == 409:
+            existing = execute(get_calendar_service().events().get(calendarId = CALENDAR_ID, eventId = event_id))
+            return existing.get('htmlLink')
+        raise
+    busy_index.confirm(reservation)
+    return created_event.get('htmlLink')
+
+def _urgency_rank(escalation):
+    urgency = escalation.get("urgency", "Medium")
+    level = urgency.get("urgency_identified") if isinstance(urgency, dict) else urgency
+    return URGENCY_RANK.get(level, len(URGENCY_RANK))
+
+def _new_batch(callback):
+    from googleapiclient.http import BatchHttpRequest
+
+    if CALENDAR_API_ROOT:
+        return BatchHttpRequest(callback=callback, batch_uri=CALENDAR_API_ROOT.rstrip("/") + "/batch/calendar/v3")
+    return get_calendar_service().new_batch_http_request(callback=callback)
+
+@instrument(kind="calendar")
+def create_calendar_events_batch(escalations):
+    """Schedule many escalations at once.
+
+    escalations is a list of dicts with the create_calendar_event arguments
+    (client_email, summary, urgency, interaction, event_id). Slots are
+    assigned in one pass, most urgent first, and the inserts go out as Google
+    API batch requests. Returns one {"link", "start", "error"} dict per
+    escalation, in the input order; an event_id that is already booked (a
+    retried batch) gets the existing event's link.
+    """
+    results = [{"link": None, "start": None, "error": None} for _ in escalations]
+    order = sorted(range(len(escalations)), key=lambda i: _urgency_rank(escalations[i]))
+    service = get_calendar_service()
+
+    pending = []
+    for i in order:
+        escalation = escalations[i]
+        reservation = busy_index.find_and_reserve()
+        if not reservation:
+            results[i]["error"] = "No available slot found"
+            continue
+        event = build_event(escalation.get("client_email", ""), escalation.get("summary", {}),
+                            escalation.get("urgency", "Medium"), escalation.get("interaction"),
+                            reservation.start, reservation.end)
+        if escalation.get("event_id"):
+            event['id'] = escalation["event_id"]
+        pending.append((i, reservation, event))
+
+    duplicates = []
+
+    def on_response(request_id, response, exception):
+        i, reservation = by_id[request_id]
+        if exception is not None:
+            busy_index.release(reservation)
+            if escalations[i].get("event_id") and getattr(getattr(exception, "resp", None), "status", None) == 409:
+                duplicates.append(i)
+            else:
+                results[i]["error"] = str(exception)
+        else:
+            busy_index.confirm(reservation)
+            results[i]["link"] = response.get("htmlLink")
+            results[i]["start"] = reservation.start.isoformat()
+
+    by_id = {}
+    for chunk_start in range(0, len(pending), MAX_BATCH_SIZE):
+        batch = _new_batch(on_response)
+        chunk = pending[chunk_start:chunk_start + MAX_BATCH_SIZE]
+        for i, reservation, event in chunk:
+            by_id[str(i)] = (i, reservation)
+            batch.add(service.events().insert(calendarId = CALENDAR_ID, body=event), request_id=str(i))
+        try:
+            execute(batch)
+        except Exception as e:
+            # The whole batch failed: free every slot that did not get a response
+            for i, reservation, _ in chunk:
+                if results[i]["link"] is None and results[i]["error"] is None and i not in duplicates:
+                    busy_index.release(reservation)
+                    results[i]["error"] = str(e)
+
+    for i in duplicates:
+        try:
+            existing = execute(service.events().get(calendarId = CALENDAR_ID, eventId = escalations[i]["event_id"]))
+        except Exception as e:
+            results[i]["error"] = str(e)
+            continue
+        results[i]["link"] = existing.get("htmlLink")
+        results[i]["start"] = existing.get("start", {}).get("dateTime")
+
+    return results
@@ -0,0 +1,275 @@
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+
+# BACKGROUND JOBS
+# Escalations (calendar scheduling) are queued in a local SQLite table and run
+# by a pool of worker threads, so Streamlit scripts return at once and poll for
+# the result. Jobs survive restarts: queued jobs, and running jobs whose lease
+# expired because their process died, are picked up again. Failures are retried
+# with jittered exponential backoff. While a handler runs, its worker renews the
+# lease every JOB_LEASE / 3 seconds, so only a dead process loses its jobs; the
+# handlers bound their own network calls (e.g. CALENDAR_TIMEOUT) so that a job
+# cannot hang forever while holding its lease.
+# The default file sits at the repository root, so every process (pages, the
+# benchmarks) shares one queue whatever its working directory
+JOBS_DB = os.getenv("JOBS_DB", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "jobs.db"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_BASE_BACKOFF = float(os.getenv("JOB_BASE_BACKOFF", "2"))
+JOB_MAX_BACKOFF = float(os.getenv("JOB_MAX_BACKOFF", "300"))
+JOB_LEASE = float(os.getenv("JOB_LEASE", "120"))
+# Workers also look for jobs queued by other processes this often
+JOB_POLL_INTERVAL = 1.0
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class RetryableJobError(Exception):
+    """Raise from a handler for an expected, temporary failure (logged without a traceback)."""
+
+
+def retry_delay(attempts):
+    return random.uniform(0.5, 1.0) * min(JOB_MAX_BACKOFF, JOB_BASE_BACKOFF * 2 ** (attempts - 1))
+
+
+class JobQueue:
+    """Persistent job queue with a worker thread pool. Handlers are registered per job kind."""
+
+    def __init__(self, path=JOBS_DB, workers=JOB_WORKERS, max_attempts=JOB_MAX_ATTEMPTS, lease_seconds=JOB_LEASE):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self._handlers = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._threads = []
+        self._stopping = False
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA busy_timeout=5000")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, kind TEXT NOT NULL, payload TEXT NOT NULL, "
+            "status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, "
+            "run_at REAL NOT NULL, lease_until REAL, result TEXT, error TEXT, "
+            "created REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_due ON jobs(status, run_at)")
+
+    def register(self, kind, handler):
+        """handler(payload, job_id) -> JSON-serialisable result; raising schedules a retry."""
+        self._handlers[kind] = handler
+
+    # ---- Queue operations ----
+    def submit(self, kind, payload, job_id=None):
+        job_id = job_id or uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, kind, payload, status, run_at, created, updated) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, json.dumps(payload), QUEUED, now, now, now),
+            )
+            self._wakeup.notify()
+        self.start()
+        return job_id
+
+    def get(self, job_id):
+        """{"id", "kind", "status", "attempts", "result", "error"} or None."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, kind, status, attempts, result, error, created, updated FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"id": row[0], "kind": row[1], "status": row[2], "attempts": row[3],
+                "result": json.loads(row[4]) if row[4] is not None else None,
+                "error": row[5], "created": row[6], "updated": row[7]}
+
+    def stats(self):
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return dict(rows)
+
+    def _claim(self):
+        """Take the next due job (atomically across processes). Returns (id, kind, payload, attempts) or None.
+
+        A running job whose lease expired counts that run as an attempt: it is
+        queued again, or failed once it used up max_attempts, so a job that
+        kills its process does not come back forever.
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute(
+                    "UPDATE jobs SET status = ?, error = ?, lease_until = NULL, updated = ? "
+                    "WHERE status = ? AND lease_until < ? AND attempts >= ?",
+                    (FAILED, "Lease expired: the worker died while running the job", now,
+                     RUNNING, now, self.max_attempts),
+                )
+                row = self._db.execute(
+                    "SELECT id, kind, payload, attempts FROM jobs "
+                    "WHERE (status = ? AND run_at <= ?) OR (status = ? AND lease_until < ?) "
+                    "ORDER BY run_at LIMIT 1",
+                    (QUEUED, now, RUNNING, now),
+                ).fetchone()
+                if row is not None:
+                    self._db.execute(
+                        "UPDATE jobs SET status = ?, attempts = attempts + 1, lease_until = ?, updated = ? WHERE id = ?",
+                        (RUNNING, now + self.lease_seconds, now, row[0]),
+                    )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        return row[0], row[1], json.loads(row[2]), row[3] + 1
+
+    def _finish(self, job_id, status, result=None, error=None, run_at=None):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, run_at = COALESCE(?, run_at), "
+                "lease_until = NULL, updated = ? WHERE id = ?",
+                (status, json.dumps(result) if result is not None else None, error, run_at, now, job_id),
+            )
+            if status == QUEUED:
+                self._wakeup.notify()
+
+    def _renew(self, job_id):
+        """Extend the lease of a job this worker is still running. Returns False once it is not running."""
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE jobs SET lease_until = ?, updated = ? WHERE id = ? AND status = ?",
+                (now + self.lease_seconds, now, job_id, RUNNING),
+            )
+        return cursor.rowcount > 0
+
+    def _heartbeat(self, job_id, finished):
+        interval = self.lease_seconds / 3 or JOB_POLL_INTERVAL
+        while not finished.wait(interval):
+            if not self._renew(job_id):
+                return
+
+    def _run(self, job_id, kind, payload, attempts):
+        handler = self._handlers.get(kind)
+        if handler is None:
+            self._finish(job_id, FAILED, error=f"No handler registered for job kind '{kind}'")
+            return
+        finished = threading.Event()
+        threading.Thread(target=self._heartbeat, args=(job_id, finished), name=f"job-lease-{job_id}", daemon=True).start()
+        try:
+            result = handler(payload, job_id)
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            if not isinstance(e, RetryableJobError):
+                traceback.print_exc()
+            if attempts >= self.max_attempts:
+                self._finish(job_id, FAILED, error=error)
+            else:
+                self._finish(job_id, QUEUED, error=error, run_at=time.time() + retry_delay(attempts))
+            return
+        finally:
+            finished.set()
+        self._finish(job_id, DONE, result=result)
+
+    # ---- Workers ----
+    def _worker(self):
+        while not self._stopping:
+            job = self._claim()
+            if job is None:
+                with self._lock:
+                    self._wakeup.wait(timeout=self._next_due_in())
+                continue
+            self._run(*job)
+
+    def _next_due_in(self):
+        """Seconds until the next retry is due, capped by the poll interval. Caller holds _lock."""
+        row = self._db.execute("SELECT MIN(run_at) FROM jobs WHERE status = ?", (QUEUED,)).fetchone()
+        if row[0] is None:
+            return JOB_POLL_INTERVAL
+        return min(JOB_POLL_INTERVAL, max(0.0, row[0] - time.time()))
+
+    def start(self):
+        """Start the worker threads once; also resumes jobs left over from an earlier run."""
+        with self._lock:
+            if self._threads:
+                return
+            self._stopping = False
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=5):
+        with self._lock:
+            self._stopping = True
+            self._wakeup.notify_all()
+            threads, self._threads = self._threads, []
+        for thread in threads:
+            thread.join(timeout)
+
+
+# ==== Escalations ====
+ESCALATION = "escalation"
+
+
+def _schedule_escalation(payload, job_id):
+    # Imported here so that importing this module does not pull in the Google client
+    from utils.f_calendar import create_calendar_event
+
+    # The job id doubles as the Calendar event id, so a retry after a lost response does not book twice
+    link = create_calendar_event(payload["client_email"], payload["summary"], payload["urgency"],
+                                 payload.get("interaction"), event_id=job_id)
+    if not link:
+        raise RetryableJobError("No available slot found")
+    from utils.results_store import get_results_store
+    results = get_results_store()
+    if results is not None:
+        results.record_scheduled(job_id, link)
+    return {"link": link}
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """Process-wide queue; the workers start with the first job or lookup."""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue()
+            _queue.register(ESCALATION, _schedule_escalation)
+            _queue.start()
+        return _queue
+
+
+def submit_escalation(client_email, summary, urgency, interaction=None, job_id=None):
+    """Queue a 15-minute call; returns the job id to poll with escalation_status().
+
+    Pass job_id to record the job elsewhere before a worker can pick it up.
+    """
+    return get_job_queue().submit(ESCALATION, {
+        "client_email": client_email,
+        "summary": summary,
+        "urgency": urgency,
+        "interaction": interaction,
+    }, job_id)
+
+
+def escalation_status(job_id):
+    """(status, meeting link or None, error or None) of an escalation job."""
+    job = get_job_queue().get(job_id) if job_id else None
+    if job is None:
+        return FAILED, None, "Unknown scheduling job"
+    link = (job["result"] or {}).get("link")
+    return job["status"], link, job["error"]
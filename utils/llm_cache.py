@@ -0,0 +1,289 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from utils.providers import CircuitOpenError, DeadlineExceeded
+from utils.resilience import remaining
+
+# LLM RESPONSE CACHE
+# Two tiers: an in-process LRU (always on unless size is 0) and an optional
+# SQLite file shared by every process that points at the same path.
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "256"))
+LLM_CACHE_DB = os.getenv("LLM_CACHE_DB", "")
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "86400"))
+LLM_CACHE_DB_MAX_ENTRIES = int(os.getenv("LLM_CACHE_DB_MAX_ENTRIES", "10000"))
+
+
+def make_key(model, prompt, **params):
+    """Stable hash of everything that changes the model output."""
+    payload = json.dumps({"model": model, "prompt": prompt, "params": params},
+                         sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _LeaderGaveUp(Exception):
+    """The caller making a coalesced call stopped for a reason of its own; a waiting follower makes the call instead."""
+
+
+def _leaders_own(error):
+    """Whether error is about the leading caller rather than the call (cancelled, its deadline, an open circuit)."""
+    return not isinstance(error, Exception) or isinstance(error, (DeadlineExceeded, CircuitOpenError))
+
+
+class _InFlight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class LLMCache:
+    def __init__(self, max_entries=LLM_CACHE_SIZE, db_path=LLM_CACHE_DB,
+                 ttl_seconds=LLM_CACHE_TTL, max_db_entries=LLM_CACHE_DB_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_db_entries = max_db_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._async_in_flight = {}
+        self._counters = {"hits": 0, "memory_hits": 0, "disk_hits": 0,
+                          "misses": 0, "coalesced": 0, "evictions": 0}
+        self._db = None
+        self._db_lock = threading.Lock()
+        if db_path:
+            self._open_db(db_path)
+
+    # ---- Storage tiers ----
+    def _open_db(self, db_path):
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS llm_cache_accessed ON llm_cache(accessed)")
+        self._db.commit()
+
+    def _memory_get(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            value, created = entry
+            if time.time() - created > self.ttl_seconds:
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+            return value
+
+    def _memory_set(self, key, value, created=None):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._memory[key] = (value, created or time.time())
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+                self._counters["evictions"] += 1
+
+    def _disk_get(self, key):
+        if self._db is None:
+            return None, None
+        now = time.time()
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT value, created FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None, None
+            if now - row[1] > self.ttl_seconds:
+                self._db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._db.commit()
+                return None, None
+            self._db.execute("UPDATE llm_cache SET accessed = ? WHERE key = ?", (now, key))
+            self._db.commit()
+        return row[0], row[1]
+
+    def _disk_set(self, key, value):
+        if self._db is None:
+            return
+        now = time.time()
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            # TTL first, then trim the least recently used rows above the size cap
+            self._db.execute("DELETE FROM llm_cache WHERE created < ?", (now - self.ttl_seconds,))
+            count = self._db.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+            overflow = count - self.max_db_entries
+            if overflow > 0:
+                self._db.execute(
+                    "DELETE FROM llm_cache WHERE key IN "
+                    "(SELECT key FROM llm_cache ORDER BY accessed ASC LIMIT ?)",
+                    (overflow,),
+                )
+                self._counters["evictions"] += overflow
+            self._db.commit()
+
+    # ---- Public API ----
+    def get(self, key):
+        value = self._memory_get(key)
+        if value is not None:
+            self._count("hits", "memory_hits")
+            return value
+        value, created = self._disk_get(key)
+        if value is not None:
+            self._memory_set(key, value, created)
+            self._count("hits", "disk_hits")
+            return value
+        return None
+
+    def set(self, key, value):
+        self._memory_set(key, value)
+        self._disk_set(key, value)
+
+    def delete(self, key):
+        with self._lock:
+            self._memory.pop(key, None)
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._db.commit()
+
+    # Async callers share one event loop (utils.providers.run_async), so the SQLite
+    # tier is read and written from a worker thread instead of blocking it
+    async def aget(self, key):
+        value = self._memory_get(key)
+        if value is not None:
+            self._count("hits", "memory_hits")
+            return value
+        if self._db is None:
+            return None
+        return await asyncio.to_thread(self.get, key)
+
+    async def aset(self, key, value):
+        self._memory_set(key, value)
+        if self._db is not None:
+            await asyncio.to_thread(self._disk_set, key, value)
+
+    async def adelete(self, key):
+        if self._db is None:
+            self.delete(key)
+        else:
+            await asyncio.to_thread(self.delete, key)
+
+    def get_or_call(self, key, fn):
+        """Return the cached value or call fn once, even if several threads ask at the same time."""
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        while True:
+            with self._lock:
+                flight = self._in_flight.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._in_flight[key] = _InFlight()
+            if leader:
+                break
+            self._count("coalesced")
+            # A follower waits no longer than its own deadline
+            left = remaining()
+            if not flight.event.wait(None if left is None else max(0.0, left)):
+                raise DeadlineExceeded("Deadline exceeded waiting for an identical call in flight")
+            if flight.error is None:
+                return flight.value
+            if not isinstance(flight.error, _LeaderGaveUp):
+                raise flight.error
+            # The first follower to get here leads the call, the others follow it
+            value = self.get(key)
+            if value is not None:
+                return value
+
+        self._count("misses")
+        try:
+            flight.value = fn()
+            self.set(key, flight.value)
+            return flight.value
+        except BaseException as e:
+            flight.error = _LeaderGaveUp() if _leaders_own(e) else e
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            flight.event.set()
+
+    async def aget_or_call(self, key, coro_fn):
+        """Async counterpart of get_or_call: identical coroutines in flight share one call."""
+        value = await self.aget(key)
+        if value is not None:
+            return value
+
+        future = self._async_in_flight.get(key)
+        while future is not None and future.get_loop() is asyncio.get_running_loop():
+            self._count("coalesced")
+            # Waiting does not cancel the shared call; a follower waits no longer than its own deadline
+            done, _ = await asyncio.wait({future}, timeout=remaining())
+            if not done:
+                raise DeadlineExceeded("Deadline exceeded waiting for an identical call in flight")
+            try:
+                return future.result()
+            except _LeaderGaveUp:
+                # The first follower woken up leads the call, the others follow it
+                value = await self.aget(key)
+                if value is not None:
+                    return value
+                future = self._async_in_flight.get(key)
+
+        self._count("misses")
+        future = asyncio.get_running_loop().create_future()
+        self._async_in_flight[key] = future
+        try:
+            value = await coro_fn()
+        except BaseException as e:
+            # Cancelling the leader (a hedge loser) or its own deadline running out must not fail the
+            # other sessions' calls; they re-raise any other error
+            future.set_exception(_LeaderGaveUp() if _leaders_own(e) else e)
+            # Mark it retrieved so the loop does not warn
+            future.exception()
+            raise
+        else:
+            future.set_result(value)
+            await self.aset(key, value)
+            return value
+        finally:
+            if self._async_in_flight.get(key) is future:
+                del self._async_in_flight[key]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["memory_entries"] = len(self._memory)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["saved_calls"] = stats["hits"] + stats["coalesced"]
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute("DELETE FROM llm_cache")
+                self._db.commit()
+
+    def _count(self, *names):
+        with self._lock:
+            for name in names:
+                self._counters[name] += 1
+
+
+llm_cache = LLMCache()
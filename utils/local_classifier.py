@@ -0,0 +1,250 @@
+"""Local TF-IDF + logistic regression classifiers distilled from LLM labels.
+
+The LLM labels logged by utils.backend (set TRIAGE_LOG_PATH) are used as
+training data. At runtime classify_sentiment/detect_urgency ask the local
+model first and only call the LLM when its confidence is below the threshold.
+
+Usage:
+    python -m utils.local_classifier train --log triage_log.jsonl --task sentiment
+    python -m utils.local_classifier evaluate --log triage_log.jsonl --task urgency
+"""
+import argparse
+import json
+import math
+import os
+import re
+import sys
+import threading
+from collections import Counter
+
+import numpy as np
+
+LOCAL_MODEL_DIR = os.getenv("LOCAL_MODEL_DIR", "models")
+LOCAL_CLASSIFIER_THRESHOLD = float(os.getenv("LOCAL_CLASSIFIER_THRESHOLD", "0.85"))
+
+TASK_LABELS = {
+    "sentiment": ["Neutral", "Angry", "Frustrated", "Stressed"],
+    "urgency": ["Low", "Medium", "High", "Critical"],
+}
+
+TOKEN_RE = re.compile(r"[a-z0-9']+")
+
+
+def tokenize(text):
+    words = TOKEN_RE.findall(text.lower())
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+class TfidfLogisticClassifier:
+    """Multinomial logistic regression over L2-normalised TF-IDF features (NumPy only)."""
+
+    def __init__(self, max_features=5000, min_df=2, l2=1e-4):
+        self.max_features = max_features
+        self.min_df = min_df
+        self.l2 = l2
+        self.vocabulary = {}
+        self.idf = None
+        self.labels = []
+        self.weights = None
+        self.bias = None
+
+    # ---- Features ----
+    def _fit_vocabulary(self, texts):
+        df = Counter()
+        for text in texts:
+            df.update(set(tokenize(text)))
+        terms = [t for t, n in df.most_common() if n >= self.min_df][:self.max_features]
+        self.vocabulary = {t: i for i, t in enumerate(terms)}
+        n_docs = len(texts)
+        self.idf = np.array([math.log((1 + n_docs) / (1 + df[t])) + 1 for t in terms], dtype=np.float32)
+
+    def _sparse_row(self, text):
+        counts = Counter(self.vocabulary[t] for t in tokenize(text) if t in self.vocabulary)
+        if not counts:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        idx = np.fromiter(counts.keys(), dtype=np.int64)
+        val = np.fromiter(counts.values(), dtype=np.float32) * self.idf[idx]
+        return idx, val / np.linalg.norm(val)
+
+    def _dense(self, rows):
+        X = np.zeros((len(rows), len(self.vocabulary)), dtype=np.float32)
+        for i, (idx, val) in enumerate(rows):
+            X[i, idx] = val
+        return X
+
+    # ---- Training ----
+    def fit(self, texts, labels, epochs=40, batch_size=128, lr=2.0, seed=0):
+        self._fit_vocabulary(texts)
+        self.labels = sorted(set(labels))
+        y = np.array([self.labels.index(l) for l in labels])
+        rows = [self._sparse_row(t) for t in texts]
+        n_features, n_classes = len(self.vocabulary), len(self.labels)
+        self.weights = np.zeros((n_features, n_classes), dtype=np.float32)
+        self.bias = np.zeros(n_classes, dtype=np.float32)
+
+        rng = np.random.default_rng(seed)
+        for _ in range(epochs):
+            order = rng.permutation(len(rows))
+            for start in range(0, len(order), batch_size):
+                batch = order[start:start + batch_size]
+                X = self._dense([rows[i] for i in batch])
+                probs = _softmax(X @ self.weights + self.bias)
+                probs[np.arange(len(batch)), y[batch]] -= 1
+                probs /= len(batch)
+                self.weights -= lr * (X.T @ probs + self.l2 * self.weights)
+                self.bias -= lr * probs.sum(axis=0)
+        return self
+
+    # ---- Inference ----
+    def predict_proba(self, text):
+        idx, val = self._sparse_row(text)
+        logits = val @ self.weights[idx] + self.bias
+        return _softmax(logits[None, :])[0]
+
+    def predict(self, text):
+        probs = self.predict_proba(text)
+        best = int(np.argmax(probs))
+        return self.labels[best], float(probs[best])
+
+    # ---- Serialization ----
+    # Terms and labels are stored as fixed-width unicode arrays, so loading a model
+    # file never unpickles anything (allow_pickle=False)
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        terms = sorted(self.vocabulary, key=self.vocabulary.get)
+        np.savez_compressed(
+            path, terms=np.array(terms, dtype=str), idf=self.idf,
+            labels=np.array(self.labels, dtype=str),
+            weights=self.weights, bias=self.bias,
+        )
+
+    @classmethod
+    def load(cls, path):
+        """Raises ValueError for a model file holding pickled objects (saved before terms were str arrays)."""
+        data = np.load(path, allow_pickle=False)
+        model = cls()
+        model.vocabulary = {t: i for i, t in enumerate(data["terms"].tolist())}
+        model.idf = data["idf"]
+        model.labels = data["labels"].tolist()
+        model.weights = data["weights"]
+        model.bias = data["bias"]
+        return model
+
+
+def _softmax(logits):
+    logits = logits - logits.max(axis=1, keepdims=True)
+    exp = np.exp(logits)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+# ==== Runtime lookup ====
+def model_path(task, model_dir=LOCAL_MODEL_DIR):
+    return os.path.join(model_dir, f"{task}_classifier.npz")
+
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def get_model(task):
+    """Load the model for task once per process; None when it has not been trained."""
+    with _models_lock:
+        if task not in _models:
+            path = model_path(task)
+            model = None
+            if os.path.exists(path):
+                try:
+                    model = TfidfLogisticClassifier.load(path)
+                except ValueError as e:
+                    # Every call goes to the LLM until the model is retrained
+                    print(f"local classifier {path} not loaded, retrain it: {e}", file=sys.stderr)
+            _models[task] = model
+        return _models[task]
+
+
+def predict_confident(task, text, threshold=LOCAL_CLASSIFIER_THRESHOLD):
+    """(label, confidence) when the local model is sure enough, otherwise None."""
+    model = get_model(task)
+    if model is None or not text.strip():
+        return None
+    label, confidence = model.predict(text)
+    if confidence < threshold:
+        return None
+    return label, confidence
+
+
+# ==== Training data ====
+def load_log(path, task):
+    texts, labels = [], []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get("task") == task and record.get("label") in TASK_LABELS[task]:
+                texts.append(record["text"])
+                labels.append(record["label"])
+    return texts, labels
+
+
+def split_holdout(texts, labels, holdout, seed=0):
+    order = np.random.default_rng(seed).permutation(len(texts))
+    cut = int(len(order) * (1 - holdout))
+    train, test = order[:cut], order[cut:]
+    return ([texts[i] for i in train], [labels[i] for i in train],
+            [texts[i] for i in test], [labels[i] for i in test])
+
+
+def evaluate(model, texts, labels, threshold=LOCAL_CLASSIFIER_THRESHOLD):
+    """Agreement with the LLM labels, overall and on the cases the model would answer alone."""
+    predictions = [model.predict(t) for t in texts]
+    agree = [p[0] == l for p, l in zip(predictions, labels)]
+    confident = [a for p, a in zip(predictions, agree) if p[1] >= threshold]
+    per_label = {}
+    for (pred, _), label in zip(predictions, labels):
+        stats = per_label.setdefault(label, {"support": 0, "correct": 0})
+        stats["support"] += 1
+        stats["correct"] += pred == label
+    return {
+        "samples": len(texts),
+        "threshold": threshold,
+        "accuracy_vs_llm": round(sum(agree) / len(agree), 4) if agree else None,
+        "coverage": round(len(confident) / len(texts), 4) if texts else None,
+        "accuracy_when_confident": round(sum(confident) / len(confident), 4) if confident else None,
+        "per_label_accuracy": {k: round(v["correct"] / v["support"], 4) for k, v in per_label.items()},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train or evaluate the local triage classifiers.")
+    parser.add_argument("command", choices=["train", "evaluate"])
+    parser.add_argument("--log", required=True, help="JSONL log written via TRIAGE_LOG_PATH")
+    parser.add_argument("--task", choices=sorted(TASK_LABELS), default="sentiment")
+    parser.add_argument("--holdout", type=float, default=0.2)
+    parser.add_argument("--threshold", type=float, default=LOCAL_CLASSIFIER_THRESHOLD)
+    parser.add_argument("--model-dir", default=LOCAL_MODEL_DIR)
+    args = parser.parse_args(argv)
+
+    texts, labels = load_log(args.log, args.task)
+    if not texts:
+        parser.error(f"No {args.task} samples found in {args.log}")
+    path = model_path(args.task, args.model_dir)
+
+    if args.command == "train":
+        train_x, train_y, test_x, test_y = split_holdout(texts, labels, args.holdout)
+        model = TfidfLogisticClassifier().fit(train_x, train_y)
+        report = evaluate(model, test_x, test_y, args.threshold) if test_x else {}
+        # Final model uses every sample; the report above is on unseen data
+        model = TfidfLogisticClassifier().fit(texts, labels)
+        model.save(path)
+        report["model_path"] = path
+    else:
+        model = TfidfLogisticClassifier.load(path)
+        report = evaluate(model, texts, labels, args.threshold)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
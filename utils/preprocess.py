@@ -0,0 +1,275 @@
+"""Email preprocessing before triage.
+
+Pasted and imported emails carry HTML markup, whole quoted reply chains,
+signatures and legal footers. preprocess_email() turns HTML into text, cuts
+quoted history and signatures, collapses whitespace and clips what is left to
+EMAIL_TOKEN_BUDGET tokens, keeping the start, where the newest message is. The
+triage prompts then only carry what the customer wrote this time.
+
+Usage:
+    python -m utils.preprocess INPUT [--show 3]
+
+INPUT is anything utils.batch_triage reads (mbox, .eml directory, JSONL); the
+report shows the tokens saved.
+"""
+import argparse
+import json
+import os
+import re
+import threading
+from html.parser import HTMLParser
+
+from utils.context import clip_to_tokens, count_tokens
+
+EMAIL_PREPROCESSING = os.getenv("EMAIL_PREPROCESSING", "1") == "1"
+EMAIL_TOKEN_BUDGET = int(os.getenv("EMAIL_TOKEN_BUDGET", "1000"))
+
+HTML_RE = re.compile(r"<\s*(html|body|div|p|br|table|span|blockquote|font)\b", re.I)
+BLOCK_TAGS = {"p", "div", "br", "li", "tr", "table", "ul", "ol", "blockquote", "hr",
+              "h1", "h2", "h3", "h4", "h5", "h6", "title", "pre"}
+VOID_TAGS = {"br", "hr", "img", "meta", "link", "input", "col", "area", "base", "wbr"}
+SKIP_TAGS = {"script", "style", "head"}
+# Containers mail clients put the quoted message in
+QUOTE_CLASSES = {"gmail_quote", "yahoo_quoted", "moz-cite-prefix"}
+QUOTE_IDS = {"divrplyfwdmsg", "appendonsend", "mail-editor-reference-message-container"}
+
+# First line of a quoted message; everything from it on is history
+REPLY_HEADER_RE = re.compile(
+    r"^(on\s.{4,200}\swrote:"
+    r"|-{2,}\s*original message\s*-{2,}"
+    r"|_{10,}"
+    r"|le\s.{4,200}\sa écrit\s?:"
+    r"|el\s.{4,200}\sescribió:"
+    r"|am\s.{4,200}\sschrieb\s.{0,100}:)$",
+    re.I,
+)
+# Forwarded messages are the content, not history
+FORWARD_RE = re.compile(r"^(-+\s*forwarded message\s*-+|begin forwarded message:?|-+\s*mensaje reenviado\s*-+)$", re.I)
+# Outlook-style header block: From: followed by Sent:/Date: within a few lines
+HEADER_FIELD_RE = re.compile(r"^(from|de|von)\s*:", re.I)
+HEADER_DATE_RE = re.compile(r"^(sent|date|enviado|fecha|gesendet|datum)\s*:", re.I)
+# Any "Field: value" line of a header block (From, To, Cc, Subject, Asunto, Betreff, ...)
+HEADER_LINE_RE = re.compile(r"^[^\W\d][\w-]{0,20}\s*:")
+# "--" also opens markdown rules and pasted logs, so it only cuts in front of a contact block
+SIGNATURE_DELIMITER_RE = re.compile(r"^--\s*$")
+SIGNATURE_RE = re.compile(
+    r"^(sent from my .+|get outlook for .+|enviado desde mi .+)$"
+    r"|^(confidentiality notice|disclaimer)\b"
+    r"|^this (e-?mail|message)( and any (files|attachments)[^.]*)? (is|are|may be|contains?) .*(confidential|privileged|intended)",
+    re.I,
+)
+VALEDICTION_RE = re.compile(
+    r"^((best|kind|warm|warmest)\s+)?regards[,.!]?$|^best( wishes)?[,.!]?$|^cheers[,.!]?$|^sincerely[,.!]?$"
+    r"|^(many\s+)?thanks( again| in advance)?[,.!]?$|^thank you( in advance)?[,.!]?$"
+    r"|^(saludos|atentamente|un saludo)[,.!]?$",
+    re.I,
+)
+# A sign-off or "--" is only treated as one this close to the end
+VALEDICTION_MAX_TAIL = 8
+# What follows a sign-off must look like a name or contact block: short lines, no
+# sentences and no error output. Phone numbers are the only digit-heavy lines allowed.
+CONTACT_LINE_MAX = 60
+ERROR_TEXT_RE = re.compile(r"(error|exception)\b|\b(traceback|fail(ed|ure|s)?|crash(ed|es)?|warning|line \d+)\b"
+                           r"|\bat [\w.$<>]+\(|\w\(\)", re.I)
+PHONE_RE = re.compile(r"^([a-z]{1,6}\.?\s*:?\s*)?\+?[\d\s().\-/]{7,}$", re.I)
+ZERO_WIDTH_RE = re.compile("[\u200b\u200c\u200d\u2060\ufeff]")
+
+
+class _TextExtractor(HTMLParser):
+    """Visible text of an HTML email, with and without the quoted-message containers."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.text = []
+        self.unquoted = []
+        self._stack = []      # (tag, hidden, quoted) of the open elements
+        self._hidden = 0
+        self._quoted = 0
+
+    def _newline(self):
+        self.text.append("\n")
+        if not self._quoted:
+            self.unquoted.append("\n")
+
+    def handle_starttag(self, tag, attrs):
+        if tag in BLOCK_TAGS and not self._hidden:
+            self._newline()
+        if tag in VOID_TAGS:
+            return
+        attrs = dict(attrs)
+        hidden = tag in SKIP_TAGS
+        quoted = (tag == "blockquote"
+                  or bool(QUOTE_CLASSES & set((attrs.get("class") or "").split()))
+                  or (attrs.get("id") or "").lower() in QUOTE_IDS)
+        self._stack.append((tag, hidden, quoted))
+        self._hidden += hidden
+        self._quoted += quoted
+
+    def handle_endtag(self, tag):
+        if not any(open_tag == tag for open_tag, _, _ in self._stack):
+            return
+        # Also closes elements left open inside it
+        while self._stack:
+            open_tag, hidden, quoted = self._stack.pop()
+            self._hidden -= hidden
+            self._quoted -= quoted
+            if open_tag == tag:
+                break
+        if tag in BLOCK_TAGS and not self._hidden:
+            self._newline()
+
+    def handle_data(self, data):
+        if self._hidden:
+            return
+        self.text.append(data)
+        if not self._quoted:
+            self.unquoted.append(data)
+
+
+def html_to_text(markup):
+    """Text of an HTML email without the quoted message (unless nothing else is left)."""
+    parser = _TextExtractor()
+    parser.feed(markup)
+    parser.close()
+    unquoted = "".join(parser.unquoted)
+    return unquoted if unquoted.strip() else "".join(parser.text)
+
+
+def normalize_whitespace(text):
+    text = ZERO_WIDTH_RE.sub("", text.replace("\r\n", "\n").replace("\r", "\n").replace("\u00a0", " "))
+    lines = [re.sub(r"[ \t\f\v]+", " ", line).strip() for line in text.split("\n")]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+
+def _reply_header_at(lines, i):
+    line = lines[i].strip()
+    if REPLY_HEADER_RE.match(line):
+        return True
+    # "On <date>, <name> <address>" is often wrapped before "wrote:"
+    if i + 1 < len(lines) and line.lower().startswith("on ") and REPLY_HEADER_RE.match(f"{line} {lines[i + 1].strip()}"):
+        return True
+    if HEADER_FIELD_RE.match(line):
+        return any(HEADER_DATE_RE.match(l.strip()) for l in lines[i + 1:i + 5])
+    return False
+
+
+def strip_quoted(text):
+    """Drop ">" quoted lines and everything from the first reply header on.
+
+    A header with nothing but a forward marker above it is kept: then the quoted
+    part is all there is. The header block right after a forward marker is never
+    a reply header either, so a forward with a note above it keeps the forwarded
+    message; history quoted inside that message is still cut.
+    """
+    lines = [line for line in text.split("\n") if not line.lstrip().startswith(">")]
+    in_forward_header = False
+    for i, line in enumerate(lines):
+        line = line.strip()
+        if FORWARD_RE.match(line):
+            in_forward_header = True
+            continue
+        if in_forward_header:
+            # The forwarded header block runs up to the first line that is neither blank nor a field
+            if not line or HEADER_LINE_RE.match(line):
+                continue
+            in_forward_header = False
+        if _reply_header_at(lines, i) and any(l.strip() and not FORWARD_RE.match(l.strip()) for l in lines[:i]):
+            return "\n".join(lines[:i])
+    return "\n".join(lines)
+
+
+def _contact_line(line):
+    """True for a line of a name or contact block (name, title, company, address, phone, email)."""
+    if len(line) > CONTACT_LINE_MAX or "?" in line or "!" in line or ERROR_TEXT_RE.search(line):
+        return False
+    # A sentence reads like one (mostly lowercase words) or leads into more text; a name or title does not
+    words = line.split()
+    if len(words) >= 4 and (line[-1] in ":;" or sum(w[0].islower() for w in words) * 2 > len(words)):
+        return False
+    digits = sum(c.isdigit() for c in line)
+    return digits * 4 <= len(line) or bool(PHONE_RE.match(line))
+
+
+def _contact_block(lines):
+    content = [line.strip() for line in lines if line.strip()]
+    return len(content) <= VALEDICTION_MAX_TAIL and all(_contact_line(line) for line in content)
+
+
+def strip_signature(text):
+    """Cut the signature block, footers and a trailing sign-off with the sender's details.
+
+    "--" and sign-offs such as "Thanks!" only cut when everything after them is a
+    name or contact block; the customer often writes on after them.
+    """
+    lines = text.split("\n")
+    for i, line in enumerate(lines):
+        line = line.strip()
+        if not i or not any(l.strip() for l in lines[:i]):
+            continue
+        if SIGNATURE_RE.match(line) or (SIGNATURE_DELIMITER_RE.match(line) and _contact_block(lines[i + 1:])):
+            lines = lines[:i]
+            break
+    content = [i for i, line in enumerate(lines) if line.strip()]
+    for i in reversed(content[-VALEDICTION_MAX_TAIL:]):
+        if i != content[0] and VALEDICTION_RE.match(lines[i].strip()) and _contact_block(lines[i + 1:]):
+            lines = lines[:i]
+            break
+    return "\n".join(lines)
+
+
+_stats = {"emails": 0, "original_tokens": 0, "tokens": 0, "truncated": 0}
+_stats_lock = threading.Lock()
+
+
+def preprocess_email(text, max_tokens=EMAIL_TOKEN_BUDGET):
+    """(cleaned text, report) where report has original_tokens, tokens, tokens_saved and truncated."""
+    original_tokens = count_tokens(text)
+    if not EMAIL_PREPROCESSING or not text:
+        return text, {"original_tokens": original_tokens, "tokens": original_tokens,
+                      "tokens_saved": 0, "truncated": False}
+
+    cleaned = html_to_text(text) if HTML_RE.search(text) else text
+    cleaned = normalize_whitespace(strip_signature(strip_quoted(normalize_whitespace(cleaned))))
+    if not cleaned:
+        # Everything looked like history or a signature; better the whole email than nothing
+        cleaned = normalize_whitespace(text)
+    clipped = clip_to_tokens(cleaned, max_tokens, keep="start")
+    tokens = count_tokens(clipped)
+
+    with _stats_lock:
+        _stats["emails"] += 1
+        _stats["original_tokens"] += original_tokens
+        _stats["tokens"] += tokens
+        _stats["truncated"] += clipped is not cleaned
+    return clipped, {"original_tokens": original_tokens, "tokens": tokens,
+                     "tokens_saved": original_tokens - tokens, "truncated": clipped is not cleaned}
+
+
+def preprocess_stats():
+    """Tokens removed from the emails preprocessed by this process so far."""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["tokens_saved"] = stats["original_tokens"] - stats["tokens"]
+    stats["saved_ratio"] = round(stats["tokens_saved"] / stats["original_tokens"], 4) if stats["original_tokens"] else None
+    return stats
+
+
+def main(argv=None):
+    # Imported here: batch_triage pulls in the backend, which the stage itself does not need
+    from utils.batch_triage import iter_emails
+
+    parser = argparse.ArgumentParser(description="Report the tokens email preprocessing saves.")
+    parser.add_argument("input", help="mbox file, directory of .eml files or JSONL file")
+    parser.add_argument("--budget", type=int, default=EMAIL_TOKEN_BUDGET)
+    parser.add_argument("--show", type=int, default=0, help="Print this many cleaned emails")
+    args = parser.parse_args(argv)
+
+    for i, record in enumerate(iter_emails(args.input)):
+        cleaned, report = preprocess_email(record["email_text"], args.budget)
+        if i < args.show:
+            print(f"==== {record['id']} ({report['original_tokens']} -> {report['tokens']} tokens)\n{cleaned}\n")
+    print(json.dumps(preprocess_stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,641 @@
+import asyncio
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from utils.rate_limiter import rate_limiter
+from utils.resilience import breaker, latency, remaining
+
+# LLM PROVIDERS
+# Selected with LLM_PROVIDER=openai | bedrock | local. Every provider keeps one
+# keep-alive connection pool per process, uses explicit connect/read timeouts
+# and retries 429/5xx with jittered exponential backoff. Deadlines, hedging and
+# the circuit breaker are configured in utils/resilience.py.
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openai")
+LLM_MODEL = os.getenv("LLM_MODEL", "")
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "")
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "20"))
+# How structured (JSON) answers are requested from OpenAI-compatible endpoints:
+# tools (forced function call), json_object (JSON mode) or prompt (schema in the prompt)
+LLM_STRUCTURED_MODE = os.getenv("LLM_STRUCTURED_MODE", "tools")
+
+BASE_BACKOFF = 0.5
+MAX_BACKOFF = 20.0
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class ProviderError(Exception):
+    """Model call failure after retries, normalised across providers."""
+
+    def __init__(self, message, status_code=None, retry_after=None, retryable=False):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.retryable = retryable
+
+
+class DeadlineExceeded(ProviderError):
+    """The caller's deadline ran out before the model answered."""
+
+
+class CircuitOpenError(ProviderError):
+    """Calls are failing fast after repeated failures; retry_after is when the circuit is tried again."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Model circuit open after repeated failures, retrying in {retry_after:.0f}s",
+                         503, retry_after, retryable=True)
+
+
+def backoff_delay(attempt, retry_after=None):
+    """Full-jitter exponential backoff, unless the server said how long to wait."""
+    if retry_after:
+        return min(retry_after, MAX_BACKOFF)
+    return random.uniform(0, min(MAX_BACKOFF, BASE_BACKOFF * 2 ** attempt))
+
+
+def schema_instructions(json_schema):
+    return ("\n\nReturn only a JSON object, without markdown or backticks, "
+            "that matches this JSON schema:\n" + json.dumps(json_schema))
+
+
+# ==== Usage listeners ====
+# Called as listener(provider, usage) after every model call, with usage
+# {"prompt_tokens": int, "completion_tokens": int}. Retry listeners are called
+# as listener(provider, error) before every retry.
+_usage_listeners = []
+_retry_listeners = []
+
+
+def add_usage_listener(listener):
+    _usage_listeners.append(listener)
+
+
+def remove_usage_listener(listener):
+    if listener in _usage_listeners:
+        _usage_listeners.remove(listener)
+
+
+def _notify_usage(provider, usage):
+    if not usage:
+        return
+    for listener in list(_usage_listeners):
+        listener(provider, usage)
+
+
+def add_retry_listener(listener):
+    _retry_listeners.append(listener)
+
+
+def remove_retry_listener(listener):
+    if listener in _retry_listeners:
+        _retry_listeners.remove(listener)
+
+
+# ==== Hedge pools ====
+# A sync attempt that may be hedged runs in the primary pool and its second
+# request in the hedge pool, so a hedge never queues behind the requests it is
+# meant to overtake. A loser that cannot be cancelled is left to finish in its pool.
+_primary_executor = ThreadPoolExecutor(max_workers=LLM_POOL_SIZE, thread_name_prefix="llm-primary")
+_hedge_executor = ThreadPoolExecutor(max_workers=LLM_POOL_SIZE, thread_name_prefix="llm-hedge")
+# Free hedge threads; no hedge is sent while all of them are busy
+_hedge_slots = threading.BoundedSemaphore(LLM_POOL_SIZE)
+
+
+class LLMProvider:
+    name = "base"
+    structured_mode = "prompt"
+
+    def __init__(self, model, max_retries=LLM_MAX_RETRIES):
+        self.model = model
+        self.max_retries = max_retries
+        self.retries = 0
+
+    # When schema is given it is (name, json_schema) and the answer is that JSON object
+    def _complete_once(self, prompt, schema=None, **params):
+        """Return (text, usage)."""
+        raise NotImplementedError
+
+    async def _acomplete_once(self, prompt, schema=None, **params):
+        return await asyncio.to_thread(self._complete_once, prompt, schema, **params)
+
+    def _stream_once(self, prompt, schema=None, **params):
+        # Providers without native streaming hand back the whole answer as one chunk
+        text, usage = self._complete_once(prompt, schema, **params)
+        _notify_usage(self, usage)
+        yield text
+
+    def _classify_error(self, error):
+        """Return a ProviderError for transport/API failures, None for anything else."""
+        return None
+
+    def _retry_delay(self, error, attempt):
+        """Backoff before the next attempt; raises when the error is final."""
+        if isinstance(error, ProviderError):
+            # Already final (deadline, circuit)
+            raise error
+        provider_error = self._classify_error(error)
+        if provider_error is None:
+            raise error
+        left = remaining()
+        if left is not None and left <= 0:
+            raise DeadlineExceeded(f"Deadline exceeded: {provider_error}") from error
+        if not provider_error.retryable or attempt == self.max_retries:
+            raise provider_error from error
+        self.retries += 1
+        for listener in list(_retry_listeners):
+            listener(self, provider_error)
+        delay = backoff_delay(attempt, provider_error.retry_after)
+        if provider_error.status_code == 429:
+            # Every caller in the process holds off, not only this one
+            rate_limiter.pause(delay)
+        if left is not None and delay >= left:
+            raise DeadlineExceeded(f"Deadline exceeded before the next retry: {provider_error}") from error
+        return delay
+
+    # ---- Circuit breaker and deadline ----
+    @staticmethod
+    def _check_circuit():
+        wait_for = breaker.allow()
+        if wait_for > 0:
+            raise CircuitOpenError(wait_for)
+
+    @staticmethod
+    def _budget():
+        """Seconds left before the deadline (None without one); raises once it has passed."""
+        left = remaining()
+        if left is not None and left <= 0:
+            raise DeadlineExceeded("Deadline exceeded before the request was sent")
+        return left
+
+    @staticmethod
+    def _record_outcome(error=None):
+        if error is None:
+            breaker.record_success()
+        # A caller's short deadline says nothing about the provider's health
+        elif isinstance(error, ProviderError) and not isinstance(error, (CircuitOpenError, DeadlineExceeded)):
+            breaker.record_failure()
+
+    def _acquire(self, estimate):
+        try:
+            rate_limiter.acquire(estimate, timeout=self._budget())
+        except TimeoutError as e:
+            raise DeadlineExceeded(f"Deadline exceeded waiting for the rate limiter: {e}") from None
+
+    async def _aacquire(self, estimate):
+        try:
+            await rate_limiter.aacquire(estimate, timeout=self._budget())
+        except TimeoutError as e:
+            raise DeadlineExceeded(f"Deadline exceeded waiting for the rate limiter: {e}") from None
+
+    # ---- Single attempts, hedged ----
+    def _timed_once(self, prompt, schema, params):
+        start = time.perf_counter()
+        text, usage = self._complete_once(prompt, schema, **params)
+        return text, usage, time.perf_counter() - start
+
+    async def _atimed_once(self, prompt, schema, params):
+        start = time.perf_counter()
+        left = self._budget()
+        try:
+            text, usage = await asyncio.wait_for(self._acomplete_once(prompt, schema, **params), left)
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded("Deadline exceeded while waiting for the model") from None
+        return text, usage, time.perf_counter() - start
+
+    def _started_once(self, started, prompt, schema, params):
+        started.set()
+        return self._timed_once(prompt, schema, params)
+
+    def _hedge_once(self, prompt, schema, params, estimate):
+        self._acquire(estimate)
+        return self._timed_once(prompt, schema, params)
+
+    async def _ahedge_once(self, prompt, schema, params, estimate):
+        await self._aacquire(estimate)
+        return await self._atimed_once(prompt, schema, params)
+
+    def _attempt(self, prompt, schema, params, estimate):
+        """(text, usage) of one attempt; sent twice when it is slower than usual (LLM_HEDGING)."""
+        key = schema[0] if schema else "text"
+        delay = latency.hedge_delay(key)
+        left = remaining()
+        if delay is None or (left is not None and left <= delay):
+            text, usage, seconds = self._timed_once(prompt, schema, params)
+            latency.record(key, seconds)
+            return text, usage
+
+        # The wait for the answers is bounded by the deadline, or by the client timeouts without one
+        timeout = left if left is not None else LLM_CONNECT_TIMEOUT + LLM_READ_TIMEOUT
+        until = time.monotonic() + timeout
+        started = threading.Event()
+        primary = _primary_executor.submit(contextvars.copy_context().run, self._started_once, started,
+                                           prompt, schema, params)
+        # The hedge delay counts from when the request is sent, not from when it was queued for a thread
+        started.wait(timeout)
+        done, _ = wait([primary], timeout=max(0.0, min(delay, until - time.monotonic())))
+        pending, hedge, error = {primary}, None, None
+        if not done and _hedge_slots.acquire(blocking=False):
+            hedge = _hedge_executor.submit(contextvars.copy_context().run, self._hedge_once,
+                                           prompt, schema, params, estimate)
+            hedge.add_done_callback(lambda _: _hedge_slots.release())
+            pending.add(hedge)
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, until - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                # The requests cannot be interrupted; those still queued are dropped
+                for other in pending:
+                    other.cancel()
+                if left is not None:
+                    raise DeadlineExceeded("Deadline exceeded while waiting for the model")
+                raise ProviderError(f"No answer from the model within {timeout:.0f}s", retryable=True)
+            for future in done:
+                if future.exception() is None:
+                    text, usage, seconds = future.result()
+                    if hedge is not None:
+                        latency.record_hedge(future is hedge)
+                    # The other request cannot be interrupted; its answer is dropped
+                    for other in pending:
+                        other.cancel()
+                    latency.record(key, seconds)
+                    return text, usage
+                error = error or future.exception()
+        raise error
+
+    async def _aattempt(self, prompt, schema, params, estimate):
+        key = schema[0] if schema else "text"
+        delay = latency.hedge_delay(key)
+        left = remaining()
+        if delay is None or (left is not None and left <= delay):
+            text, usage, seconds = await self._atimed_once(prompt, schema, params)
+            latency.record(key, seconds)
+            return text, usage
+        primary = asyncio.ensure_future(self._atimed_once(prompt, schema, params))
+        tasks = pending = {primary}
+        error = None
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                tasks = pending = {primary, asyncio.ensure_future(self._ahedge_once(prompt, schema, params, estimate))}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        text, usage, seconds = task.result()
+                        if len(tasks) > 1:
+                            latency.record_hedge(task is not primary)
+                        latency.record(key, seconds)
+                        return text, usage
+                    error = error or task.exception()
+            raise error
+        finally:
+            # The losing request is cancelled, which closes its connection
+            for task in pending:
+                task.cancel()
+
+    # Every attempt first waits for room under the process-wide rate limits (utils/rate_limiter.py)
+    def complete(self, prompt, schema=None, **params):
+        self._check_circuit()
+        estimate = rate_limiter.estimate(prompt, params.get("max_tokens"))
+        try:
+            for attempt in range(self.max_retries + 1):
+                self._acquire(estimate)
+                try:
+                    text, usage = self._attempt(prompt, schema, params, estimate)
+                except Exception as e:
+                    time.sleep(self._retry_delay(e, attempt))
+                    continue
+                rate_limiter.settle(estimate, usage)
+                _notify_usage(self, usage)
+                self._record_outcome()
+                return text
+        except Exception as e:
+            self._record_outcome(e)
+            raise
+
+    async def acomplete(self, prompt, schema=None, **params):
+        self._check_circuit()
+        estimate = rate_limiter.estimate(prompt, params.get("max_tokens"))
+        try:
+            for attempt in range(self.max_retries + 1):
+                await self._aacquire(estimate)
+                try:
+                    text, usage = await self._aattempt(prompt, schema, params, estimate)
+                except Exception as e:
+                    await asyncio.sleep(self._retry_delay(e, attempt))
+                    continue
+                rate_limiter.settle(estimate, usage)
+                _notify_usage(self, usage)
+                self._record_outcome()
+                return text
+        except Exception as e:
+            self._record_outcome(e)
+            raise
+
+    def stream(self, prompt, schema=None, **params):
+        """Yield text deltas as they arrive. Only the request before the first token is retried.
+
+        The deadline bounds every read of the stream; streams are not hedged.
+        """
+        self._check_circuit()
+        estimate = rate_limiter.estimate(prompt, params.get("max_tokens"))
+        for attempt in range(self.max_retries + 1):
+            try:
+                self._acquire(estimate)
+                chunks = self._stream_once(prompt, schema, **params)
+                try:
+                    first = next(chunks, None)
+                except Exception as e:
+                    time.sleep(self._retry_delay(e, attempt))
+                    continue
+            except Exception as e:
+                self._record_outcome(e)
+                raise
+            self._record_outcome()
+            if first is not None:
+                yield first
+            try:
+                yield from chunks
+            except Exception as e:
+                provider_error = self._classify_error(e)
+                if provider_error is None:
+                    raise
+                left = remaining()
+                if left is not None and left <= 0:
+                    raise DeadlineExceeded(f"Deadline exceeded while streaming: {provider_error}") from e
+                raise provider_error from e
+            return
+
+
+class OpenAICompatibleProvider(LLMProvider):
+    name = "openai"
+    default_model = "gpt-3.5-turbo"
+
+    def __init__(self, model=None, base_url=None, api_key=None, max_retries=LLM_MAX_RETRIES,
+                 connect_timeout=LLM_CONNECT_TIMEOUT, read_timeout=LLM_READ_TIMEOUT, pool_size=LLM_POOL_SIZE,
+                 structured_mode=LLM_STRUCTURED_MODE):
+        # Imported with the first provider rather than with the pages (about half a second)
+        import httpx
+        from openai import OpenAI
+
+        super().__init__(model or self.default_model, max_retries)
+        self.base_url = base_url or None
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self.structured_mode = structured_mode
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        # Retries are done here, with jitter, so the SDK must not retry as well
+        self.client = OpenAI(
+            api_key=self.api_key, base_url=self.base_url, max_retries=0, timeout=self.timeout,
+            http_client=httpx.Client(timeout=self.timeout, limits=self.limits),
+        )
+        # httpx async pools are bound to the event loop that created them; the pages share one (run_async)
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._async_lock = threading.Lock()
+
+    def _async_client(self):
+        import httpx
+        from openai import AsyncOpenAI
+
+        loop = asyncio.get_running_loop()
+        with self._async_lock:
+            async_client = self._async_clients.get(loop)
+            if async_client is None:
+                async_client = AsyncOpenAI(
+                    api_key=self.api_key, base_url=self.base_url, max_retries=0, timeout=self.timeout,
+                    http_client=httpx.AsyncClient(timeout=self.timeout, limits=self.limits),
+                )
+                self._async_clients[loop] = async_client
+        return async_client
+
+    def _request(self, prompt, schema, params):
+        request = {"model": self.model, "timeout": self._timeout(), **params}
+        if schema is not None:
+            name, json_schema = schema
+            if self.structured_mode == "tools":
+                request["tools"] = [{"type": "function", "function": {
+                    "name": name, "description": f"Return the {name} result", "parameters": json_schema}}]
+                request["tool_choice"] = {"type": "function", "function": {"name": name}}
+            else:
+                prompt += schema_instructions(json_schema)
+                if self.structured_mode == "json_object":
+                    request["response_format"] = {"type": "json_object"}
+        request["messages"] = [{"role": "user", "content": prompt}]
+        return request
+
+    def _timeout(self):
+        """Connect/read timeouts, shortened to the time left before the deadline."""
+        import httpx
+
+        left = remaining()
+        if left is None:
+            return self.timeout
+        left = max(0.001, left)
+        return httpx.Timeout(min(self.timeout.read, left), connect=min(self.timeout.connect, left))
+
+    @staticmethod
+    def _message_text(message):
+        if message.tool_calls:
+            return message.tool_calls[0].function.arguments
+        return message.content
+
+    @staticmethod
+    def _usage(response):
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return None
+        if isinstance(usage, dict):
+            # SDK versions without a typed usage field on stream chunks leave it as a dict
+            return {"prompt_tokens": usage.get("prompt_tokens", 0), "completion_tokens": usage.get("completion_tokens", 0)}
+        return {"prompt_tokens": usage.prompt_tokens, "completion_tokens": usage.completion_tokens}
+
+    def _complete_once(self, prompt, schema=None, **params):
+        response = self.client.chat.completions.create(**self._request(prompt, schema, params))
+        return self._message_text(response.choices[0].message), self._usage(response)
+
+    async def _acomplete_once(self, prompt, schema=None, **params):
+        response = await self._async_client().chat.completions.create(**self._request(prompt, schema, params))
+        return self._message_text(response.choices[0].message), self._usage(response)
+
+    def _stream_once(self, prompt, schema=None, **params):
+        response = self.client.chat.completions.create(
+            stream=True,
+            extra_body={"stream_options": {"include_usage": True}},
+            **self._request(prompt, schema, params)
+        )
+        try:
+            for chunk in response:
+                _notify_usage(self, self._usage(chunk))
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if delta.tool_calls:
+                    function = delta.tool_calls[0].function
+                    text = function.arguments if function else ""
+                else:
+                    text = delta.content
+                if text:
+                    yield text
+        finally:
+            # Also runs when the consumer stops early, so the connection is not left streaming
+            response.close()
+
+    def _classify_error(self, error):
+        import httpx
+        from openai import APIStatusError, APIConnectionError
+
+        if isinstance(error, APIStatusError):
+            try:
+                retry_after = float(error.response.headers.get("retry-after"))
+            except (TypeError, ValueError):
+                retry_after = None
+            return ProviderError(str(error), error.status_code, retry_after,
+                                 error.status_code in RETRYABLE_STATUS)
+        if isinstance(error, (APIConnectionError, httpx.TransportError)):
+            # Includes APITimeoutError; httpx errors surface while a stream is read
+            return ProviderError(str(error) or type(error).__name__, retryable=True)
+        return None
+
+
+class LocalHTTPProvider(OpenAICompatibleProvider):
+    """Any OpenAI-compatible server on the local network (vLLM, llama.cpp, a mock)."""
+    name = "local"
+    default_model = "local-model"
+
+    def __init__(self, model=None, base_url=None, api_key=None, **kwargs):
+        super().__init__(model, base_url or "http://localhost:8000/v1", api_key or "not-needed", **kwargs)
+
+
+class BedrockProvider(LLMProvider):
+    name = "bedrock"
+    default_model = "amazon.nova-lite-v1:0"
+
+    def __init__(self, model=None, region=None, max_retries=LLM_MAX_RETRIES,
+                 connect_timeout=LLM_CONNECT_TIMEOUT, read_timeout=LLM_READ_TIMEOUT, pool_size=LLM_POOL_SIZE):
+        # boto3 is only needed when Bedrock is the configured provider
+        import boto3
+        from botocore.config import Config
+
+        super().__init__(model or self.default_model, max_retries)
+        config = Config(
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            max_pool_connections=pool_size,
+            retries={"max_attempts": 1, "mode": "standard"},
+        )
+        self.client = boto3.client(
+            service_name="bedrock-runtime",
+            region_name=region or os.getenv("BEDROCK_REGION", "us-east-1"),
+            config=config,
+        )
+
+    def _complete_once(self, prompt, schema=None, **params):
+        if schema is not None:
+            prompt += schema_instructions(schema[1])
+        body = json.dumps({
+            "messages": [{"role": "user", "content": [{"text": prompt}]}],
+            **({"inferenceConfig": params} if params else {})
+        }).encode("utf-8")
+        response = self.client.invoke_model(
+            modelId=self.model,
+            body=body,
+            accept="application/json",
+            contentType="application/json"
+        )
+        response_body = json.loads(response.get("body").read().decode("utf-8"))
+        usage = response_body.get("usage") or {}
+        return response_body["output"]["message"]["content"][0]["text"], {
+            "prompt_tokens": usage.get("inputTokens", 0),
+            "completion_tokens": usage.get("outputTokens", 0),
+        }
+
+    def _classify_error(self, error):
+        from botocore.exceptions import ClientError, ConnectionError as BotoConnectionError, ReadTimeoutError
+
+        if isinstance(error, ClientError):
+            code = error.response.get("Error", {}).get("Code", "")
+            status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+            if code in ("ThrottlingException", "TooManyRequestsException"):
+                status = 429
+            return ProviderError(str(error), status, retryable=status in RETRYABLE_STATUS)
+        if isinstance(error, (BotoConnectionError, ReadTimeoutError)):
+            return ProviderError(str(error), retryable=True)
+        return None
+
+
+PROVIDERS = {
+    "openai": OpenAICompatibleProvider,
+    "local": LocalHTTPProvider,
+    "bedrock": BedrockProvider,
+}
+
+_provider = None
+_provider_lock = threading.Lock()
+
+
+def create_provider(name=LLM_PROVIDER, model=LLM_MODEL, base_url=LLM_BASE_URL):
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown LLM_PROVIDER '{name}', expected one of {sorted(PROVIDERS)}")
+    if name == "bedrock":
+        return BedrockProvider(model=model or None)
+    return PROVIDERS[name](model=model or None, base_url=base_url or None)
+
+
+def get_provider():
+    """Process-wide provider so every session shares the same connection pool."""
+    global _provider
+    with _provider_lock:
+        if _provider is None:
+            _provider = create_provider()
+        return _provider
+
+
+def preload_provider():
+    """Create the provider in a background thread, so the first request does not wait for the client imports."""
+    def preload():
+        try:
+            get_provider()
+        except Exception:
+            pass  # raised again by the first request
+
+    if _provider is None:
+        threading.Thread(target=preload, name="llm-preload", daemon=True).start()
+
+
+def set_provider(provider):
+    global _provider
+    with _provider_lock:
+        _provider = provider
+
+
+# ==== Shared event loop ====
+# Async clients and their connection pools belong to the event loop that created
+# them, so synchronous callers (the pages) run their coroutines on one long-lived
+# loop instead of a new asyncio.run loop, and a new pool, per click.
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_event_loop():
+    """Process-wide event loop running on a daemon thread."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="llm-loop", daemon=True).start()
+        return _loop
+
+
+def run_async(coro):
+    """Run a coroutine on the shared event loop from synchronous code and return its result.
+
+    The caller's context variables (request context, deadline) are copied to the coroutine.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result()
@@ -0,0 +1,319 @@
+import asyncio
+import collections
+import contextlib
+import os
+import threading
+import time
+from contextvars import ContextVar
+
+from utils.context import count_tokens
+
+# RATE LIMITER
+# Every model request (retries included) waits here for room under the
+# provider's requests-per-minute and tokens-per-minute limits, so the process
+# slows down before the provider answers with 429s. Waiting requests are served
+# by priority class, from the urgency of the ticket and the type of call, and
+# round-robin across sessions within a class, so one busy chat or a batch run
+# cannot starve the others. Off while both limits are 0.
+LLM_RPM_LIMIT = int(os.getenv("LLM_RPM_LIMIT", "0"))
+LLM_TPM_LIMIT = int(os.getenv("LLM_TPM_LIMIT", "0"))
+# Completion tokens counted for a request until its real usage is known
+LLM_COMPLETION_ESTIMATE = int(os.getenv("LLM_COMPLETION_ESTIMATE", "200"))
+# Recent waits kept per priority class for the percentiles
+RATE_LIMIT_WINDOW = 1000
+
+# Lower is served first; requests are ordered by urgency, then by call type within an urgency
+URGENCY_RANK = {"Critical": 0, "High": 1, "Medium": 2, "Low": 3}
+CALL_RANK = {"chat": 0, "triage": 1, "batch": 2}
+DEFAULT_URGENCY = "Medium"
+DEFAULT_CALL_TYPE = "triage"
+
+_request = ContextVar("llm_request", default={})
+
+
+def priority_for(urgency=None, call_type=None):
+    """Priority class: urgency rank * len(CALL_RANK) + call rank, so a Critical batch call still beats a Low chat."""
+    return (URGENCY_RANK.get(urgency, URGENCY_RANK[DEFAULT_URGENCY]) * len(CALL_RANK)
+            + CALL_RANK.get(call_type, CALL_RANK[DEFAULT_CALL_TYPE]))
+
+
+def set_request_context(**fields):
+    """Tag the model calls made from here on in this context (e.g. a Streamlit script run).
+
+    Fields: urgency ("Low" .. "Critical"), call_type ("chat", "triage", "batch")
+    and session (fair-queuing key). None values are ignored.
+    """
+    _request.set({**_request.get(), **{k: v for k, v in fields.items() if v is not None}})
+
+
+def current_request():
+    """Fields set for the model calls of this context."""
+    return dict(_request.get())
+
+
+@contextlib.contextmanager
+def request_context(**fields):
+    """set_request_context() for the calls made inside the with block only."""
+    token = _request.set(_request.get())
+    try:
+        set_request_context(**fields)
+        yield
+    finally:
+        _request.reset(token)
+
+
+class TokenBucket:
+    """Refills continuously at per_minute / 60 per second, holding at most a minute's worth."""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        self._refill(now)
+        # A request larger than the bucket waits for a full one rather than forever
+        return max(0.0, (min(amount, self.capacity) - self.level) / self.rate)
+
+    def take(self, amount, now):
+        # May go below zero when a request used more than estimated
+        self._refill(now)
+        self.level -= amount
+
+
+class _Waiter:
+    __slots__ = ("tokens", "priority", "session", "enqueued", "waited", "event", "loop", "future")
+
+    def __init__(self, tokens, priority, session, future=None):
+        self.tokens = tokens
+        self.priority = priority
+        self.session = session
+        self.enqueued = time.monotonic()
+        self.waited = 0.0
+        self.event = threading.Event() if future is None else None
+        self.loop = future.get_loop() if future is not None else None
+        self.future = future
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class RateLimiter:
+    """Process-wide RPM/TPM token buckets with a priority queue and per-session round-robin."""
+
+    def __init__(self, rpm=LLM_RPM_LIMIT, tpm=LLM_TPM_LIMIT, completion_estimate=LLM_COMPLETION_ESTIMATE):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.completion_estimate = completion_estimate
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        # priority -> {session: deque of waiters}; dict order is the round-robin order
+        self._queues = collections.defaultdict(dict)
+        self._paused_until = 0.0
+        self._waits = collections.defaultdict(lambda: collections.deque(maxlen=RATE_LIMIT_WINDOW))
+        self._granted = collections.Counter()
+        self._dispatcher = None
+
+    @property
+    def enabled(self):
+        return self.requests is not None or self.tokens is not None
+
+    def estimate(self, prompt, max_tokens=None):
+        """Tokens a request is expected to use: its prompt plus an assumed completion."""
+        if self.tokens is None:
+            return 0
+        return count_tokens(prompt) + (max_tokens or self.completion_estimate)
+
+    # ---- Buckets ----
+    def _delay(self, tokens, now):
+        delay = self._paused_until - now
+        if self.requests is not None:
+            delay = max(delay, self.requests.wait_time(1, now))
+        if self.tokens is not None:
+            delay = max(delay, self.tokens.wait_time(tokens, now))
+        return delay
+
+    def _take(self, waiter, now):
+        if self.requests is not None:
+            self.requests.take(1, now)
+        if self.tokens is not None:
+            self.tokens.take(waiter.tokens, now)
+        waiter.waited = now - waiter.enqueued
+        self._waits[waiter.priority].append(waiter.waited)
+        self._granted[waiter.priority] += 1
+
+    def settle(self, estimated, usage):
+        """Charge the difference between the estimate and the tokens the request really used."""
+        if self.tokens is None or not usage:
+            return
+        used = (usage.get("prompt_tokens") or 0) + (usage.get("completion_tokens") or 0)
+        if used:
+            with self._lock:
+                self.tokens.take(used - estimated, time.monotonic())
+
+    def pause(self, seconds):
+        """Hold every request for a while, e.g. after the provider answered 429."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._changed.notify()
+
+    # ---- Queue ----
+    def _enqueue(self, tokens, future=None):
+        """Grant at once when nothing is waiting and the buckets allow it; otherwise queue."""
+        request = _request.get()
+        waiter = _Waiter(tokens, priority_for(request.get("urgency"), request.get("call_type")),
+                         request.get("session"), future)
+        with self._lock:
+            now = time.monotonic()
+            if not self._queues and self._delay(tokens, now) <= 0:
+                self._take(waiter, now)
+                return waiter, True
+            self._queues[waiter.priority].setdefault(waiter.session, collections.deque()).append(waiter)
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(target=self._dispatch, name="rate-limiter", daemon=True)
+                self._dispatcher.start()
+            self._changed.notify()
+        return waiter, False
+
+    def _head(self):
+        """Next waiter to serve: highest priority class, then the session whose turn it is."""
+        priority = min(self._queues)
+        sessions = self._queues[priority]
+        session = next(iter(sessions))
+        return priority, session, sessions[session][0]
+
+    def _remove(self, priority, session, waiter, rotate):
+        sessions = self._queues[priority]
+        queue = sessions[session]
+        queue.remove(waiter)
+        if rotate or not queue:
+            del sessions[session]
+            if queue:
+                # Served: the session moves to the back of the round-robin
+                sessions[session] = queue
+        if not sessions:
+            del self._queues[priority]
+
+    def _dispatch(self):
+        with self._lock:
+            while True:
+                if not self._queues:
+                    self._changed.wait()
+                    continue
+                priority, session, waiter = self._head()
+                now = time.monotonic()
+                delay = self._delay(waiter.tokens, now)
+                if delay > 0:
+                    # Woken early when a higher-priority request arrives
+                    self._changed.wait(delay)
+                    continue
+                self._remove(priority, session, waiter, rotate=True)
+                self._take(waiter, now)
+                if waiter.future is not None:
+                    waiter.loop.call_soon_threadsafe(_resolve, waiter.future)
+                else:
+                    waiter.event.set()
+
+    def _cancel(self, waiter):
+        """Take a waiter out of the queue; False when it was granted in the meantime."""
+        with self._lock:
+            queue = self._queues.get(waiter.priority, {}).get(waiter.session)
+            if queue is not None and waiter in queue:
+                self._remove(waiter.priority, waiter.session, waiter, rotate=False)
+                self._changed.notify()
+                return True
+            return False
+
+    def acquire(self, tokens=0, timeout=None):
+        """Block until the request may be sent; returns the seconds waited.
+
+        Raises TimeoutError when it is not granted within timeout seconds.
+        """
+        if not self.enabled:
+            return 0.0
+        waiter, granted = self._enqueue(tokens)
+        if not granted and not waiter.event.wait(timeout) and self._cancel(waiter):
+            raise TimeoutError(f"No rate-limit slot within {timeout:.1f}s")
+        _notify_wait(waiter.waited)
+        return waiter.waited
+
+    async def aacquire(self, tokens=0, timeout=None):
+        if not self.enabled:
+            return 0.0
+        waiter, granted = self._enqueue(tokens, asyncio.get_running_loop().create_future())
+        if not granted:
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+            except asyncio.TimeoutError:
+                if self._cancel(waiter):
+                    raise TimeoutError(f"No rate-limit slot within {timeout:.1f}s") from None
+            except asyncio.CancelledError:
+                self._cancel(waiter)
+                raise
+        _notify_wait(waiter.waited)
+        return waiter.waited
+
+    # ---- Metrics ----
+    def stats(self):
+        """Queue depth, wait-time percentiles per priority class and bucket levels."""
+        from utils.telemetry import percentile
+
+        with self._lock:
+            now = time.monotonic()
+            depth = {p: sum(len(q) for q in sessions.values()) for p, sessions in self._queues.items()}
+            waits = {p: list(w) for p, w in self._waits.items()}
+            granted = dict(self._granted)
+            if self.requests is not None:
+                self.requests._refill(now)
+            if self.tokens is not None:
+                self.tokens._refill(now)
+            stats = {
+                "enabled": self.enabled,
+                "rpm_limit": self.rpm or None,
+                "tpm_limit": self.tpm or None,
+                "requests_available": round(self.requests.level, 1) if self.requests is not None else None,
+                "tokens_available": round(self.tokens.level) if self.tokens is not None else None,
+                "paused_s": round(max(0.0, self._paused_until - now), 2),
+                "queued": sum(depth.values()),
+                "sessions_waiting": len({s for sessions in self._queues.values() for s in sessions}),
+            }
+        stats["priorities"] = [
+            {
+                "priority": p,
+                "queued": depth.get(p, 0),
+                "granted": granted.get(p, 0),
+                "wait_p50_ms": round(percentile(waits.get(p, []), 0.50) * 1000, 1) if waits.get(p) else None,
+                "wait_p95_ms": round(percentile(waits.get(p, []), 0.95) * 1000, 1) if waits.get(p) else None,
+                "wait_max_ms": round(max(waits[p]) * 1000, 1) if waits.get(p) else None,
+            }
+            for p in sorted(set(depth) | set(granted))
+        ]
+        return stats
+
+
+# Called as listener(seconds) in the caller's context after every acquire
+_wait_listeners = []
+
+
+def add_wait_listener(listener):
+    _wait_listeners.append(listener)
+
+
+def _notify_wait(seconds):
+    for listener in list(_wait_listeners):
+        try:
+            listener(seconds)
+        except Exception:
+            pass
+
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,210 @@
+import asyncio
+import collections
+import contextlib
+import functools
+import inspect
+import os
+import threading
+import time
+from contextvars import ContextVar
+
+# RESILIENCE
+# Deadlines, hedged requests and a circuit breaker for model calls.
+# - A deadline set with deadline_after() (or the deadline= argument of the
+#   backend functions) bounds every model call made inside it: rate-limiter
+#   waits, request timeouts and retry backoff all stop when it runs out.
+# - With LLM_HEDGING=1, a request that has not answered after the observed
+#   p95 latency of its kind is sent a second time; the first answer wins and the
+#   other request is cancelled.
+# - After LLM_BREAKER_FAILURES failed calls in a row the circuit opens: calls
+#   fail at once for LLM_BREAKER_COOLDOWN seconds, then a single probe decides
+#   whether it closes again. The backend answers interactive calls with a
+#   degraded default meanwhile.
+LLM_HEDGING = os.getenv("LLM_HEDGING", "0") == "1"
+LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", "0.95"))
+# Latency samples of a kind of request needed before it is hedged
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+# Recent latencies kept per kind of request for the hedge delay
+LATENCY_WINDOW = 200
+
+_deadline = ContextVar("llm_deadline", default=None)
+
+
+# ==== Deadlines ====
+@contextlib.contextmanager
+def _deadline_at(at):
+    current = _deadline.get()
+    token = _deadline.set(current if at is None else at if current is None else min(at, current))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def deadline_after(seconds):
+    """Model calls made inside the with block must finish within seconds (None or 0 = no limit).
+
+    Nested deadlines can only shorten the one around them.
+    """
+    return _deadline_at(time.monotonic() + seconds if seconds else None)
+
+
+def remaining():
+    """Seconds left before the current deadline, None without one."""
+    at = _deadline.get()
+    return None if at is None else at - time.monotonic()
+
+
+def accepts_deadline(fn):
+    """Decorator adding a deadline=seconds argument to a function (sync, async or generator)."""
+    if inspect.isgeneratorfunction(fn):
+        @functools.wraps(fn)
+        def gen_wrapper(*args, deadline=None, **kwargs):
+            # Entered around each step only, as the generator may be consumed from another context
+            at = time.monotonic() + deadline if deadline else None
+            gen = fn(*args, **kwargs)
+            try:
+                while True:
+                    with _deadline_at(at):
+                        try:
+                            item = next(gen)
+                        except StopIteration:
+                            return
+                    yield item
+            finally:
+                gen.close()
+        return gen_wrapper
+
+    if asyncio.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def async_wrapper(*args, deadline=None, **kwargs):
+            with deadline_after(deadline):
+                return await fn(*args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, deadline=None, **kwargs):
+        with deadline_after(deadline):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+# ==== Hedging ====
+class LatencyTracker:
+    """Recent request latencies per kind of request (schema name), for the hedge delay."""
+
+    def __init__(self, window=LATENCY_WINDOW, quantile=LLM_HEDGE_QUANTILE, min_samples=LLM_HEDGE_MIN_SAMPLES):
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self._samples = collections.defaultdict(lambda: collections.deque(maxlen=window))
+        self._lock = threading.Lock()
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def record(self, key, seconds):
+        with self._lock:
+            self._samples[key].append(seconds)
+
+    def hedge_delay(self, key):
+        """Seconds to wait before hedging a request of this kind; None when it is not hedged."""
+        from utils.telemetry import percentile
+
+        if not LLM_HEDGING:
+            return None
+        with self._lock:
+            samples = list(self._samples.get(key, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return percentile(samples, self.quantile)
+
+    def record_hedge(self, won):
+        with self._lock:
+            self.hedged += 1
+            self.hedge_wins += won
+
+    def stats(self):
+        from utils.telemetry import percentile
+
+        with self._lock:
+            samples = {key: list(values) for key, values in self._samples.items()}
+            hedged, wins = self.hedged, self.hedge_wins
+        return {
+            "hedging": LLM_HEDGING,
+            "hedged": hedged,
+            "hedge_wins": wins,
+            "hedge_delay_ms": {key: round(percentile(values, self.quantile) * 1000, 1)
+                               for key, values in samples.items() if len(values) >= self.min_samples},
+        }
+
+
+# ==== Circuit breaker ====
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker: closed -> open (cooldown) -> half open (one probe) -> closed or open."""
+
+    def __init__(self, failures=LLM_BREAKER_FAILURES, cooldown=LLM_BREAKER_COOLDOWN):
+        self.threshold = failures
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.rejected = 0
+        self._opened = 0.0
+        self._probe_started = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """0 when a call may go out, otherwise the seconds until the circuit is tried again."""
+        if self.threshold <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            if self.state == CLOSED:
+                return 0.0
+            if self.state == OPEN and now - self._opened >= self.cooldown:
+                self.state = HALF_OPEN
+                self._probe_started = None
+            if self.state == HALF_OPEN and (self._probe_started is None
+                                            or now - self._probe_started >= self.cooldown):
+                # One probe at a time; a probe that never reported back is replaced after a cooldown
+                self._probe_started = now
+                return 0.0
+            self.rejected += 1
+            return max(0.1, self.cooldown - (now - self._opened))
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.state = CLOSED
+
+    def record_failure(self):
+        if self.threshold <= 0:
+            return
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.threshold):
+                self.state = OPEN
+                self._opened = time.monotonic()
+                self.trips += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.threshold > 0,
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "trips": self.trips,
+                "rejected_calls": self.rejected,
+            }
+
+
+latency = LatencyTracker()
+breaker = CircuitBreaker()
+
+
+def resilience_stats():
+    return {"circuit": breaker.stats(), **latency.stats()}
@@ -0,0 +1,377 @@
+"""Persistent store of triage results and chat transcripts.
+
+Every triage (app and batch) and every chat turn is appended to a SQLite
+database indexed on time, urgency, sentiment and client email. Writes go
+through a queue to a single writer thread that commits them in batches, so a
+request never waits on the disk. Queries use the indexes with keyset
+pagination and the export streams rows to Parquet/Arrow in chunks, so neither
+loads the table into memory.
+
+Usage:
+    python -m utils.results_store export --output tickets.parquet [--since 2025-01-01]
+    python -m utils.results_store counts --by urgency --bucket day [--since 2025-01-01]
+    python -m utils.results_store sla
+"""
+import argparse
+import atexit
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import traceback
+from datetime import datetime, timezone
+
+RESULTS_DB = os.getenv("RESULTS_DB", "results.db")
+# Seconds from triage to a booked call per urgency before an escalation breaches its SLA
+SLA_TARGETS = {"Critical": 900, "High": 3600, "High_Chat": 3600, "Medium": 4 * 3600, "Medium_Chat": 4 * 3600,
+               "Low": 24 * 3600}
+SLA_TARGETS.update(json.loads(os.getenv("SLA_TARGETS", "{}")))
+# Target for escalations whose urgency is missing or not in SLA_TARGETS (Medium, the default urgency)
+SLA_DEFAULT_TARGET = float(os.getenv("SLA_DEFAULT_TARGET", str(4 * 3600)))
+# The writer commits up to this many rows together, waiting at most the interval for more
+RESULTS_BATCH_SIZE = 500
+RESULTS_FLUSH_INTERVAL = 0.2
+EXPORT_CHUNK_ROWS = 20_000
+
+TICKET_COLUMNS = ["id", "created", "source", "client_email", "sentiment", "urgency", "summary", "escalated",
+                  "session_id", "job_id", "scheduled", "meeting_link", "tokens_saved", "email_text", "result"]
+GROUP_COLUMNS = {"urgency", "sentiment", "client_email", "source", "escalated"}
+BUCKETS = {"hour": "%Y-%m-%d %H:00", "day": "%Y-%m-%d", "week": "%Y-W%W", "month": "%Y-%m"}
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS tickets ("
+    "id TEXT PRIMARY KEY, created REAL NOT NULL, source TEXT NOT NULL, client_email TEXT, "
+    "sentiment TEXT, urgency TEXT, summary TEXT, escalated INTEGER NOT NULL DEFAULT 0, "
+    "session_id TEXT, job_id TEXT, scheduled REAL, meeting_link TEXT, tokens_saved INTEGER, "
+    "email_text TEXT, result TEXT)",
+    "CREATE INDEX IF NOT EXISTS tickets_created ON tickets(created)",
+    "CREATE INDEX IF NOT EXISTS tickets_urgency ON tickets(urgency, created)",
+    "CREATE INDEX IF NOT EXISTS tickets_sentiment ON tickets(sentiment, created)",
+    "CREATE INDEX IF NOT EXISTS tickets_client ON tickets(client_email, created)",
+    "CREATE INDEX IF NOT EXISTS tickets_job ON tickets(job_id)",
+    "CREATE TABLE IF NOT EXISTS chat_turns ("
+    "session_id TEXT NOT NULL, turn INTEGER NOT NULL, created REAL NOT NULL, "
+    "question TEXT, answer TEXT, sentiment TEXT, PRIMARY KEY (session_id, turn))",
+    "CREATE INDEX IF NOT EXISTS chat_turns_created ON chat_turns(created)",
+]
+
+INSERT_TICKET = (f"INSERT OR REPLACE INTO tickets ({', '.join(TICKET_COLUMNS)}) "
+                 f"VALUES ({', '.join('?' * len(TICKET_COLUMNS))})")
+INSERT_TURN = ("INSERT OR REPLACE INTO chat_turns (session_id, turn, created, question, answer, sentiment) "
+               "VALUES (?, ?, ?, ?, ?, ?)")
+UPDATE_ESCALATED = "UPDATE tickets SET escalated = 1, job_id = ? WHERE id = ?"
+UPDATE_SCHEDULED = "UPDATE tickets SET scheduled = ?, meeting_link = ? WHERE job_id = ?"
+
+
+def _label(result, field):
+    return result.get(field) if isinstance(result, dict) else None
+
+
+def _timestamp(value):
+    """Epoch seconds from a number, an ISO date/time string or a datetime."""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+class ResultsStore:
+    """Append-only writes through a background writer; reads on per-thread connections."""
+
+    def __init__(self, path=RESULTS_DB):
+        self.path = path
+        db = self._connect()
+        for statement in SCHEMA:
+            db.execute(statement)
+        db.close()
+        self._queue = queue.Queue()
+        self._local = threading.local()
+        self._writer = threading.Thread(target=self._write_loop, name="results-writer", daemon=True)
+        self._writer.start()
+        self.dropped = 0
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("PRAGMA busy_timeout=5000")
+        return db
+
+    # ---- Write path ----
+    def _write_loop(self):
+        db = self._connect()
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + RESULTS_FLUSH_INTERVAL
+            while len(batch) < RESULTS_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                db.execute("BEGIN")
+                # Consecutive writes of the same statement go in one executemany, in order
+                start = 0
+                for i in range(1, len(batch) + 1):
+                    if i == len(batch) or batch[i][0] != batch[start][0]:
+                        db.executemany(batch[start][0], [params for _, params in batch[start:i]])
+                        start = i
+                db.execute("COMMIT")
+            except Exception:
+                traceback.print_exc()
+                self.dropped += len(batch)
+                if db.in_transaction:
+                    db.execute("ROLLBACK")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _append(self, sql, params):
+        self._queue.put((sql, params))
+
+    def flush(self):
+        """Wait until everything queued so far is committed."""
+        self._queue.join()
+
+    def record_triage(self, ticket_id, triage, client_email="", email_text="", source="app",
+                      session_id=None, job_id=None):
+        """Queue one triage result ({"sentiment", "summary", "urgency", ...}); returns at once."""
+        sentiment, summary, urgency = triage.get("sentiment"), triage.get("summary"), triage.get("urgency")
+        self._append(INSERT_TICKET, (
+            ticket_id, time.time(), source, client_email or None,
+            _label(sentiment, "sentiment_identified"), _label(urgency, "urgency_identified"),
+            _label(summary, "summary"), int(bool(job_id)), session_id, job_id, None, None,
+            (triage.get("preprocessing") or {}).get("tokens_saved", triage.get("tokens_saved")),
+            email_text, json.dumps({k: triage.get(k) for k in ("sentiment", "summary", "urgency")},
+                                   ensure_ascii=False),
+        ))
+
+    def record_turn(self, session_id, turn, question, answer, sentiment):
+        self._append(INSERT_TURN, (session_id, turn, time.time(), question, answer, sentiment))
+
+    def record_escalation(self, ticket_id, job_id):
+        self._append(UPDATE_ESCALATED, (job_id, ticket_id))
+
+    def record_scheduled(self, job_id, link):
+        """The call of an escalation job was booked (used for the SLA)."""
+        self._append(UPDATE_SCHEDULED, (time.time(), link, job_id))
+
+    # ---- Queries ----
+    def _db(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = self._connect()
+        return db
+
+    @staticmethod
+    def _filters(since=None, until=None, urgency=None, sentiment=None, client_email=None, escalated=None,
+                 source=None):
+        clauses, params = [], []
+        if since is not None:
+            clauses.append("created >= ?")
+            params.append(_timestamp(since))
+        if until is not None:
+            clauses.append("created < ?")
+            params.append(_timestamp(until))
+        for column, value in (("urgency", urgency), ("sentiment", sentiment),
+                              ("client_email", client_email), ("source", source)):
+            if value is None:
+                continue
+            values = [value] if isinstance(value, str) else list(value)
+            clauses.append(f"{column} IN ({', '.join('?' * len(values))})")
+            params.extend(values)
+        if escalated is not None:
+            clauses.append("escalated = ?")
+            params.append(int(escalated))
+        return clauses, params
+
+    def query_tickets(self, limit=100, before=None, full=False, **filters):
+        """Newest tickets first, filtered by since/until/urgency/sentiment/client_email/escalated/source.
+
+        For the next page pass before=(created, id) of the last row returned.
+        """
+        clauses, params = self._filters(**filters)
+        if before is not None:
+            clauses.append("(created < ? OR (created = ? AND id < ?))")
+            params.extend([before[0], before[0], before[1]])
+        columns = TICKET_COLUMNS if full else [c for c in TICKET_COLUMNS if c not in ("email_text", "result")]
+        sql = f"SELECT {', '.join(columns)} FROM tickets"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY created DESC, id DESC LIMIT ?"
+        rows = self._db().execute(sql, params + [limit]).fetchall()
+        return [dict(zip(columns, row)) for row in rows]
+
+    def counts(self, by="urgency", bucket=None, **filters):
+        """Ticket counts per value of a column, optionally per time bucket (hour/day/week/month, UTC)."""
+        if by not in GROUP_COLUMNS:
+            raise ValueError(f"Cannot group by '{by}', expected one of {sorted(GROUP_COLUMNS)}")
+        clauses, params = self._filters(**filters)
+        where = " WHERE " + " AND ".join(clauses) if clauses else ""
+        if bucket is None:
+            sql = f"SELECT {by}, COUNT(*) FROM tickets{where} GROUP BY {by} ORDER BY COUNT(*) DESC"
+            return [{by: value, "tickets": count} for value, count in self._db().execute(sql, params)]
+        if bucket not in BUCKETS:
+            raise ValueError(f"Unknown bucket '{bucket}', expected one of {sorted(BUCKETS)}")
+        period = f"strftime('{BUCKETS[bucket]}', created, 'unixepoch')"
+        sql = (f"SELECT {period} AS period, {by}, COUNT(*) FROM tickets{where} "
+               f"GROUP BY period, {by} ORDER BY period")
+        return [{"period": period, by: value, "tickets": count}
+                for period, value, count in self._db().execute(sql, params)]
+
+    def sla_breaches(self, limit=100, now=None, **filters):
+        """Escalated tickets whose call was booked, or is still unbooked, later than SLA_TARGETS allows.
+
+        Urgencies missing from SLA_TARGETS are held to SLA_DEFAULT_TARGET.
+        """
+        clauses, params = self._filters(escalated=True, **filters)
+        now = now or time.time()
+        # One condition per urgency, each followed by its own parameters
+        conditions = []
+        for level, seconds in SLA_TARGETS.items():
+            conditions.append("(urgency = ? AND COALESCE(scheduled, ?) - created > ?)")
+            params.extend([level, now, float(seconds)])
+        conditions.append(f"((urgency IS NULL OR urgency NOT IN ({', '.join('?' * len(SLA_TARGETS))})) "
+                          f"AND COALESCE(scheduled, ?) - created > ?)")
+        params.extend([*SLA_TARGETS, now, SLA_DEFAULT_TARGET])
+        clauses.append("(" + " OR ".join(conditions) + ")")
+        columns = [c for c in TICKET_COLUMNS if c not in ("email_text", "result")]
+        sql = (f"SELECT {', '.join(columns)} FROM tickets WHERE {' AND '.join(clauses)} "
+               f"ORDER BY created DESC LIMIT ?")
+        rows = self._db().execute(sql, params + [limit]).fetchall()
+        return [dict(zip(columns, row)) for row in rows]
+
+    def transcript(self, session_id):
+        rows = self._db().execute(
+            "SELECT turn, created, question, answer, sentiment FROM chat_turns WHERE session_id = ? ORDER BY turn",
+            (session_id,),
+        ).fetchall()
+        return [dict(zip(("turn", "created", "question", "answer", "sentiment"), row)) for row in rows]
+
+    def chat_turn_stats(self, **filters):
+        """Chat sessions of the filtered tickets with their average and p95 answered turns."""
+        from utils.telemetry import percentile
+
+        clauses, params = self._filters(**filters)
+        where = " WHERE " + " AND ".join(clauses) if clauses else ""
+        turns = [row[0] for row in self._db().execute(
+            f"SELECT COUNT(*) FROM chat_turns WHERE session_id IN (SELECT session_id FROM tickets{where}) "
+            f"GROUP BY session_id", params)]
+        return {
+            "sessions": len(turns),
+            "avg_turns": round(sum(turns) / len(turns), 2) if turns else None,
+            "p95_turns": percentile(turns, 0.95),
+        }
+
+    def stats(self):
+        db = self._db()
+        return {
+            "tickets": db.execute("SELECT COUNT(*) FROM tickets").fetchone()[0],
+            "chat_turns": db.execute("SELECT COUNT(*) FROM chat_turns").fetchone()[0],
+            "queued_writes": self._queue.unfinished_tasks,
+            "dropped_writes": self.dropped,
+            "path": self.path,
+        }
+
+    # ---- Export ----
+    def export(self, path, fmt=None, include_text=True, chunk_rows=EXPORT_CHUNK_ROWS, **filters):
+        """Stream tickets, oldest first, to a Parquet (.parquet) or Arrow IPC (.arrow/.feather) file.
+
+        Returns the number of rows written. Only chunk_rows rows are in memory at a time.
+        """
+        import pyarrow as pa
+
+        fmt = fmt or ("parquet" if path.endswith(".parquet") else "arrow")
+        columns = TICKET_COLUMNS if include_text else [c for c in TICKET_COLUMNS if c not in ("email_text", "result")]
+        types = {"created": pa.timestamp("ms", tz="UTC"), "scheduled": pa.timestamp("ms", tz="UTC"),
+                 "escalated": pa.bool_(), "tokens_saved": pa.int64()}
+        schema = pa.schema([(c, types.get(c, pa.string())) for c in columns])
+
+        if fmt == "parquet":
+            import pyarrow.parquet as pq
+            writer = pq.ParquetWriter(path, schema, compression="zstd")
+        else:
+            writer = pa.ipc.new_file(path, schema)
+
+        # Timestamps are converted to milliseconds by SQLite, so rows go to Arrow without a Python pass
+        select = [f"CAST({c} * 1000 AS INTEGER)" if c in ("created", "scheduled") else c for c in columns]
+        clauses, params = self._filters(**filters)
+        sql = f"SELECT {', '.join(select)} FROM tickets"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY created"
+        # Own connection: the cursor stays open for the whole export
+        db = self._connect()
+        rows_written = 0
+        try:
+            cursor = db.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(chunk_rows)
+                if not rows:
+                    break
+                arrays = [pa.array(values, type=pa.int8()).cast(pa.bool_()) if c == "escalated"
+                          else pa.array(values, type=schema.field(c).type)
+                          for c, values in zip(columns, zip(*rows))]
+                writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+                rows_written += len(rows)
+        finally:
+            writer.close()
+            db.close()
+        return rows_written
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_results_store():
+    """Process-wide store; None when RESULTS_DB is empty."""
+    global _store
+    if not RESULTS_DB:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = ResultsStore(RESULTS_DB)
+            # Commit what is still queued when the process exits normally
+            atexit.register(_store.flush)
+        return _store
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query or export the triage results store.")
+    parser.add_argument("command", choices=["export", "counts", "sla", "stats"])
+    parser.add_argument("--db", default=RESULTS_DB)
+    parser.add_argument("--output", help="Export file (.parquet, .arrow or .feather)")
+    parser.add_argument("--since", help="ISO date/time (UTC)")
+    parser.add_argument("--until", help="ISO date/time (UTC)")
+    parser.add_argument("--urgency", nargs="+")
+    parser.add_argument("--sentiment", nargs="+")
+    parser.add_argument("--by", default="urgency", choices=sorted(GROUP_COLUMNS))
+    parser.add_argument("--bucket", choices=sorted(BUCKETS))
+    parser.add_argument("--no-text", action="store_true", help="Leave email text and raw results out of the export")
+    args = parser.parse_args(argv)
+
+    store = ResultsStore(args.db)
+    filters = {"since": args.since, "until": args.until, "urgency": args.urgency, "sentiment": args.sentiment}
+    if args.command == "export":
+        if not args.output:
+            parser.error("--output is required for export")
+        start = time.perf_counter()
+        rows = store.export(args.output, include_text=not args.no_text, **filters)
+        report = {"rows": rows, "output": args.output, "seconds": round(time.perf_counter() - start, 2)}
+    elif args.command == "counts":
+        report = store.counts(args.by, args.bucket, **filters)
+    elif args.command == "sla":
+        report = store.sla_breaches(**filters)
+    else:
+        report = store.stats()
+    print(json.dumps(report, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
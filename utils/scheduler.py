@@ -0,0 +1,129 @@
+import bisect
+import itertools
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+# BUSY-INTERVAL INDEX
+# Keeps the calendar's busy times in memory (refreshed from freebusy after a short
+# TTL) together with the slots that sessions have reserved but not inserted yet,
+# so two sessions scheduling at the same moment never get the same slot.
+BUSY_INDEX_TTL = float(os.getenv("BUSY_INDEX_TTL", "30"))
+
+
+class Reservation:
+    def __init__(self, token, start, end):
+        self.token = token
+        self.start = start
+        self.end = end
+
+    def __repr__(self):
+        return f"Reservation({self.token}, {self.start.isoformat()} - {self.end.isoformat()})"
+
+
+class BusyIndex:
+    """Sorted busy intervals plus pending reservations, with atomic find-and-reserve."""
+
+    def __init__(self, fetch_busy, ttl_seconds=BUSY_INDEX_TTL, clock=None):
+        # fetch_busy(time_min, time_max) -> iterable of (start, end) aware datetimes
+        self._fetch_busy = fetch_busy
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock or (lambda: datetime.now(timezone.utc))
+        self._lock = threading.Lock()
+        self._busy = []        # sorted list of (start, end)
+        self._reserved = {}    # token -> (start, end)
+        self._window_end = None
+        self._fetched_at = 0.0
+        self._tokens = itertools.count(1)
+        self.refreshes = 0
+
+    # ---- Index maintenance (caller holds _lock) ----
+    def _refresh(self, now, until):
+        stale = time.monotonic() - self._fetched_at > self.ttl_seconds
+        if not stale and self._window_end is not None and until <= self._window_end:
+            return
+        # The clock moves on by up to one TTL before the next refresh, so fetch that much further
+        until += timedelta(seconds=self.ttl_seconds)
+        busy = sorted(self._fetch_busy(now, until))
+        self._busy = _merge(busy)
+        self._window_end = until
+        self._fetched_at = time.monotonic()
+        self.refreshes += 1
+
+    def _intervals_from(self, point):
+        """Busy and reserved intervals that end after point, in start order."""
+        # Busy intervals are merged, so everything before the bisect point ends before `point`
+        i = bisect.bisect_right(self._busy, (point, point))
+        if i > 0 and self._busy[i - 1][1] > point:
+            i -= 1
+        busy = self._busy[i:]
+        reserved = sorted(r for r in self._reserved.values() if r[1] > point)
+        return _merge(sorted(busy + reserved))
+
+    def _first_gap(self, start, end_search, duration):
+        free_start = start
+        for busy_start, busy_end in self._intervals_from(start):
+            if free_start + duration <= busy_start:
+                break
+            if busy_end > free_start:
+                free_start = busy_end
+        if free_start + duration <= end_search:
+            return free_start, free_start + duration
+        return None, None
+
+    # ---- Public API ----
+    def find_slot(self, duration_minutes=15, search_hours=2, lead_minutes=5):
+        """Next free slot without reserving it."""
+        now = self._clock()
+        with self._lock:
+            self._refresh(now, now + timedelta(hours=search_hours))
+            return self._first_gap(now + timedelta(minutes=lead_minutes),
+                                   now + timedelta(hours=search_hours),
+                                   timedelta(minutes=duration_minutes))
+
+    def find_and_reserve(self, duration_minutes=15, search_hours=2, lead_minutes=5):
+        """Find the next free slot and hold it until confirm() or release(); None if the window is full."""
+        now = self._clock()
+        with self._lock:
+            self._refresh(now, now + timedelta(hours=search_hours))
+            start, end = self._first_gap(now + timedelta(minutes=lead_minutes),
+                                         now + timedelta(hours=search_hours),
+                                         timedelta(minutes=duration_minutes))
+            if start is None:
+                return None
+            token = next(self._tokens)
+            self._reserved[token] = (start, end)
+            return Reservation(token, start, end)
+
+    def confirm(self, reservation):
+        """The event was created: keep the slot as busy until the next refresh sees it."""
+        with self._lock:
+            interval = self._reserved.pop(reservation.token, None)
+            if interval is not None:
+                self._busy = _merge(sorted(self._busy + [interval]))
+
+    def release(self, reservation):
+        """The insert failed: give the slot back."""
+        with self._lock:
+            self._reserved.pop(reservation.token, None)
+
+    def invalidate(self):
+        with self._lock:
+            self._fetched_at = 0.0
+
+    def stats(self):
+        with self._lock:
+            return {"busy_intervals": len(self._busy), "reserved": len(self._reserved),
+                    "refreshes": self.refreshes}
+
+
+def _merge(intervals):
+    merged = []
+    for start, end in intervals:
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
@@ -0,0 +1,73 @@
+import json
+from typing import List, Literal
+
+from pydantic import BaseModel, Field, ValidationError
+
+# RESPONSE SCHEMAS
+# One compact model per task. They are sent to the provider as the function /
+# JSON schema, so the model answers with these fields only (no echoed email).
+
+class SentimentResult(BaseModel):
+    reasoning: str = Field(description="One short sentence")
+    sentiment_identified: Literal["Neutral", "Angry", "Frustrated", "Stressed"]
+
+
+class IssueSummary(BaseModel):
+    summary: str
+    reasoning: str = Field(description="One short sentence")
+    questions: List[str] = Field(description="5 clarification questions for the customer")
+
+
+class UrgencyResult(BaseModel):
+    reasoning: str = Field(description="One short sentence")
+    urgency_identified: Literal["Low", "Medium", "High", "Critical"]
+
+
+# Sentiment, issue summary and urgency in one answer (fused triage mode)
+class TriageResult(BaseModel):
+    summary: str
+    questions: List[str] = Field(description="5 clarification questions for the customer")
+    sentiment_reasoning: str = Field(description="One short sentence")
+    sentiment_identified: Literal["Neutral", "Angry", "Frustrated", "Stressed"]
+    urgency_reasoning: str = Field(description="One short sentence")
+    urgency_identified: Literal["Low", "Medium", "High", "Critical"]
+
+
+class Greeting(BaseModel):
+    message: str = Field(description="Privacy notice, greeting and the first clarification question")
+    reasoning: str = Field(description="One short sentence on why this question")
+
+
+class NextQuestion(BaseModel):
+    question: str
+    reasoning: str = Field(description="One short sentence")
+
+
+class SufficiencyResult(BaseModel):
+    reasoning: str = Field(description="One short sentence on what is still missing")
+    score: float = Field(ge=0, le=1, description="Share of the details needed to act on the issue that the customer has given")
+
+
+def function_schema(model_cls):
+    """(name, JSON schema) pair as expected by the providers."""
+    return model_cls.__name__, model_cls.model_json_schema()
+
+
+def _first_json_object(text):
+    # Tool/JSON-mode answers are the object itself; prompt-mode answers may have text around it
+    text = text.strip()
+    if text.startswith("{"):
+        return text
+    start = text.find("{")
+    if start < 0:
+        raise ValueError("no JSON object in model output")
+    obj, _ = json.JSONDecoder().raw_decode(text[start:])
+    return json.dumps(obj)
+
+
+def parse_structured(model_cls, text):
+    """Validated dict for model_cls, or an {"error", "raw"} dict like the rest of the backend."""
+    try:
+        return model_cls.model_validate_json(_first_json_object(text or "")).model_dump()
+    except (ValidationError, ValueError) as e:
+        return {"error": f"Invalid {model_cls.__name__} output: {e}", "raw": text}
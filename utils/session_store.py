@@ -0,0 +1,254 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from urllib.parse import urlparse, unquote
+
+# SESSION STORE
+# Chat sessions (client email, email text, triage summary) and the LangGraph
+# checkpoint of every chat (utils/chat_graph.py) live here, keyed by session_id,
+# so the chat link only carries the id and any app replica can continue a chat.
+# SQLite by default; SESSION_STORE_URL=redis://host:6379/0 uses any server
+# speaking the Redis protocol.
+SESSION_STORE_URL = os.getenv("SESSION_STORE_URL", "sqlite:///sessions.db")
+SESSION_TTL = float(os.getenv("SESSION_TTL", str(7 * 24 * 3600)))
+
+
+class SessionStore:
+    """JSON documents by key, each expiring ttl_seconds after it was last written."""
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value):
+        raise NotImplementedError
+
+    def update(self, key, fn):
+        """Atomic read-modify-write: fn(current value or None) returns the new value, or None to keep it.
+
+        Returns what fn returned. Replicas updating the same key never overwrite each other's changes.
+        """
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    # ---- Chat sessions ----
+    def create_session(self, data):
+        session_id = uuid.uuid4().hex
+        self.set(f"session:{session_id}", data)
+        return session_id
+
+    def load_session(self, session_id):
+        return self.get(f"session:{session_id}") if session_id else None
+
+    def update_session(self, session_id, **fields):
+        return self.update(f"session:{session_id}", lambda session: {**(session or {}), **fields})
+
+
+class SQLiteSessionStore(SessionStore):
+    def __init__(self, path="sessions.db", ttl_seconds=SESSION_TTL):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS sessions_expires ON sessions(expires)")
+        self._db.commit()
+
+    def _get(self, key):
+        row = self._db.execute("SELECT value, expires FROM sessions WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return json.loads(row[0])
+
+    def _set(self, key, value):
+        now = time.time()
+        self._db.execute("INSERT OR REPLACE INTO sessions (key, value, expires) VALUES (?, ?, ?)",
+                         (key, json.dumps(value), now + self.ttl_seconds))
+        self._db.execute("DELETE FROM sessions WHERE expires < ?", (now,))
+
+    def get(self, key):
+        with self._lock:
+            return self._get(key)
+
+    def set(self, key, value):
+        with self._lock:
+            self._set(key, value)
+            self._db.commit()
+
+    def update(self, key, fn):
+        with self._lock:
+            # BEGIN IMMEDIATE takes the write lock before the read, so processes sharing the file queue up
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                value = fn(self._get(key))
+                if value is not None:
+                    self._set(key, value)
+                self._db.commit()
+            except BaseException:
+                self._db.rollback()
+                raise
+        return value
+
+    def delete(self, key):
+        with self._lock:
+            self._db.execute("DELETE FROM sessions WHERE key = ?", (key,))
+            self._db.commit()
+
+
+class RedisError(Exception):
+    pass
+
+
+class _RespConnection:
+    """Minimal Redis protocol (RESP2) client connection."""
+
+    def __init__(self, host, port, timeout):
+        self._sock = socket.create_connection((host, port), timeout=timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._reader = self._sock.makefile("rb")
+
+    def command(self, *args):
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        self._sock.sendall(b"".join(parts))
+        return self._read()
+
+    def _read(self):
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError("connection closed by server")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise RedisError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(rest)
+            return None if length < 0 else [self._read() for _ in range(length)]
+        raise RedisError(f"unexpected reply {line!r}")
+
+    def close(self):
+        self._reader.close()
+        self._sock.close()
+
+
+class RedisSessionStore(SessionStore):
+    """Store on Redis or anything speaking its protocol (Valkey, KeyDB, a local stand-in)."""
+
+    def __init__(self, url="redis://localhost:6379/0", ttl_seconds=SESSION_TTL, timeout=5.0, prefix="ai_first_tier:"):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.strip("/") or 0)
+        self.ttl_seconds = ttl_seconds
+        self.timeout = timeout
+        self.prefix = prefix
+        # One connection per thread: Streamlit runs every session in its own thread
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = _RespConnection(self.host, self.port, self.timeout)
+            if self.password:
+                conn.command("AUTH", self.password)
+            if self.db:
+                conn.command("SELECT", self.db)
+            self._local.conn = conn
+        return conn
+
+    def _drop_connection(self):
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn is not None:
+            conn.close()
+
+    def _command(self, *args):
+        # A dropped connection is retried once on a fresh one
+        for attempt in range(2):
+            try:
+                return self._connection().command(*args)
+            except (ConnectionError, OSError):
+                self._drop_connection()
+                if attempt:
+                    raise
+
+    def get(self, key):
+        value = self._command("GET", self.prefix + key)
+        return None if value is None else json.loads(value)
+
+    def set(self, key, value):
+        self._command("SET", self.prefix + key, json.dumps(value), "EX", int(self.ttl_seconds))
+
+    def delete(self, key):
+        self._command("DEL", self.prefix + key)
+
+    def update(self, key, fn):
+        # Optimistic: WATCH the key, write it in MULTI/EXEC, and start over when another client changed it
+        key = self.prefix + key
+        dropped = False
+        while True:
+            conn = self._connection()
+            try:
+                conn.command("WATCH", key)
+                raw = conn.command("GET", key)
+                try:
+                    value = fn(None if raw is None else json.loads(raw))
+                except BaseException:
+                    conn.command("UNWATCH")
+                    raise
+                if value is None:
+                    conn.command("UNWATCH")
+                    return None
+                conn.command("MULTI")
+                conn.command("SET", key, json.dumps(value), "EX", int(self.ttl_seconds))
+                if conn.command("EXEC") is not None:
+                    return value
+            except (ConnectionError, OSError):
+                # A dropped connection is retried once on a fresh one
+                self._drop_connection()
+                if dropped:
+                    raise
+                dropped = True
+
+
+def create_session_store(url=SESSION_STORE_URL):
+    parsed = urlparse(url)
+    if parsed.scheme == "sqlite":
+        # sqlite:///relative.db or sqlite:////absolute/path.db
+        return SQLiteSessionStore(url[len("sqlite:///"):] or "sessions.db")
+    if parsed.scheme in ("redis", "valkey"):
+        return RedisSessionStore(url)
+    raise ValueError(f"Unsupported SESSION_STORE_URL '{url}', expected sqlite:/// or redis://")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_session_store():
+    """Process-wide store shared by every Streamlit session."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = create_session_store()
+        return _store
@@ -0,0 +1,355 @@
+"""Similar-ticket index: reuse the clarification questions of a near-duplicate email.
+
+Every issue summary extracted by the LLM adds its email to a local TF-IDF
+index. When a new email is close enough to one seen before (cosine similarity
+at or above SIMILAR_TICKET_THRESHOLD), extract_issue_summary reuses the stored
+questions instead of calling the model. During an outage most emails describe
+the same issue, so most of them are answered from here.
+
+Tickets come from other customers, so an entry keeps no text of theirs: only
+the hashed term counts of the email and the questions, without the ones that
+quote an address, link or number. The summary shown is always made from the
+current email. Reuse is off unless SIMILAR_TICKET_INDEX names a file.
+
+Terms are hashed into a fixed feature space, so inserts never refit a
+vocabulary; IDF weights follow the documents indexed so far. The index is kept
+in memory and persisted as an append-only JSONL file (SIMILAR_TICKET_INDEX):
+inserts are appended, a restart replays the file and entries appended by other
+processes are picked up before each search.
+
+Usage:
+    python -m utils.similar_tickets build --input results.jsonl
+    python -m utils.similar_tickets evaluate --input labelled.jsonl --threshold 0.8
+    python -m utils.similar_tickets stats
+"""
+import argparse
+import json
+import os
+import re
+import threading
+import time
+import uuid
+import zlib
+from collections import Counter
+
+import numpy as np
+
+from utils.local_classifier import LOCAL_MODEL_DIR, tokenize
+
+# JSONL file of indexed tickets (empty = reuse disabled), e.g. models/ticket_index.jsonl
+SIMILAR_TICKET_INDEX = os.getenv("SIMILAR_TICKET_INDEX", "")
+SIMILAR_TICKET_THRESHOLD = float(os.getenv("SIMILAR_TICKET_THRESHOLD", "0.8"))
+N_FEATURES = 2 ** 18
+# Questions quoting an email address, a link or a number (order, phone, ticket) are not stored
+IDENTIFYING_RE = re.compile(r"\S+@\S+|https?://|www\.|\d{3,}")
+
+
+class _Buffer:
+    """Growable 1-D NumPy array with amortised O(1) appends."""
+
+    def __init__(self, dtype):
+        self._data = np.zeros(1024, dtype=dtype)
+        self.size = 0
+
+    def extend(self, values):
+        end = self.size + len(values)
+        if end > len(self._data):
+            grown = np.zeros(max(end, 2 * len(self._data)), dtype=self._data.dtype)
+            grown[:self.size] = self._data[:self.size]
+            self._data = grown
+        self._data[self.size:end] = values
+        self.size = end
+
+    def view(self):
+        return self._data[:self.size]
+
+
+def hashed_counts(text, n_features=N_FEATURES):
+    """(sorted feature ids, counts) of the words and bigrams of text."""
+    counts = Counter(zlib.crc32(t.encode("utf-8")) % n_features for t in tokenize(text))
+    idx = np.fromiter(counts.keys(), dtype=np.int32, count=len(counts))
+    values = np.fromiter(counts.values(), dtype=np.int32, count=len(counts))
+    order = np.argsort(idx)
+    return idx[order], values[order]
+
+
+def hashed_terms(text, n_features=N_FEATURES):
+    """(sorted feature ids, sublinear term frequencies) of the words and bigrams of text."""
+    idx, counts = hashed_counts(text, n_features)
+    return idx, 1 + np.log(counts.astype(np.float32))
+
+
+def shareable_questions(questions):
+    """The questions that can be shown to another customer: strings that quote no identifier."""
+    if not isinstance(questions, list):
+        return []
+    return [q for q in questions if isinstance(q, str) and q.strip() and not IDENTIFYING_RE.search(q)]
+
+
+class SimilarTicketIndex:
+    """Cosine search over TF-IDF vectors of past emails, with incremental inserts.
+
+    The term ids and frequencies of all documents are stored back to back, so a
+    search is a handful of vectorised passes over them (no per-document loop).
+    """
+
+    def __init__(self, path=None, n_features=N_FEATURES):
+        self.path = path
+        self.n_features = n_features
+        self.records = []
+        self.df = np.zeros(n_features, dtype=np.int32)
+        self._terms = _Buffer(np.int32)
+        self._tf = _Buffer(np.float32)
+        self._starts = _Buffer(np.int64)
+        # Document weights and norms for the current IDF; rebuilt after inserts
+        self._weights = None
+        self._norms = None
+        self._query = np.zeros(n_features, dtype=np.float32)
+        self._offset = 0
+        self._lock = threading.RLock()
+        self.lookups = 0
+        self.hits = 0
+        self._sync()
+
+    def __len__(self):
+        return len(self.records)
+
+    # ---- Inserts ----
+    def _index(self, record):
+        idx = np.asarray(record["terms"], dtype=np.int32)
+        counts = np.asarray(record["counts"], dtype=np.float32)
+        if not idx.size or idx.shape != counts.shape or idx.max() >= self.n_features:
+            return
+        self._starts.extend([self._terms.size])
+        self._terms.extend(idx)
+        self._tf.extend(1 + np.log(counts))
+        self.df[idx] += 1
+        self.records.append(record)
+        self._weights = self._norms = None
+
+    def _sync(self):
+        """Index the entries appended to the file since the last read (by any process)."""
+        if not self.path or not os.path.exists(self.path) or os.path.getsize(self.path) <= self._offset:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            data = f.read()
+        # A line still being written by another process is read next time
+        complete = data[:data.rfind(b"\n") + 1]
+        self._offset += len(complete)
+        for line in complete.splitlines():
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            # Entries of the earlier format, which kept the email and summary, are skipped
+            if isinstance(record, dict) and record.get("terms") and record.get("questions"):
+                self._index(record)
+
+    def add(self, email, questions, **fields):
+        """Index an email with its clarification questions; returns the ticket id, or None when nothing is stored.
+
+        Only the hashed term counts of the email and its shareable questions are kept;
+        fields are stored with them (evaluate keeps the incident group this way).
+        """
+        questions = shareable_questions(questions)
+        idx, counts = hashed_counts(email, self.n_features)
+        if not questions or not idx.size:
+            return None
+        record = {"id": uuid.uuid4().hex[:12], "terms": idx.tolist(), "counts": counts.tolist(),
+                  "questions": questions, **fields, "added": time.time()}
+        with self._lock:
+            if not self.path:
+                self._index(record)
+                return record["id"]
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+            # One O_APPEND write per entry, so lines from several processes do not interleave
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+            self._sync()
+        return record["id"]
+
+    # ---- Search ----
+    def _idf(self, terms):
+        return np.log((1 + len(self.records)) / (1 + self.df[terms])).astype(np.float32) + 1
+
+    def _document_vectors(self):
+        if self._weights is None:
+            terms = self._terms.view()
+            self._weights = self._tf.view() * self._idf(terms)
+            self._norms = np.sqrt(np.add.reduceat(self._weights ** 2, self._starts.view()))
+        return self._weights, self._norms
+
+    def search(self, email, k=1):
+        """Up to k (similarity, record) pairs, most similar first."""
+        with self._lock:
+            self._sync()
+            idx, tf = hashed_terms(email, self.n_features)
+            if not self.records or not idx.size:
+                return []
+            weights, norms = self._document_vectors()
+            weight = tf * self._idf(idx)
+            # Dense query vector, reused between searches and cleared afterwards
+            self._query[idx] = weight / np.linalg.norm(weight)
+            scores = np.add.reduceat(self._query[self._terms.view()] * weights, self._starts.view()) / norms
+            self._query[idx] = 0
+            k = min(k, len(scores))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(float(scores[i]), self.records[i]) for i in top]
+
+    def lookup(self, email, threshold=SIMILAR_TICKET_THRESHOLD):
+        """(similarity, record) of the closest ticket when it reaches threshold, otherwise None."""
+        matches = self.search(email, 1)
+        with self._lock:
+            self.lookups += 1
+            if matches and matches[0][0] >= threshold:
+                self.hits += 1
+                return matches[0]
+        return None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "tickets": len(self.records),
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": round(self.hits / self.lookups, 4) if self.lookups else None,
+                "path": self.path,
+            }
+
+
+# ==== Runtime lookup ====
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """Process-wide index over SIMILAR_TICKET_INDEX; None when reuse is disabled."""
+    global _index
+    if not SIMILAR_TICKET_INDEX:
+        return None
+    with _index_lock:
+        if _index is None:
+            _index = SimilarTicketIndex(SIMILAR_TICKET_INDEX)
+        return _index
+
+
+def find_similar(email, threshold=SIMILAR_TICKET_THRESHOLD):
+    """(similarity, record) of a stored near-duplicate of email, or None."""
+    index = get_index()
+    if index is None or not email.strip():
+        return None
+    return index.lookup(email, threshold)
+
+
+def remember(email, result):
+    """Index the questions of a successful LLM issue summary so near-duplicates can reuse them."""
+    index = get_index()
+    if index is None or not isinstance(result, dict) or "error" in result or result.get("source"):
+        return
+    if not email.strip():
+        return
+    index.add(email, result.get("questions"))
+
+
+def index_stats():
+    index = get_index()
+    return index.stats() if index is not None else {"tickets": 0, "enabled": False}
+
+
+# ==== Reports ====
+def load_tickets(path):
+    """(email, summary dict, group) per line of a batch_triage output or labelled JSONL file.
+
+    group is the optional "group"/"incident" label of near-duplicate emails, used for recall.
+    """
+    tickets = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            email = record.get("email_text") or record.get("email")
+            summary = record.get("summary")
+            if email and isinstance(summary, dict) and "error" not in summary:
+                tickets.append((email, summary, record.get("group", record.get("incident"))))
+    return tickets
+
+
+def evaluate(tickets, thresholds):
+    """Replay tickets in order through an empty index, as production would see them.
+
+    A ticket whose group already occurred is a duplicate the index should catch:
+    recall is the share of those that hit, precision the share of hits whose
+    match is from the same group. Misses are inserted, hits are not.
+    """
+    reports = []
+    for threshold in thresholds:
+        index = SimilarTicketIndex()
+        seen_groups = set()
+        hits = correct = duplicates = 0
+        start = time.perf_counter()
+        for email, summary, group in tickets:
+            match = index.lookup(email, threshold)
+            if group is not None and group in seen_groups:
+                duplicates += 1
+            if match is None:
+                index.add(email, summary.get("questions"), group=group)
+            else:
+                hits += 1
+                correct += group is not None and match[1].get("group") == group
+            seen_groups.add(group)
+        elapsed = time.perf_counter() - start
+        labelled = any(group is not None for _, _, group in tickets)
+        reports.append({
+            "threshold": threshold,
+            "tickets": len(tickets),
+            "indexed": len(index),
+            "hits": hits,
+            "hit_rate": round(hits / len(tickets), 4) if tickets else None,
+            "precision": round(correct / hits, 4) if labelled and hits else None,
+            "recall": round(correct / duplicates, 4) if labelled and duplicates else None,
+            "ms_per_lookup": round(elapsed / len(tickets) * 1000, 3) if tickets else None,
+        })
+    return reports
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or evaluate the similar-ticket index.")
+    parser.add_argument("command", choices=["build", "evaluate", "stats"])
+    parser.add_argument("--input", help="JSONL with email_text and summary (e.g. batch_triage output)")
+    parser.add_argument("--index", default=SIMILAR_TICKET_INDEX or os.path.join(LOCAL_MODEL_DIR, "ticket_index.jsonl"))
+    parser.add_argument("--threshold", type=float, nargs="+", default=[SIMILAR_TICKET_THRESHOLD])
+    args = parser.parse_args(argv)
+
+    if args.command == "stats":
+        index = SimilarTicketIndex(args.index)
+        print(json.dumps(index.stats(), indent=2))
+        return
+    if not args.input:
+        parser.error("--input is required")
+    tickets = load_tickets(args.input)
+    if not tickets:
+        parser.error(f"No tickets with a summary found in {args.input}")
+
+    if args.command == "build":
+        # Near-duplicates of tickets already indexed are skipped, as at runtime
+        index = SimilarTicketIndex(args.index)
+        added = 0
+        for email, summary, _ in tickets:
+            if index.lookup(email, args.threshold[0]) is None and index.add(email, summary.get("questions")):
+                added += 1
+        report = {"read": len(tickets), "added": added, **index.stats()}
+    else:
+        report = evaluate(tickets, args.threshold)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
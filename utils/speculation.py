@@ -0,0 +1,88 @@
+import contextvars
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.backend import classify_sentiment, stream_next_question
+from utils.sufficiency import CHAT_SUFFICIENCY, score
+
+# SPECULATIVE CHAT TURNS
+# When an answer is submitted, its sentiment classification and the next
+# question are generated at the same time. If the sentiment ends the chat the
+# question stream is cancelled; otherwise ask_next renders the tokens that have
+# already arrived. With CHAT_SUFFICIENCY=llm the sufficiency judgment runs
+# alongside them too.
+CHAT_SPECULATION = os.getenv("CHAT_SPECULATION", "1") == "1"
+CHAT_WORKERS = int(os.getenv("CHAT_WORKERS", "8"))
+
+_executor = ThreadPoolExecutor(max_workers=CHAT_WORKERS, thread_name_prefix="chat-turn")
+
+
+class SpeculativeTurn:
+    """Sentiment of one answer plus the speculative next question, running concurrently."""
+
+    def __init__(self, answer, context):
+        self.answer = answer
+        # The question is generated against a copy of the session's conversation context (summary
+        # folds, prompt sizes); the chat adopts it only if this turn's question is the one asked
+        self.context = dict(context)
+        if context.get("conversation") is not None:
+            self.context["conversation"] = context["conversation"].copy()
+        self.result = {}
+        self._deltas = queue.Queue()
+        self._cancelled = threading.Event()
+        # Each task runs in a copy of the caller's context, so the rate limiter still sees the chat session
+        self._sentiment = _executor.submit(contextvars.copy_context().run, classify_sentiment, answer)
+        self._question = (_executor.submit(contextvars.copy_context().run, self._generate, self.context)
+                          if CHAT_SPECULATION else None)
+        self._sufficiency = (_executor.submit(contextvars.copy_context().run, score, self.context)
+                             if CHAT_SUFFICIENCY == "llm" else None)
+
+    def _generate(self, context):
+        stream = stream_next_question(context, self.result)
+        try:
+            for delta in stream:
+                if self._cancelled.is_set():
+                    break
+                self._deltas.put(delta)
+        except Exception as e:
+            self.result["error"] = str(e)
+        finally:
+            # Closing the generator closes the HTTP stream if we stopped early
+            stream.close()
+            self._deltas.put(None)
+
+    def sentiment(self):
+        return self._sentiment.result()
+
+    def sufficiency(self):
+        """{"score", ...} of the chat including this answer; the local scorer runs here, on demand."""
+        if self._sufficiency is not None:
+            return self._sufficiency.result()
+        return score(self.context)
+
+    @property
+    def conversation(self):
+        """This turn's copy of the conversation context; complete once question_deltas() is exhausted."""
+        return self.context.get("conversation")
+
+    @property
+    def has_question(self):
+        return self._question is not None and not self._cancelled.is_set()
+
+    def question_deltas(self):
+        """Generator for st.write_stream: tokens already received come out at once."""
+        while True:
+            delta = self._deltas.get()
+            if delta is None:
+                return
+            yield delta
+
+    def cancel(self):
+        self._cancelled.set()
+
+
+def start_turn(answer, context):
+    """context is the generate_next_question context with this answer already filled in."""
+    return SpeculativeTurn(answer, context)
@@ -0,0 +1,213 @@
+"""Information-sufficiency scoring for the clarification chat.
+
+After every answer the chat is scored on how much of the detail the support
+team needs has been collected; once the score reaches CHAT_SUFFICIENCY_THRESHOLD
+(after at least CHAT_MIN_ANSWERS answers) the chat ends and is handed off,
+instead of running to CHAT_MAX_QUESTIONS questions.
+
+Two scorers (CHAT_SUFFICIENCY):
+- "local": share of the questions suggested by extract_issue_summary that a
+  turn has covered with a real answer (the question asked, or the answer given,
+  shares most of the suggested question's content words). No model call.
+- "llm": a structured judgment of the conversation by the model, run while the
+  answer's sentiment is classified.
+"off" keeps the fixed question limit only.
+
+Usage:
+    python -m utils.sufficiency replay [--threshold 0.4 0.6 0.8] [--since 2025-01-01]
+
+replay scores the chat transcripts in the results store with the local scorer
+and reports how many turns each threshold would have saved.
+"""
+import argparse
+import json
+import os
+import re
+import threading
+from collections import Counter
+
+from utils.local_classifier import TOKEN_RE
+
+CHAT_SUFFICIENCY = os.getenv("CHAT_SUFFICIENCY", "local")
+CHAT_SUFFICIENCY_THRESHOLD = float(os.getenv("CHAT_SUFFICIENCY_THRESHOLD", "0.6"))
+# Answers collected before the score may end a chat
+CHAT_MIN_ANSWERS = int(os.getenv("CHAT_MIN_ANSWERS", "2"))
+CHAT_MAX_QUESTIONS = int(os.getenv("CHAT_MAX_QUESTIONS", "10"))
+# Share of a suggested question's content words a turn must contain to cover it
+QUESTION_MATCH = 0.6
+# Words are compared on this many leading characters ("changed" ~ "change", "accounts" ~ "account")
+STEM_LENGTH = 5
+# Questions extract_issue_summary is asked for; used when a ticket has none
+DEFAULT_QUESTIONS = 5
+
+STOPWORDS = set("""
+a about after all also am an and any are as at be been before but by can could did do does doing done for
+from had has have how i if in into is it its me my no not of on or our please so some still such than that
+the their them then there these they this those to too us was we were what when where which while who why
+will with would you your yours yes ok okay thanks thank hi hello
+""".split())
+NON_ANSWER_RE = re.compile(
+    r"^(i\s+)?(don'?t|do not|dont)\s+know|^no\s+idea|^not\s+sure|^idk\b|^dunno\b|^n/?a$|^\?+$"
+    r"|^(i\s+)?(can'?t|cannot)\s+(remember|tell|say)",
+    re.I,
+)
+
+
+def content_words(text):
+    """Stems of the words of text, without stopwords."""
+    return {word[:STEM_LENGTH] for word in TOKEN_RE.findall((text or "").lower())
+            if word not in STOPWORDS and len(word) > 2}
+
+
+def suggested_questions(questions):
+    """Suggested questions as a list of strings (also the older [{"Q1": ...}] shape)."""
+    if isinstance(questions, str):
+        return [questions] if questions.strip() else []
+    if isinstance(questions, dict):
+        questions = list(questions.values())
+    flat = []
+    for question in questions or []:
+        if isinstance(question, dict):
+            flat.extend(str(q) for q in question.values())
+        elif question:
+            flat.append(str(question))
+    return flat
+
+
+def informative(answer):
+    answer = (answer or "").strip()
+    return bool(answer) and not NON_ANSWER_RE.match(answer)
+
+
+def local_score(questions, interactions):
+    """{"score", "covered", "suggested", "source"}: suggested questions covered by an informative turn."""
+    suggested = [words for words in map(content_words, suggested_questions(questions)) if words]
+    turns = [content_words(f"{i['question']} {i['answer']}") for i in interactions if informative(i.get("answer"))]
+    if not suggested:
+        covered = min(len(turns), DEFAULT_QUESTIONS)
+        return {"score": round(covered / DEFAULT_QUESTIONS, 3), "covered": covered,
+                "suggested": 0, "source": "local"}
+    covered = sum(
+        1 for words in suggested
+        if any(len(words & turn) / len(words) >= QUESTION_MATCH for turn in turns)
+    )
+    return {"score": round(covered / len(suggested), 3), "covered": covered,
+            "suggested": len(suggested), "source": "local"}
+
+
+def score(context, mode=CHAT_SUFFICIENCY):
+    """Sufficiency of a generate_next_question context whose last answer is filled in.
+
+    Returns {"score": 0..1, ...}; "llm" falls back to the local score when the
+    model answer is invalid.
+    """
+    interactions = context.get("previous") or []
+    if mode == "llm":
+        # Imported here: the local scorer does not need the model stack
+        from utils.backend import assess_sufficiency
+
+        result = assess_sufficiency(context)
+        if "error" not in result:
+            return {"score": round(min(1.0, max(0.0, result["score"])), 3),
+                    "reasoning": result.get("reasoning"), "source": "llm"}
+    return local_score(context.get("questions"), interactions)
+
+
+def should_stop(state, threshold=CHAT_SUFFICIENCY_THRESHOLD):
+    """Reason to end the chat ("max_questions" / "sufficient") or None."""
+    if state["question_count"] >= CHAT_MAX_QUESTIONS:
+        return "max_questions"
+    answered = sum(1 for i in state["interactions"] if i["answer"])
+    if CHAT_SUFFICIENCY != "off" and answered >= CHAT_MIN_ANSWERS and state.get("sufficiency", 0.0) >= threshold:
+        return "sufficient"
+    return None
+
+
+# ==== Metrics ====
+_chats = Counter()
+_turns = Counter()
+_stats_lock = threading.Lock()
+
+
+def record_chat_end(turns, reason):
+    """Count a finished chat with its answered turns and why it ended (frustration/sufficient/max_questions)."""
+    with _stats_lock:
+        _chats[reason] += 1
+        _turns[reason] += turns
+
+
+def chat_stats():
+    """Chats ended by this process so far, with the average answered turns overall and per reason."""
+    with _stats_lock:
+        chats, turns = dict(_chats), dict(_turns)
+    total = sum(chats.values())
+    return {
+        "mode": CHAT_SUFFICIENCY,
+        "threshold": CHAT_SUFFICIENCY_THRESHOLD,
+        "chats": total,
+        "avg_turns": round(sum(turns.values()) / total, 2) if total else None,
+        "ended_by": {reason: {"chats": n, "avg_turns": round(turns[reason] / n, 2)} for reason, n in chats.items()},
+    }
+
+
+# ==== Replay ====
+def replay(sessions, thresholds, min_answers=CHAT_MIN_ANSWERS):
+    """Turns each threshold would have used on (suggested questions, transcript) pairs, local scorer."""
+    reports = []
+    for threshold in thresholds:
+        used = stopped = 0
+        for questions, turns in sessions:
+            length = len(turns)
+            for k in range(min_answers, len(turns) + 1):
+                if local_score(questions, turns[:k])["score"] >= threshold:
+                    length = k
+                    break
+            used += length
+            stopped += length < len(turns)
+        actual = sum(len(turns) for _, turns in sessions)
+        reports.append({
+            "threshold": threshold,
+            "sessions": len(sessions),
+            "avg_turns_actual": round(actual / len(sessions), 2),
+            "avg_turns": round(used / len(sessions), 2),
+            "turns_saved": round(1 - used / actual, 4) if actual else None,
+            "stopped_early": round(stopped / len(sessions), 4),
+        })
+    return reports
+
+
+def load_sessions(store, limit=1000, **filters):
+    """(suggested questions, transcript) of the newest chat sessions in the results store."""
+    sessions = []
+    for ticket in store.query_tickets(limit=limit, full=True, **filters):
+        if not ticket["session_id"]:
+            continue
+        turns = store.transcript(ticket["session_id"])
+        if not turns:
+            continue
+        result = json.loads(ticket["result"] or "{}")
+        sessions.append(((result.get("summary") or {}).get("questions"), turns))
+    return sessions
+
+
+def main(argv=None):
+    from utils.results_store import get_results_store
+
+    parser = argparse.ArgumentParser(description="Replay chat transcripts through the sufficiency scorer.")
+    parser.add_argument("command", choices=["replay"])
+    parser.add_argument("--threshold", type=float, nargs="+", default=[CHAT_SUFFICIENCY_THRESHOLD])
+    parser.add_argument("--since", help="ISO date/time (UTC)")
+    parser.add_argument("--limit", type=int, default=1000, help="Newest chat sessions to replay")
+    args = parser.parse_args(argv)
+
+    store = get_results_store()
+    if store is None:
+        parser.error("The results store is disabled (RESULTS_DB is empty)")
+    sessions = load_sessions(store, args.limit, since=args.since)
+    if not sessions:
+        parser.error("No chat transcripts in the results store")
+    print(json.dumps(replay(sessions, args.threshold), indent=2))
+
+
+if __name__ == "__main__":
+    main()
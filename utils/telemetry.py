@@ -0,0 +1,459 @@
+import asyncio
+import collections
+import functools
+import inspect
+import json
+import math
+import os
+import sys
+import threading
+import time
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils.providers import add_usage_listener, add_retry_listener
+from utils.rate_limiter import add_wait_listener, rate_limiter
+
+# TELEMETRY
+# Every backend function and chat graph node runs inside a span that records
+# wall time, prompt/completion tokens, cost, cache status, retries and errors.
+# Finished spans are aggregated per task and handed to the configured exporters
+# (structured JSON log lines, an OpenMetrics file or an OpenMetrics HTTP endpoint).
+TELEMETRY_ENABLED = os.getenv("TELEMETRY_ENABLED", "1") == "1"
+TELEMETRY_WINDOW = int(os.getenv("TELEMETRY_WINDOW", "1000"))
+TELEMETRY_JSON_LOG = os.getenv("TELEMETRY_JSON_LOG", "")
+TELEMETRY_METRICS_FILE = os.getenv("TELEMETRY_METRICS_FILE", "")
+TELEMETRY_METRICS_PORT = int(os.getenv("TELEMETRY_METRICS_PORT", "0"))
+TELEMETRY_FLUSH_INTERVAL = float(os.getenv("TELEMETRY_FLUSH_INTERVAL", "15"))
+
+# USD per 1M (prompt, completion) tokens; LLM_PRICES='{"model": [in, out]}' adds or overrides
+MODEL_PRICES = {
+    "gpt-3.5-turbo": (0.50, 1.50),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "amazon.nova-micro-v1:0": (0.035, 0.14),
+    "amazon.nova-lite-v1:0": (0.06, 0.24),
+    "amazon.nova-pro-v1:0": (0.80, 3.20),
+}
+MODEL_PRICES.update({model: tuple(price) for model, price in json.loads(os.getenv("LLM_PRICES", "{}")).items()})
+
+
+def call_cost(model, prompt_tokens, completion_tokens):
+    price_in, price_out = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * price_in + completion_tokens * price_out) / 1_000_000
+
+
+class Span:
+    """One instrumented call. Fields are filled in while it runs and frozen by finish()."""
+
+    def __init__(self, name, kind):
+        self.name = name
+        self.kind = kind
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self.duration = None
+        self.model = None
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+        self.cache = None      # "hit", "miss", "local" or "similar" (answered without a model call); "degraded" (default answer)
+        self.retries = 0
+        self.queue_wait = 0.0  # seconds spent waiting for the rate limiter
+        self.error = None
+
+    def add_usage(self, model, usage):
+        prompt_tokens = usage.get("prompt_tokens") or 0
+        completion_tokens = usage.get("completion_tokens") or 0
+        self.model = model
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.cost += call_cost(model, prompt_tokens, completion_tokens)
+
+    def finish(self, error=None):
+        self.duration = time.perf_counter() - self._start
+        if error is not None and self.error is None:
+            self.error = error
+        return self
+
+    def to_dict(self):
+        return {
+            "ts": round(self.started, 3),
+            "kind": self.kind,
+            "task": self.name,
+            "duration_ms": round(self.duration * 1000, 2),
+            "model": self.model,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cost_usd": round(self.cost, 8),
+            "cache": self.cache,
+            "retries": self.retries,
+            "queue_wait_ms": round(self.queue_wait * 1000, 2),
+            "error": self.error,
+        }
+
+
+class _TaskStats:
+    def __init__(self, window):
+        self.count = 0
+        self.errors = 0
+        self.retries = 0
+        self.seconds = 0.0
+        self.queue_wait = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+        self.cache = collections.Counter()
+        self.durations = collections.deque(maxlen=window)
+
+    def add(self, span):
+        self.count += 1
+        self.errors += span.error is not None
+        self.retries += span.retries
+        self.seconds += span.duration
+        self.queue_wait += span.queue_wait
+        self.prompt_tokens += span.prompt_tokens
+        self.completion_tokens += span.completion_tokens
+        self.cost += span.cost
+        if span.cache:
+            self.cache[span.cache] += 1
+        self.durations.append(span.duration)
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a list of numbers (q between 0 and 1)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+class Telemetry:
+    """Process-wide span collector: cumulative counters per task plus a window of recent spans."""
+
+    def __init__(self, window=TELEMETRY_WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._recent = collections.deque(maxlen=window)
+        self._exporters = []
+
+    def add_exporter(self, exporter):
+        self._exporters.append(exporter)
+
+    def remove_exporter(self, exporter):
+        if exporter in self._exporters:
+            self._exporters.remove(exporter)
+
+    def record(self, span):
+        with self._lock:
+            stats = self._stats.get((span.kind, span.name))
+            if stats is None:
+                stats = self._stats[(span.kind, span.name)] = _TaskStats(self.window)
+            stats.add(span)
+            self._recent.append(span.to_dict())
+        for exporter in list(self._exporters):
+            try:
+                exporter.export(span)
+            except Exception as e:
+                # A broken exporter must not break the call that is being measured
+                print(f"telemetry exporter {type(exporter).__name__} failed: {e}", file=sys.stderr)
+
+    def summary(self):
+        """One row per (kind, task) with call counts, latency percentiles, tokens and cost."""
+        with self._lock:
+            items = [(key, stats, list(stats.durations)) for key, stats in self._stats.items()]
+        rows = []
+        for (kind, name), stats, durations in sorted(items, key=lambda item: item[0]):
+            lookups = stats.cache["hit"] + stats.cache["miss"]
+            rows.append({
+                "kind": kind,
+                "task": name,
+                "calls": stats.count,
+                "errors": stats.errors,
+                "retries": stats.retries,
+                "p50_ms": round(percentile(durations, 0.50) * 1000, 1),
+                "p95_ms": round(percentile(durations, 0.95) * 1000, 1),
+                "prompt_tokens": stats.prompt_tokens,
+                "completion_tokens": stats.completion_tokens,
+                "cost_usd": round(stats.cost, 6),
+                "mean_queue_ms": round(stats.queue_wait / stats.count * 1000, 1),
+                "cache_hit_rate": round(stats.cache["hit"] / lookups, 3) if lookups else None,
+                "local_answers": stats.cache["local"],
+                "similar_answers": stats.cache["similar"],
+            })
+        return rows
+
+    def recent(self, limit=None):
+        with self._lock:
+            records = list(self._recent)
+        return records[-limit:] if limit else records
+
+    def openmetrics(self):
+        """All counters and latency quantiles in OpenMetrics text format."""
+        with self._lock:
+            items = [(key, stats, list(stats.durations), dict(stats.cache)) for key, stats in self._stats.items()]
+        items.sort(key=lambda item: item[0])
+        lines = []
+
+        def family(name, metric_type, help_text, unit=None):
+            lines.append(f"# TYPE {name} {metric_type}")
+            if unit:
+                lines.append(f"# UNIT {name} {unit}")
+            lines.append(f"# HELP {name} {help_text}")
+
+        def labels(kind, task, **extra):
+            pairs = {"kind": kind, "task": task, **extra}
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs.items()) + "}"
+
+        family("triage_call_duration_seconds", "summary", "Wall time of instrumented calls", "seconds")
+        for (kind, task), stats, durations, _ in items:
+            for q in (0.5, 0.95):
+                lines.append(f"triage_call_duration_seconds{labels(kind, task, quantile=q)} {percentile(durations, q):.6f}")
+            lines.append(f"triage_call_duration_seconds_count{labels(kind, task)} {stats.count}")
+            lines.append(f"triage_call_duration_seconds_sum{labels(kind, task)} {stats.seconds:.6f}")
+
+        family("triage_tokens", "counter", "Model tokens used")
+        for (kind, task), stats, _, _ in items:
+            lines.append(f"triage_tokens_total{labels(kind, task, type='prompt')} {stats.prompt_tokens}")
+            lines.append(f"triage_tokens_total{labels(kind, task, type='completion')} {stats.completion_tokens}")
+
+        family("triage_cost_usd", "counter", "Estimated model cost in USD")
+        for (kind, task), stats, _, _ in items:
+            lines.append(f"triage_cost_usd_total{labels(kind, task)} {stats.cost:.8f}")
+
+        family("triage_cache_lookups", "counter", "Cache status of model calls")
+        for (kind, task), _, _, cache in items:
+            for status, count in sorted(cache.items()):
+                lines.append(f"triage_cache_lookups_total{labels(kind, task, status=status)} {count}")
+
+        family("triage_queue_wait_seconds", "counter", "Time spent waiting for the rate limiter", "seconds")
+        for (kind, task), stats, _, _ in items:
+            lines.append(f"triage_queue_wait_seconds_total{labels(kind, task)} {stats.queue_wait:.6f}")
+
+        family("triage_retries", "counter", "Retried model requests")
+        for (kind, task), stats, _, _ in items:
+            lines.append(f"triage_retries_total{labels(kind, task)} {stats.retries}")
+
+        family("triage_errors", "counter", "Calls that raised or returned an error")
+        for (kind, task), stats, _, _ in items:
+            lines.append(f"triage_errors_total{labels(kind, task)} {stats.errors}")
+
+        if rate_limiter.enabled:
+            limiter = rate_limiter.stats()
+            family("triage_llm_queue_depth", "gauge", "Model requests waiting for the rate limiter")
+            for row in limiter["priorities"]:
+                lines.append(f'triage_llm_queue_depth{{priority="{row["priority"]}"}} {row["queued"]}')
+
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self._recent.clear()
+
+
+telemetry = Telemetry()
+_current_span = ContextVar("telemetry_span", default=None)
+
+
+# ==== Exporters ====
+# Anything with an export(span) method can be added with telemetry.add_exporter().
+class JsonLogExporter:
+    """One JSON object per finished span, appended to a file ("-" for stderr)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        line = json.dumps(span.to_dict()) + "\n"
+        with self._lock:
+            if self.path == "-":
+                sys.stderr.write(line)
+            else:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line)
+
+
+class OpenMetricsFileExporter:
+    """Rewrites an OpenMetrics text file (e.g. for the node_exporter textfile collector) at most every interval seconds."""
+
+    def __init__(self, path, interval=TELEMETRY_FLUSH_INTERVAL, source=telemetry):
+        self.path = path
+        self.interval = interval
+        self.source = source
+        self._last = 0.0
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        with self._lock:
+            if time.monotonic() - self._last < self.interval:
+                return
+            self._last = time.monotonic()
+        self.flush()
+
+    def flush(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.source.openmetrics())
+        os.replace(tmp_path, self.path)
+
+
+_metrics_server = None
+
+
+def start_metrics_server(port, source=telemetry):
+    """Serve /metrics in OpenMetrics format from a daemon thread (once per process)."""
+    global _metrics_server
+    if _metrics_server is not None:
+        return _metrics_server
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = source.openmetrics().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/openmetrics-text; version=1.0.0; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    _metrics_server = ThreadingHTTPServer(("", port), Handler)
+    threading.Thread(target=_metrics_server.serve_forever, name="metrics", daemon=True).start()
+    return _metrics_server
+
+
+# ==== Instrumentation ====
+def current_span():
+    return _current_span.get()
+
+
+def annotate(**fields):
+    """Set fields (cache, error, ...) on the span of the call that is running, if any."""
+    span = _current_span.get()
+    if span is not None:
+        for name, value in fields.items():
+            setattr(span, name, value)
+
+
+def _result_error(result):
+    # Backend functions report failures as {"error": ...} dicts instead of raising
+    if isinstance(result, dict) and result.get("error"):
+        return str(result["error"])
+    return None
+
+
+def _on_usage(provider, usage):
+    span = _current_span.get()
+    if span is not None:
+        span.add_usage(provider.model, usage)
+
+
+def _on_retry(provider, error):
+    span = _current_span.get()
+    if span is not None:
+        span.retries += 1
+
+
+def _on_wait(seconds):
+    span = _current_span.get()
+    if span is not None:
+        span.queue_wait += seconds
+
+
+def instrument(name=None, kind="backend"):
+    """Decorator running a function (sync, async or generator) inside a telemetry span.
+
+    Model calls inside the span add their token usage and retries to it; the
+    innermost span gets them, so nested spans do not count tokens twice.
+    """
+    def decorator(fn):
+        task = name or fn.__name__
+        if not TELEMETRY_ENABLED:
+            return fn
+
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def gen_wrapper(*args, **kwargs):
+                # The span is made current only while the generator runs, since it may be
+                # consumed from another thread or stopped early
+                span = Span(task, kind)
+                gen = fn(*args, **kwargs)
+                error = None
+                try:
+                    while True:
+                        token = _current_span.set(span)
+                        try:
+                            item = next(gen)
+                        except StopIteration:
+                            return
+                        finally:
+                            _current_span.reset(token)
+                        yield item
+                except GeneratorExit:
+                    gen.close()
+                    raise
+                except Exception as e:
+                    error = f"{type(e).__name__}: {e}"
+                    raise
+                finally:
+                    telemetry.record(span.finish(error))
+            return gen_wrapper
+
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                span = Span(task, kind)
+                token = _current_span.set(span)
+                error = None
+                try:
+                    result = await fn(*args, **kwargs)
+                    error = _result_error(result)
+                    return result
+                except BaseException as e:
+                    error = "cancelled" if isinstance(e, asyncio.CancelledError) else f"{type(e).__name__}: {e}"
+                    raise
+                finally:
+                    _current_span.reset(token)
+                    telemetry.record(span.finish(error))
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            span = Span(task, kind)
+            token = _current_span.set(span)
+            error = None
+            try:
+                result = fn(*args, **kwargs)
+                error = _result_error(result)
+                return result
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                raise
+            finally:
+                _current_span.reset(token)
+                telemetry.record(span.finish(error))
+        return wrapper
+
+    return decorator
+
+
+def configure_from_env():
+    if TELEMETRY_JSON_LOG:
+        telemetry.add_exporter(JsonLogExporter(TELEMETRY_JSON_LOG))
+    if TELEMETRY_METRICS_FILE:
+        telemetry.add_exporter(OpenMetricsFileExporter(TELEMETRY_METRICS_FILE))
+    if TELEMETRY_METRICS_PORT:
+        start_metrics_server(TELEMETRY_METRICS_PORT)
+
+
+add_usage_listener(_on_usage)
+add_retry_listener(_on_retry)
+add_wait_listener(_on_wait)
+configure_from_env()